@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=['webrtcvad', 'pydub', 'simpleaudio', 'numpy', 'dearpygui'],
+    hiddenimports=['webrtcvad', 'pydub', 'sounddevice', 'numpy', 'dearpygui'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
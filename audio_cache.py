@@ -0,0 +1,287 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from audio_sources import FilePcmSource
+from vad_engine import FrameDecisions
+from waveform import PeakPyramid
+
+# Bump when the layout of cache entries changes, older entries are then ignored
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+HASH_CHUNK_BYTES = 1 << 20
+
+# Several files of a project load at once. The path index is read, changed and
+# written under this lock. The writes in progress per entry are tracked under it
+# too, and eviction checks and deletes an entry under it, so an entry is never
+# deleted while something is being written into it.
+_index_lock = threading.Lock()
+_writing = {}  # key: the writes in progress into that entry
+
+
+def _begin_write(key, token):
+    with _index_lock:
+        _writing.setdefault(key, []).append(token)
+
+
+def _end_write(key, token):
+    # Ending a write twice, e.g. abandoning one that was committed, does nothing
+    with _index_lock:
+        tokens = _writing.get(key, [])
+        if token in tokens:
+            tokens.remove(token)
+        if not tokens:
+            _writing.pop(key, None)
+
+
+@contextmanager
+def _writing_into(key):
+    token = object()
+    _begin_write(key, token)
+    try:
+        yield
+    finally:
+        _end_write(key, token)
+
+
+def default_cache_dir():
+    override = os.environ.get("VOICE_BUFFER_CACHE_DIR")
+    if override:
+        return override
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "VoiceBufferSplitter", "cache")
+
+
+def hash_file(path):
+    # Content hash of a file, the key of its cache entry. Needs no cache, e.g. to
+    # check a session's files with caching turned off.
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def params_key(params):
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class AudioCache:
+    # On-disk cache of decoded PCM and VAD decisions, keyed by a hash of the
+    # input file's content. Each entry is a directory:
+    #   meta.json              format of the decoded audio, touched on every use (LRU)
+    #   pcm.raw                decoded PCM, opened memory-mapped
+    #   decisions-<params>.npz per-frame VAD decisions for one set of VAD parameters
+    #   peaks.npz              waveform peak pyramid
+    # The least recently used entries are removed once the cache grows past max_bytes.
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_path = os.path.join(self.directory, "index.json")
+
+    def entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def file_key(self, path):
+        # hash_file() of the file. Hashing a long recording takes a moment, so the
+        # hash is remembered per path and only recomputed when size or mtime change.
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with _index_lock:
+            index = self._read_json(self.index_path) or {}
+        known = index.get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['key']
+
+        key = hash_file(path)
+        with _index_lock:
+            index = self._read_json(self.index_path) or {}
+            index[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'key': key}
+            self._write_json(self.index_path, index)
+        return key
+
+    def load_source(self, key, name=None):
+        # Memory-mapped FilePcmSource for a cached decode, or None
+        meta = self._read_json(os.path.join(self.entry_dir(key), "meta.json"))
+        pcm_path = os.path.join(self.entry_dir(key), "pcm.raw")
+        if not meta or meta.get('version') != CACHE_VERSION or not os.path.exists(pcm_path):
+            return None
+        if os.path.getsize(pcm_path) != meta['frames'] * meta['channels'] * meta['sample_width']:
+            self.invalidate(key)  # Left over from an interrupted write
+            return None
+
+        self._touch(key)
+        try:
+            return FilePcmSource.open(pcm_path, meta['frame_rate'], meta['channels'], meta['sample_width'], name)
+        except OSError:
+            return None  # Evicted by another load just now
+
+    def store_source(self, key, source):
+        # Write a decoded source to the cache, returns it memory-mapped from there
+        writer = self.open_writer(key, source.frame_rate, source.channels, source.sample_width, source.name)
+        try:
+            writer.append(source.data)
+            return self.commit_source(key, writer)
+        except Exception:
+            self.abandon_writer(key, writer)
+            raise
+
+    def open_writer(self, key, frame_rate, channels, sample_width, name=None):
+        # A FilePcmSource writing into the entry, for decodes that arrive in chunks.
+        # Nothing becomes visible to load_source until commit_source(), and closing
+        # it before then deletes the partial file.
+        entry = self.entry_dir(key)
+        token = object()
+        _begin_write(key, token)
+        try:
+            os.makedirs(entry, exist_ok=True)
+            writer = FilePcmSource(frame_rate, channels, sample_width, os.path.join(entry, "pcm.raw.tmp"), name)
+        except BaseException:
+            _end_write(key, token)
+            raise
+        writer.cache_write = token
+        return writer
+
+    def abandon_writer(self, key, writer):
+        # Give up on an entry from open_writer(), deleting what was written
+        writer.close()
+        _end_write(key, writer.cache_write)
+
+    def commit_source(self, key, source):
+        try:
+            source.finish(os.path.join(self.entry_dir(key), "pcm.raw"))
+            meta = {
+                'version': CACHE_VERSION,
+                'frame_rate': source.frame_rate,
+                'channels': source.channels,
+                'sample_width': source.sample_width,
+                'frames': source.frame_count(),
+            }
+            self._write_json(os.path.join(self.entry_dir(key), "meta.json"), meta)
+        finally:
+            _end_write(key, source.cache_write)
+        self.evict(keep=key)
+        return source
+
+    def load_decisions(self, key, params):
+        path = os.path.join(self.entry_dir(key), f"decisions-{params_key(params)}.npz")
+        if not os.path.exists(path):
+            return None
+        try:
+            decisions = FrameDecisions.load(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        self._touch(key)
+        return decisions
+
+    def store_decisions(self, key, params, decisions):
+        with _writing_into(key):
+            os.makedirs(self.entry_dir(key), exist_ok=True)
+            path = os.path.join(self.entry_dir(key), f"decisions-{params_key(params)}.npz")
+            decisions.save(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        self.evict(keep=key)
+
+    def load_peaks(self, key):
+        path = os.path.join(self.entry_dir(key), "peaks.npz")
+        if not os.path.exists(path):
+            return None
+        try:
+            return PeakPyramid.load(path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store_peaks(self, key, peaks):
+        with _writing_into(key):
+            os.makedirs(self.entry_dir(key), exist_ok=True)
+            path = os.path.join(self.entry_dir(key), "peaks.npz")
+            peaks.save(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        self.evict(keep=key)
+
+    def invalidate(self, key):
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def size(self):
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self, keep=None):
+        # Remove least recently used entries until the cache fits in max_bytes
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for key, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            with _index_lock:
+                if key in _writing:
+                    continue
+                self.invalidate(key)
+            if not os.path.exists(self.entry_dir(key)):
+                total -= size  # On Windows an entry that is still mapped can't be deleted
+
+    def _entries(self):
+        # (key, last used, bytes) for every entry. Other loads write, rename and
+        # evict files meanwhile; whatever is gone by the time it is looked at is skipped.
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = self.entry_dir(key)
+            try:
+                names = os.listdir(entry)
+            except OSError:
+                continue  # Not an entry, or evicted since
+            try:
+                last_used = os.path.getmtime(os.path.join(entry, "meta.json"))
+            except OSError:
+                last_used = 0
+            size = 0
+            for name in names:
+                try:
+                    size += os.path.getsize(os.path.join(entry, name))
+                except OSError:
+                    pass
+            entries.append((key, last_used, size))
+        return entries
+
+    def _touch(self, key):
+        meta_path = os.path.join(self.entry_dir(key), "meta.json")
+        now = time.time()
+        try:
+            os.utime(meta_path, (now, now))
+        except OSError:
+            pass  # Not committed yet, or evicted meanwhile
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_json(path, data):
+        # Write next to the target and rename, so readers never see half a file
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+
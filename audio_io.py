@@ -0,0 +1,366 @@
+import math
+import os
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import mediainfo_json
+
+# 10 seconds of 16 kHz mono 16-bit PCM per chunk
+DEFAULT_CHUNK_BYTES = 16000 * 2 * 10
+
+SUPPORTED_EXTENSIONS = ('.m4a', '.mp3', '.wav')
+
+
+def load_audio_file(path):
+    # Decode a whole input file, returns None for formats we don't handle
+    file_ext = os.path.splitext(path)[1].lower()
+    if file_ext == '.m4a':
+        return AudioSegment.from_file(path, format='m4a', codec='aac')
+    elif file_ext == '.mp3':
+        return AudioSegment.from_file(path, format='mp3')
+    elif file_ext == '.wav':
+        return AudioSegment.from_file(path, format='wav')
+    return None
+
+
+def probe_audio_format(path):
+    # (frame_rate, channels, duration in seconds) of the file's first audio
+    # stream, via ffprobe. The duration is 0 when the container doesn't say.
+    info = mediainfo_json(path)
+    stream = next(s for s in info['streams'] if s.get('codec_type') == 'audio')
+    duration = float(info.get('format', {}).get('duration') or stream.get('duration') or 0)
+    return int(stream['sample_rate']), int(stream['channels']), duration
+
+
+def ffmpeg_pcm_chunks(path, sample_rate=16000, channels=1, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    # Decode any file ffmpeg understands to 16-bit PCM and yield it in fixed-size
+    # chunks, so the whole file never has to sit in memory at once
+    cmd = [
+        AudioSegment.converter,
+        '-nostdin',
+        '-v', 'error',
+        '-i', path,
+        '-vn',
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ac', str(channels),
+        '-ar', str(sample_rate),
+        '-',
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            chunk = process.stdout.read(chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+        error_output = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {path}: {error_output.decode(errors='replace').strip()}")
+    finally:
+        # Stop ffmpeg if the consumer gave up early
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+# Default output format of the processed files
+OUTPUT_FRAME_RATE = 44100
+OUTPUT_CHANNELS = 2
+
+# Sample rates offered for the output
+OUTPUT_FRAME_RATES = (16000, 22050, 24000, 32000, 44100, 48000)
+
+# encoding -> (file extension, ffmpeg muxer, ffmpeg encoder arguments). WAV is
+# written by Python itself; everything else is encoded by ffmpeg, fed 16-bit PCM
+# through a pipe.
+OUTPUT_ENCODINGS = {
+    'wav': ('.wav', 'wav', ['-c:a', 'pcm_s16le']),
+    'flac': ('.flac', 'flac', ['-c:a', 'flac']),
+    'mp3': ('.mp3', 'mp3', ['-c:a', 'libmp3lame', '-q:a', '4']),
+    'opus': ('.opus', 'ogg', ['-c:a', 'libopus', '-application', 'voip']),
+}
+# libopus only encodes at these rates, other rates are raised to the next one
+OPUS_FRAME_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_KBPS_PER_CHANNEL = 32
+
+# Input frames converted per step when writing, about 1.5 s at 44.1 kHz
+WRITE_CHUNK_FRAMES = 65536
+
+# Silence is written from one shared block of zeros, this long
+ZERO_BLOCK_BYTES = WRITE_CHUNK_FRAMES * 4
+_zero_block = memoryview(bytes(ZERO_BLOCK_BYTES))
+
+# Resampling filter: Kaiser-windowed sinc with this many zero crossings per side
+RESAMPLE_ZERO_CROSSINGS = 16
+RESAMPLE_KAISER_BETA = 8.6
+RESAMPLE_CUTOFF = 0.95
+# Ratios that would need more filter phases than this are left to ffmpeg
+MAX_RESAMPLE_PHASES = 2048
+
+
+class Resampler:
+    # Streaming polyphase resampler. Input and output are float32 arrays shaped
+    # (channels, frames). Every block of `down` input frames becomes `up` output
+    # frames, computed as one matrix product of the overlapping input windows
+    # (a strided view, no copy) with a precomputed polyphase filter matrix.
+
+    def __init__(self, in_rate, out_rate, channels):
+        divisor = math.gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.channels = channels
+
+        cutoff = RESAMPLE_CUTOFF * min(1.0, self.up / self.down)
+        self.half_width = int(math.ceil(RESAMPLE_ZERO_CROSSINGS / cutoff))
+        self.window = self.down + 2 * self.half_width - 1
+
+        # Output phase p sits at input position p * down / up within its block and
+        # uses the inputs from half_width - 1 before to half_width after it
+        phases = np.arange(self.up)
+        position = phases * self.down / self.up
+        base = np.floor(position).astype(int)
+        taps = np.arange(-(self.half_width - 1), self.half_width + 1)
+        distance = taps[None, :] - (position - base)[:, None]
+        weights = cutoff * np.sinc(cutoff * distance)
+        weights *= np.i0(RESAMPLE_KAISER_BETA * np.sqrt(np.clip(1 - (distance / self.half_width) ** 2, 0, None)))
+        weights /= weights.sum(axis=1, keepdims=True)  # Unity gain at DC for every phase
+
+        self.matrix = np.zeros((self.window, self.up), dtype=np.float32)
+        rows = base[:, None] + taps[None, :] + self.half_width - 1
+        self.matrix[rows, phases[:, None]] = weights
+
+        # pending[:, 0] is input frame next_block * down - (half_width - 1), the
+        # zeros stand in for the audio before the start
+        self.pending = np.zeros((channels, self.half_width - 1), dtype=np.float32)
+        self.frames_in = 0
+        self.frames_out = 0
+
+    @staticmethod
+    def supported(in_rate, out_rate):
+        return out_rate // math.gcd(in_rate, out_rate) <= MAX_RESAMPLE_PHASES
+
+    def process(self, samples):
+        self.frames_in += samples.shape[1]
+        self.pending = np.concatenate((self.pending, samples), axis=1)
+        return self._run()
+
+    def process_silence(self, frames):
+        # Like process() with frames of silence, returns (output, frames of silence
+        # that follow it). Only the first window of silence is filtered, where
+        # the audio before it still rings out; after that every output frame is
+        # zero, so they are only counted.
+        head = min(frames, self.window)
+        output = self.process(np.zeros((self.channels, head), dtype=np.float32))
+        rest = frames - head
+        if rest == 0:
+            return output, 0
+        # pending is all zeros now, rest only moves the blocks along
+        self.frames_in += rest
+        length = self.pending.shape[1] + rest
+        blocks = max(0, (length - self.window) // self.down + 1)
+        self.pending = np.zeros((self.channels, length - blocks * self.down), dtype=np.float32)
+        self.frames_out += blocks * self.up
+        return output, blocks * self.up
+
+    def flush(self):
+        # Pad with silence so the last blocks can be computed, then cut the output
+        # to exactly ceil(frames_in * up / down) frames
+        self.pending = np.concatenate(
+            (self.pending, np.zeros((self.channels, self.window), dtype=np.float32)), axis=1)
+        output = self._run()
+        expected = -(-self.frames_in * self.up // self.down)
+        return output[:, :max(0, expected - (self.frames_out - output.shape[1]))]
+
+    def _run(self):
+        blocks = (self.pending.shape[1] - self.window) // self.down + 1
+        if blocks <= 0:
+            return np.zeros((self.channels, 0), dtype=np.float32)
+
+        output = np.empty((self.channels, blocks * self.up), dtype=np.float32)
+        for channel in range(self.channels):
+            windows = np.lib.stride_tricks.sliding_window_view(self.pending[channel], self.window)[::self.down][:blocks]
+            output[channel] = (windows @ self.matrix).ravel()
+        self.pending = self.pending[:, blocks * self.down:]
+        self.frames_out += output.shape[1]
+        return output
+
+
+def pcm_to_float(data, sample_width, channels):
+    # Interleaved signed PCM bytes -> float32 (channels, frames) in [-1, 1)
+    dtype = {1: np.int8, 2: '<i2', 4: '<i4'}[sample_width]
+    samples = np.frombuffer(data, dtype=dtype).reshape(-1, channels).T
+    return samples.astype(np.float32) / float(1 << (8 * sample_width - 1))
+
+
+def match_channels(samples, channels):
+    if samples.shape[0] == channels:
+        return samples
+    if samples.shape[0] > 1:
+        samples = samples.mean(axis=0, keepdims=True)
+    return np.repeat(samples, channels, axis=0)
+
+
+def float_to_pcm16(samples):
+    # float32 (channels, frames) -> interleaved 16-bit little-endian bytes
+    return np.clip(np.rint(samples.T * 32768.0), -32768, 32767).astype('<i2').tobytes()
+
+
+def output_frame_rate(encoding, frame_rate):
+    # The rate an output is actually written at
+    if encoding == 'opus' and frame_rate not in OPUS_FRAME_RATES:
+        return next((rate for rate in OPUS_FRAME_RATES if rate >= frame_rate), OPUS_FRAME_RATES[-1])
+    return frame_rate
+
+
+def ffmpeg_encoder(path, encoding, in_rate, frame_rate, channels):
+    # ffmpeg reading 16-bit PCM at in_rate from its stdin and writing it to path
+    # encoded. Errors go to a temporary file, so output on stderr can never fill
+    # a pipe and stall the encoder.
+    _, muxer, arguments = OUTPUT_ENCODINGS[encoding]
+    if encoding == 'opus':
+        arguments = arguments + ['-b:a', f'{OPUS_KBPS_PER_CHANNEL * channels}k']
+    cmd = [
+        AudioSegment.converter,
+        '-v', 'error',
+        '-y',
+        '-f', 's16le',
+        '-ar', str(in_rate),
+        '-ac', str(channels),
+        '-i', 'pipe:0',
+    ] + arguments + [
+        '-ar', str(frame_rate),
+        '-f', muxer,
+        path,
+    ]
+    errors = tempfile.TemporaryFile()
+    try:
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errors), errors
+    except BaseException:
+        errors.close()
+        raise
+
+
+class OutputWriter:
+    # Writes PCM chunks of one format to an output file of another. Each chunk is
+    # converted to the output channels and rate in NumPy as it arrives, then goes
+    # straight into a WAV file, or into an ffmpeg pipe for the other encodings;
+    # ffmpeg then encodes in a process of its own while the next chunks are
+    # produced. close() completes the file, abort() gives up on it.
+
+    def __init__(self, path, in_rate, in_channels, in_width, encoding='wav',
+                 frame_rate=OUTPUT_FRAME_RATE, channels=OUTPUT_CHANNELS):
+        self.path = path
+        self.in_channels = in_channels
+        self.in_width = in_width
+        self.channels = channels
+        self.frame_rate = output_frame_rate(encoding, frame_rate)
+        self.resampler = None
+        self.wav_file = None
+        self.process = None
+        self.errors = None
+
+        pipe_rate = self.frame_rate
+        if in_rate != self.frame_rate:
+            if Resampler.supported(in_rate, self.frame_rate):
+                self.resampler = Resampler(in_rate, self.frame_rate, channels)
+            else:
+                pipe_rate = in_rate  # Ratios our resampler can't handle are left to ffmpeg
+        if encoding == 'wav' and pipe_rate == self.frame_rate:
+            self.wav_file = wave.open(path, 'wb')
+            self.wav_file.setnchannels(channels)
+            self.wav_file.setsampwidth(2)
+            self.wav_file.setframerate(self.frame_rate)
+        else:
+            self.process, self.errors = ffmpeg_encoder(path, encoding, pipe_rate, self.frame_rate, channels)
+
+    def write(self, data):
+        # Convert and write one chunk, returns the number of bytes it became
+        if self.resampler is None and self.in_width == 2 and self.in_channels == self.channels:
+            pcm = data  # Already in the output format
+        else:
+            samples = match_channels(pcm_to_float(data, self.in_width, self.in_channels), self.channels)
+            if self.resampler is not None:
+                samples = self.resampler.process(samples)
+            pcm = float_to_pcm16(samples)
+        self._write(pcm)
+        return len(pcm)
+
+    def write_silence(self, frames):
+        # Write frames of silence, counted at the input rate, returns the number of
+        # bytes they became. Nothing is converted or allocated for it: the output
+        # is sliced from the shared zero block, only the resampler's ringing
+        # into the silence is computed.
+        written = 0
+        if self.resampler is not None:
+            output, frames = self.resampler.process_silence(frames)
+            pcm = float_to_pcm16(output)
+            self._write(pcm)
+            written += len(pcm)
+        size = frames * self.channels * 2
+        step = ZERO_BLOCK_BYTES - ZERO_BLOCK_BYTES % (self.channels * 2)
+        for offset in range(0, size, step):
+            self._write(_zero_block[:min(step, size - offset)])
+        return written + size
+
+    def close(self):
+        # Finish the file, returns the number of bytes the end of the resampling became
+        written = 0
+        if self.resampler is not None:
+            pcm = float_to_pcm16(self.resampler.flush())
+            self._write(pcm)
+            written = len(pcm)
+        if self.wav_file is not None:
+            self.wav_file.close()
+            self.wav_file = None
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass  # ffmpeg quit early, its exit status says so
+            failed = self.process.wait() != 0
+            message = self._error_output()
+            self.process = None
+            if failed:
+                raise RuntimeError(f"ffmpeg failed to encode {self.path}: {message}")
+        return written
+
+    def abort(self):
+        # Stop writing, the caller deletes what was written
+        if self.wav_file is not None:
+            self.wav_file.close()
+            self.wav_file = None
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+            self._error_output()
+            self.process = None
+
+    def _write(self, pcm):
+        if self.wav_file is not None:
+            self.wav_file.writeframes(pcm)
+            return
+        try:
+            self.process.stdin.write(pcm)
+        except BrokenPipeError:
+            # ffmpeg quit, its own message says why
+            self.process.wait()
+            raise RuntimeError(f"ffmpeg failed to encode {self.path}: {self._error_output()}")
+
+    def _error_output(self):
+        if self.errors is None:
+            return ""
+        self.errors.seek(0)
+        message = self.errors.read().decode(errors='replace').strip()
+        self.errors.close()
+        self.errors = None
+        return message
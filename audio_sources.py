@@ -0,0 +1,317 @@
+import itertools
+import os
+import tempfile
+import threading
+
+import numpy as np
+from pydub import AudioSegment
+
+
+class PcmSource:
+    # Decoded audio of one input file, at the quality of the file. Buffers only
+    # hold references into it, so this is the single copy of the audio in memory.
+    # While a file is still being streamed in, data is a bytearray that grows.
+
+    def __init__(self, frame_rate, channels, sample_width, data=None, name=None):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_width = channels * sample_width
+        self.data = bytearray() if data is None else data
+        self.name = name
+
+    @classmethod
+    def from_segment(cls, segment, name=None):
+        return cls(segment.frame_rate, segment.channels, segment.sample_width, segment.raw_data, name)
+
+    def append(self, pcm):
+        self.data += pcm
+
+    def frame_count(self):
+        return len(self.data) // self.frame_width
+
+    def __len__(self):
+        # Duration in ms, rounded like len(AudioSegment)
+        return round(1000 * (self.frame_count() / self.frame_rate))
+
+    def frame_range(self, start_ms, end_ms):
+        # Same ms -> frame mapping as slicing an AudioSegment
+        duration = len(self)
+        first = int(min(start_ms, duration) * (self.frame_rate / 1000.0))
+        stop = int(min(end_ms, duration) * (self.frame_rate / 1000.0))
+        return first, max(first, stop)
+
+    def pcm(self, first, stop):
+        # Raw bytes of frames [first, stop). Finished sources hand out a view
+        # without copying; a growing bytearray can't be pinned, so it is copied.
+        if isinstance(self.data, bytearray):
+            data = self.data[first * self.frame_width:stop * self.frame_width]
+        else:
+            data = memoryview(self.data)[first * self.frame_width:stop * self.frame_width]
+        return self._pad(data, first, stop)
+
+    def _pad(self, data, first, stop):
+        missing = (stop - first) * self.frame_width - len(data)
+        if missing > 0:
+            # Rounding at the very end can ask for a frame or two more than exists
+            data = bytes(data) + b'\0' * missing
+        return data
+
+    def close(self):
+        pass
+
+
+class FilePcmSource(PcmSource):
+    # Decoded audio kept in a raw PCM file instead of on the Python heap. Chunks
+    # are appended to the file while decoding and read back through it; finish()
+    # then maps the file with np.memmap, so buffers, playback and export slice
+    # their samples straight out of the mapping. Without a path the file is a
+    # scratch file that is deleted again on close().
+
+    def __init__(self, frame_rate, channels, sample_width, path=None, name=None):
+        super().__init__(frame_rate, channels, sample_width, b'', name)
+        self.scratch = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='voicebuffer-', suffix='.pcm')
+            os.close(fd)
+        self.path = path
+        self.file = open(path, 'w+b')
+        self.bytes_written = 0
+        self.lock = threading.Lock()  # Decoding appends on a worker thread while the GUI plays
+
+    @classmethod
+    def open(cls, path, frame_rate, channels, sample_width, name=None):
+        # Map an existing raw PCM file, e.g. from the cache
+        source = cls.__new__(cls)
+        PcmSource.__init__(source, frame_rate, channels, sample_width, b'', name)
+        source.scratch = False
+        source.path = path
+        source.file = None
+        source.bytes_written = os.path.getsize(path)
+        source.lock = threading.Lock()
+        source._map()
+        return source
+
+    @classmethod
+    def from_segment(cls, segment, path=None, name=None):
+        source = cls(segment.frame_rate, segment.channels, segment.sample_width, path, name)
+        source.append(segment.raw_data)
+        source.finish()
+        return source
+
+    def append(self, pcm):
+        with self.lock:
+            if self.file is None:
+                return  # Closed because another file was loaded meanwhile
+            self.file.seek(0, os.SEEK_END)
+            self.file.write(pcm)
+            self.bytes_written += len(pcm)
+
+    def frame_count(self):
+        return self.bytes_written // self.frame_width
+
+    def pcm(self, first, stop):
+        with self.lock:
+            if self.file is not None:
+                # Still being written, read through the file
+                self.file.flush()
+                self.file.seek(first * self.frame_width)
+                return self._pad(self.file.read((stop - first) * self.frame_width), first, stop)
+        return super().pcm(first, stop)
+
+    def finish(self, path=None):
+        # Done writing: map the file, after moving it to path if one is given
+        with self.lock:
+            self.file.close()
+            self.file = None
+            if path is not None:
+                os.replace(self.path, path)
+                self.path = path
+                self.scratch = False
+            self._map()
+
+    def _map(self):
+        # np.memmap can't map an empty file
+        self.data = np.memmap(self.path, dtype=np.uint8, mode='r') if self.bytes_written else b''
+
+    def close(self):
+        # Scratch files and files that were never finished are deleted
+        with self.lock:
+            unfinished = self.file is not None
+            if unfinished:
+                self.file.close()
+                self.file = None
+            self.data = b''
+            if self.scratch or unfinished:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass  # Windows keeps a file that is still mapped by a live view
+
+
+# Loaded sources by id, buffers refer to them by id only
+sources = {}
+_source_ids = itertools.count()
+# Sources that background jobs (exports) still read from, with how many jobs
+# use them. Removing one of these only takes effect once the last job is done.
+_retained = {}
+_removed_while_retained = set()
+_registry_lock = threading.Lock()
+
+
+def add_source(source):
+    source_id = next(_source_ids)
+    sources[source_id] = source
+    return source_id
+
+
+def get_source(source_id):
+    return sources[source_id]
+
+
+def remove_source(source_id):
+    with _registry_lock:
+        if source_id in _retained:
+            _removed_while_retained.add(source_id)
+            return
+        source = sources.pop(source_id, None)
+    if source is not None:
+        source.close()
+
+
+def clear_sources():
+    for source_id in list(sources):
+        remove_source(source_id)
+
+
+def retain_sources(source_ids):
+    with _registry_lock:
+        for source_id in source_ids:
+            _retained[source_id] = _retained.get(source_id, 0) + 1
+
+
+def release_sources(source_ids):
+    removed = []
+    with _registry_lock:
+        for source_id in source_ids:
+            _retained[source_id] -= 1
+            if _retained[source_id] == 0:
+                del _retained[source_id]
+                if source_id in _removed_while_retained:
+                    _removed_while_retained.discard(source_id)
+                    removed.append(sources.pop(source_id, None))
+    for source in removed:
+        if source is not None:
+            source.close()
+
+
+def buffer_sources(bufs):
+    # Ids of the sources a list of buffers reads from
+    ids = set()
+    for buf in bufs:
+        if isinstance(buf, RegionView):
+            ids.add(buf.source_id)
+        elif isinstance(buf, MergedView):
+            ids.update(part.source_id for part in buf.parts)
+    return ids
+
+
+class RegionView:
+    # A buffer that is just a time range of a loaded source. The samples are read
+    # from the source only when the buffer is played or exported.
+    __slots__ = ('source_id', 'start_ms', 'end_ms')
+
+    def __init__(self, source_id, start_ms, end_ms):
+        self.source_id = source_id
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+
+    @property
+    def source(self):
+        return sources[self.source_id]
+
+    @property
+    def channels(self):
+        return self.source.channels
+
+    @property
+    def frame_rate(self):
+        return self.source.frame_rate
+
+    @property
+    def sample_width(self):
+        return self.source.sample_width
+
+    def frame_count(self):
+        first, stop = self.source.frame_range(self.start_ms, self.end_ms)
+        return stop - first
+
+    def __len__(self):
+        return round(1000 * (self.frame_count() / self.frame_rate))
+
+    @property
+    def raw_data(self):
+        return self.source.pcm(*self.source.frame_range(self.start_ms, self.end_ms))
+
+    def resolve(self):
+        return AudioSegment(bytes(self.raw_data), sample_width=self.sample_width,
+                            frame_rate=self.frame_rate, channels=self.channels)
+
+
+class MergedView:
+    # Several buffers played back to back, still without copying any audio
+    __slots__ = ('parts',)
+
+    def __init__(self, parts):
+        # Flatten merges of merges so every part is a plain RegionView
+        self.parts = []
+        for part in parts:
+            self.parts.extend(part.parts if isinstance(part, MergedView) else [part])
+
+    def _uniform(self):
+        first = self.parts[0]
+        return all((p.channels, p.frame_rate, p.sample_width) == (first.channels, first.frame_rate, first.sample_width)
+                   for p in self.parts)
+
+    @property
+    def channels(self):
+        return max(p.channels for p in self.parts)
+
+    @property
+    def frame_rate(self):
+        return max(p.frame_rate for p in self.parts)
+
+    @property
+    def sample_width(self):
+        return max(p.sample_width for p in self.parts)
+
+    def frame_count(self):
+        if self._uniform():
+            return sum(p.frame_count() for p in self.parts)
+        return int(self.resolve().frame_count())
+
+    def __len__(self):
+        return round(1000 * (self.frame_count() / self.frame_rate))
+
+    @property
+    def raw_data(self):
+        if self._uniform():
+            return b''.join(p.raw_data for p in self.parts)
+        return self.resolve().raw_data
+
+    def resolve(self):
+        if self._uniform():
+            return AudioSegment(self.raw_data, sample_width=self.sample_width,
+                                frame_rate=self.frame_rate, channels=self.channels)
+        # Parts from sources in different formats are converted like pydub concatenation does
+        merged = AudioSegment.empty()
+        for part in self.parts:
+            merged += part.resolve()
+        return merged
+
+
+def as_segment(buf):
+    # AudioSegment for anything used as a buffer
+    if isinstance(buf, (RegionView, MergedView)):
+        return buf.resolve()
+    return buf
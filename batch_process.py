@@ -0,0 +1,149 @@
+import os
+os.environ["PATH"] += os.pathsep + r"C:\ffmpeg\bin"
+
+import argparse
+import glob
+import multiprocessing
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from audio_io import load_audio_file, SUPPORTED_EXTENSIONS, OUTPUT_CHANNELS, OUTPUT_ENCODINGS, OUTPUT_FRAME_RATE
+from audio_sources import PcmSource, add_source, remove_source
+from instrumentation import labelled, set_log_file, stage
+from output_assembly import export_output
+from region_engine import MERGE_GAP_MS, MIN_REGION_MS, PRE_ROLL_MS, POST_ROLL_MS, MAX_REGION_MS
+from vad_engine import detect_voice_buffers, MAX_SILENCE_MS
+
+
+def find_inputs(pattern):
+    # A directory means every supported file in it, anything else is a glob
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(p for p in paths if os.path.isfile(p) and os.path.splitext(p)[1].lower() in SUPPORTED_EXTENSIONS)
+
+
+def output_path(infile, outdir, encoding='wav'):
+    # Same naming as the GUI's default output filename
+    input_filename = os.path.basename(infile)
+    return os.path.join(outdir, input_filename.rsplit('.', 1)[0] + '-processed' + OUTPUT_ENCODINGS[encoding][0])
+
+
+def process_file(infile, outdir, repeat_all=False, aggressiveness=2, shape=None, log_path=None, target=None):
+    # shape holds the region settings of FrameDecisions.regions(), e.g. merge_gap_ms,
+    # and target the output format (encoding, frame_rate, channels), 44.1 kHz
+    # stereo WAV without it. With a log_path the timing of every stage is
+    # appended to it as JSON lines.
+    if log_path:
+        set_log_file(log_path)
+    with labelled(os.path.basename(infile)):
+        return run_file(infile, outdir, repeat_all, aggressiveness, shape, target or {})
+
+
+def run_file(infile, outdir, repeat_all, aggressiveness, shape, target):
+    started = time.perf_counter()
+    with stage('decode') as measured:
+        audio = load_audio_file(infile)
+        measured.add(frames=int(audio.frame_count()), nbytes=len(audio.raw_data))
+    source_id = add_source(PcmSource.from_segment(audio, name=infile))
+    try:
+        regions, buffers = detect_voice_buffers(audio, aggressiveness=aggressiveness, source_id=source_id, **(shape or {}))
+
+        repeat_indices = range(len(buffers)) if repeat_all else ()
+        outpath = output_path(infile, outdir, target.get('encoding', 'wav'))
+        output_ms = export_output(buffers, outpath, repeat_indices, target=target)
+    finally:
+        # Pool workers are reused for the next file
+        remove_source(source_id)
+
+    return {
+        'input': infile,
+        'output': outpath,
+        'input_bytes': os.path.getsize(infile),
+        'input_ms': len(audio),
+        'output_ms': output_ms,
+        'buffers': len(buffers),
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split voice recordings into buffers and write processed files without the GUI.")
+    parser.add_argument('inputs', nargs='+', help="input directory or glob pattern, e.g. raw/ or 'raw/*.m4a'")
+    parser.add_argument('-o', '--output-dir', default='processed', help="where processed files are written (default: processed)")
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help="number of files processed at once")
+    parser.add_argument('--repeat-all', action='store_true', help="repeat every buffer, like selecting Repeat on all of them")
+    parser.add_argument('--aggressiveness', type=int, default=2, choices=range(4), help="webrtcvad aggressiveness (0-3)")
+    parser.add_argument('--hangover-ms', type=int, default=MAX_SILENCE_MS, help=f"non-speech that ends a region (default: {MAX_SILENCE_MS})")
+    parser.add_argument('--merge-gap-ms', type=int, default=MERGE_GAP_MS, help=f"join regions closer than this (default: {MERGE_GAP_MS})")
+    parser.add_argument('--min-length-ms', type=int, default=MIN_REGION_MS, help=f"drop shorter regions (default: {MIN_REGION_MS})")
+    parser.add_argument('--pre-roll-ms', type=int, default=PRE_ROLL_MS, help=f"audio kept before each region (default: {PRE_ROLL_MS})")
+    parser.add_argument('--post-roll-ms', type=int, default=POST_ROLL_MS, help=f"audio kept after each region (default: {POST_ROLL_MS})")
+    parser.add_argument('--max-length-ms', type=int, default=MAX_REGION_MS, help="cut longer regions at their quietest points, 0 to keep them whole (default: 0)")
+    parser.add_argument('--format', default='wav', choices=sorted(OUTPUT_ENCODINGS), help="output format (default: wav)")
+    parser.add_argument('--sample-rate', type=int, default=OUTPUT_FRAME_RATE, help=f"output sample rate (default: {OUTPUT_FRAME_RATE})")
+    parser.add_argument('--channels', type=int, default=OUTPUT_CHANNELS, choices=(1, 2), help=f"output channels (default: {OUTPUT_CHANNELS})")
+    parser.add_argument('--log', metavar='FILE', help="append the time, throughput and peak memory of every stage to FILE as JSON lines")
+    args = parser.parse_args(argv)
+    shape = {
+        'max_silence_ms': args.hangover_ms,
+        'merge_gap_ms': args.merge_gap_ms,
+        'min_region_ms': args.min_length_ms,
+        'pre_roll_ms': args.pre_roll_ms,
+        'post_roll_ms': args.post_roll_ms,
+        'max_region_ms': args.max_length_ms,
+    }
+    target = {'encoding': args.format, 'frame_rate': args.sample_rate, 'channels': args.channels}
+
+    infiles = []
+    for pattern in args.inputs:
+        infiles.extend(p for p in find_inputs(pattern) if p not in infiles)
+    if not infiles:
+        print("No supported input files found")
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"Processing {len(infiles)} files with {args.workers} workers")
+
+    started = time.perf_counter()
+    results = []
+    failed = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        jobs = {
+            pool.submit(process_file, infile, args.output_dir, args.repeat_all, args.aggressiveness, shape, args.log,
+                        target): infile
+            for infile in infiles
+        }
+        for job in as_completed(jobs):
+            infile = jobs[job]
+            try:
+                result = job.result()
+            except Exception as e:
+                print(f"FAILED {infile}: {str(e)}")
+                traceback.print_exc()
+                failed.append(infile)
+                continue
+            results.append(result)
+            speed = result['input_ms'] / 1000.0 / result['seconds']
+            print(f"{os.path.basename(infile)}: {result['buffers']} buffers, "
+                  f"{result['input_ms'] / 1000.0:.1f}s -> {result['output_ms'] / 1000.0:.1f}s "
+                  f"in {result['seconds']:.1f}s ({speed:.1f}x realtime) -> {result['output']}")
+
+    wall = time.perf_counter() - started
+    audio_seconds = sum(r['input_ms'] for r in results) / 1000.0
+    input_mb = sum(r['input_bytes'] for r in results) / (1024 * 1024)
+    print(f"Processed {len(results)} of {len(infiles)} files in {wall:.1f}s: "
+          f"{audio_seconds / 60.0:.1f} min of audio ({audio_seconds / wall:.1f}x realtime), "
+          f"{input_mb / wall:.2f} MB/s, {len(results) / wall * 60.0:.1f} files/min")
+    if failed:
+        print(f"{len(failed)} files failed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
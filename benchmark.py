@@ -0,0 +1,273 @@
+import os
+os.environ["PATH"] += os.pathsep + r"C:\ffmpeg\bin"
+
+import argparse
+import json
+import multiprocessing
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from audio_io import load_audio_file, OUTPUT_ENCODINGS
+from audio_sources import PcmSource, add_source, remove_source
+from instrumentation import peak_rss_mb, recent, record_count
+from output_assembly import export_output
+from vad_engine import detect_voice_buffers
+from waveform import region_mask
+
+# Bump when the layout of the results file changes
+RESULTS_VERSION = 3
+
+# Synthesized per step, bounds the memory used for it
+SYNTH_CHUNK_SECONDS = 60
+
+# Edits applied before assembly, like a user would make them
+REPEAT_EVERY = 4    # Every 4th buffer is repeated
+EXCLUDE_EVERY = 10  # and every 10th (counting from the 10th) excluded
+
+
+def parse_length(text):
+    # Seconds for "90", "90s", "10m", "1.5h"
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    text = text.strip().lower()
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def speech_bursts(seconds, seed):
+    # (start, end) in seconds of 0.3-3 s of speech with 0.05-1.5 s pauses between
+    rng = np.random.default_rng(seed)
+    bursts = []
+    position = 0.5
+    while position < seconds - 2:
+        length = rng.uniform(0.3, 3.0)
+        bursts.append((position, position + length))
+        position += length + rng.uniform(0.05, 1.5)
+    return bursts
+
+
+def synthesize(path, seconds, frame_rate=44100, seed=1):
+    # Write a speech-like mono WAV: a voiced tone with wobbling pitch and syllable
+    # rate amplitude changes, plus breath noise, in bursts over a faint noise
+    # floor. Made a chunk at a time, so hours of it need little memory, and the
+    # same seed always gives the same file. Returns the number of bursts.
+    bursts = np.array(speech_bursts(seconds, seed)).reshape(-1, 2) * 1000.0
+    total = int(seconds * frame_rate)
+    chunk = SYNTH_CHUNK_SECONDS * frame_rate
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(frame_rate)
+        for first in range(0, total, chunk):
+            t = np.arange(first, min(total, first + chunk)) / frame_rate
+            rng = np.random.default_rng((seed, first))
+            voiced = 0.3 * np.sin(2 * np.pi * (150 + 30 * np.sin(2 * np.pi * 3 * t)) * t) * (1 + 0.5 * np.sin(2 * np.pi * 5 * t))
+            voiced += 0.05 * rng.standard_normal(len(t))
+            signal = np.where(region_mask(bursts[:, 0], bursts[:, 1], t), voiced, 0.0)
+            signal += 0.0003 * rng.standard_normal(len(t))
+            wav_file.writeframes((np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes())
+    return len(bursts)
+
+
+def run_case(path, outpath, aggressiveness=2, workers=1, encoding='wav'):
+    # Time each stage of processing one file, the way the GUI does it. Runs in a
+    # process of its own so the peak memory is this case's alone; the peak after
+    # each stage includes the stages before it. Assembly and export take turns in
+    # a single streamed pass; export_output times each on its own, and those
+    # records are reported as the assemble and export stages.
+    stages = {}
+
+    def finish(stage, started):
+        stages[stage] = {'seconds': time.perf_counter() - started, 'peak_rss_mb': peak_rss_mb()}
+
+    started = time.perf_counter()
+    audio = load_audio_file(path)
+    source_id = add_source(PcmSource.from_segment(audio, name=path))
+    finish('load', started)
+    try:
+        started = time.perf_counter()
+        regions, buffers = detect_voice_buffers(audio, aggressiveness=aggressiveness, workers=workers, source_id=source_id)
+        finish('detect', started)
+
+        repeat = range(0, len(buffers), REPEAT_EVERY)
+        excluded = range(EXCLUDE_EVERY - 1, len(buffers), EXCLUDE_EVERY)
+        before = record_count()
+        output_ms = export_output(buffers, outpath, repeat, excluded, target={'encoding': encoding})
+        stages.update(recorded_stages(('assemble', 'export'), record_count() - before))
+    finally:
+        remove_source(source_id)
+        if os.path.exists(outpath):
+            os.remove(outpath)  # Hours of stereo output add up
+
+    return {
+        'input_ms': len(audio),
+        'buffers': len(buffers),
+        'output_ms': output_ms,
+        'stages': stages,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def recorded_stages(names, count):
+    # Time and peak memory of the named stages among the last count records
+    records = recent()[-count:] if count > 0 else []
+    return {entry['stage']: {'seconds': entry['seconds'], 'peak_rss_mb': entry['peak_rss_mb']}
+            for entry in records if entry['stage'] in names}
+
+
+def run_benchmarks(lengths, frame_rate=44100, seed=1, aggressiveness=2, workers=1, repeat=1, work_dir=None, encoding='wav'):
+    # One case per length; with repeat > 1 each stage keeps its fastest time and
+    # the highest peak memory of the runs
+    work_dir = tempfile.mkdtemp(prefix="voice-benchmark-", dir=work_dir)
+    context = multiprocessing.get_context('spawn')
+    cases = []
+    try:
+        for name in lengths:
+            seconds = parse_length(name)
+            path = os.path.join(work_dir, "input.wav")
+            started = time.perf_counter()
+            bursts = synthesize(path, seconds, frame_rate, seed)
+            synth_seconds = time.perf_counter() - started
+
+            case = None
+            for _ in range(repeat):
+                # A fresh process per run, so no run inherits another's peak
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    outpath = os.path.join(work_dir, "output" + OUTPUT_ENCODINGS[encoding][0])
+                    result = pool.submit(run_case, path, outpath, aggressiveness, workers, encoding).result()
+                if case is None:
+                    case = result
+                    continue
+                for stage, stats in result['stages'].items():
+                    best = case['stages'][stage]
+                    best['seconds'] = min(best['seconds'], stats['seconds'])
+                    best['peak_rss_mb'] = max_known(best['peak_rss_mb'], stats['peak_rss_mb'])
+                case['peak_rss_mb'] = max_known(case['peak_rss_mb'], result['peak_rss_mb'])
+
+            case.update({'name': name, 'seconds': seconds, 'speech_bursts': bursts, 'synthesize_seconds': synth_seconds})
+            cases.append(case)
+            print_case(case)
+            os.remove(path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'system': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'settings': {
+            'frame_rate': frame_rate,
+            'seed': seed,
+            'aggressiveness': aggressiveness,
+            'workers': workers,
+            'repeat': repeat,
+            'encoding': encoding,
+        },
+        'cases': cases,
+    }
+
+
+def max_known(a, b):
+    if a is None or b is None:
+        return a if b is None else b
+    return max(a, b)
+
+
+def format_mb(value):
+    return "?" if value is None else f"{value:.0f} MB"
+
+
+def print_case(case):
+    audio_seconds = case['input_ms'] / 1000.0
+    total = sum(stats['seconds'] for stats in case['stages'].values())
+    stages = ", ".join(f"{stage} {stats['seconds']:.2f}s" for stage, stats in case['stages'].items())
+    print(f"{case['name']}: {case['buffers']} buffers, {stages} = {total:.2f}s "
+          f"({audio_seconds / total:.0f}x realtime), peak {format_mb(case['peak_rss_mb'])}")
+
+
+def compare(results, baseline, threshold=0.15, min_seconds=0.05):
+    # Lines describing every stage that got slower, or case that needs more
+    # memory, by more than threshold (0.15 = 15%) compared to the baseline.
+    # Stage times also have to grow by min_seconds, so the timer noise of
+    # short cases doesn't count as a regression.
+    regressions = []
+    old_cases = {case['name']: case for case in baseline['cases']}
+    for case in results['cases']:
+        old = old_cases.get(case['name'])
+        if old is None:
+            continue
+        for stage, stats in case['stages'].items():
+            old_stats = old['stages'].get(stage)
+            if old_stats is None:
+                continue
+            before, after = old_stats['seconds'], stats['seconds']
+            if after > before * (1 + threshold) and after - before >= min_seconds:
+                regressions.append(f"{case['name']} {stage}: {before:.2f}s -> {after:.2f}s (+{(after / before - 1) * 100:.0f}%)")
+        before, after = old.get('peak_rss_mb'), case['peak_rss_mb']
+        if before and after and after > before * (1 + threshold):
+            regressions.append(f"{case['name']} peak memory: {before:.0f} MB -> {after:.0f} MB (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time loading, detection and export on synthesized recordings.")
+    parser.add_argument('--lengths', default='1m,10m,1h,4h', help="comma separated recording lengths, e.g. 90s,10m,1.5h (default: 1m,10m,1h,4h)")
+    parser.add_argument('--frame-rate', type=int, default=44100, help="sample rate of the synthesized recordings (default: 44100)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed of the synthesized recordings (default: 1)")
+    parser.add_argument('--aggressiveness', type=int, default=2, choices=range(4), help="webrtcvad aggressiveness (0-3)")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="processes used for detection (default: 1)")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per length, the fastest time of each stage is kept")
+    parser.add_argument('--format', default='wav', choices=sorted(OUTPUT_ENCODINGS), help="output format to encode to (default: wav)")
+    parser.add_argument('--work-dir', help="where the synthesized recordings are written (default: system temp directory)")
+    parser.add_argument('-o', '--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', metavar='BASELINE', help="results JSON of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15, help="slowdown that counts as a regression, 0.15 = 15%% (default: 0.15)")
+    parser.add_argument('--min-delta', type=float, default=0.05, help="seconds a stage must slow down by to count (default: 0.05)")
+    args = parser.parse_args(argv)
+
+    # Read the baseline first, so a typo doesn't cost a whole run
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('version') != RESULTS_VERSION:
+            print(f"Unsupported results version {baseline.get('version')} in {args.compare}")
+            return 2
+
+    lengths = [length.strip() for length in args.lengths.split(',') if length.strip()]
+    results = run_benchmarks(lengths, args.frame_rate, args.seed, args.aggressiveness, max(1, args.workers),
+                             max(1, args.repeat), args.work_dir, args.format)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if baseline is not None:
+        if baseline['settings'] != results['settings']:
+            print(f"Note: baseline settings differ: {baseline['settings']}")
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
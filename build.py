@@ -30,7 +30,7 @@ if os.path.exists(icon_path):
 args.extend([
     '--hidden-import=webrtcvad',
     '--hidden-import=pydub',
-    '--hidden-import=simpleaudio',
+    '--hidden-import=sounddevice',
     '--hidden-import=numpy',
     '--hidden-import=dearpygui',
 ])
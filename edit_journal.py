@@ -0,0 +1,125 @@
+from collections import deque
+
+# Edits kept for undo, the oldest are forgotten beyond this
+JOURNAL_LIMIT = 10000
+# Replacements kept for undo. Each holds a whole table, so beyond this the
+# oldest is forgotten together with the edits made before it.
+TABLE_LIMIT = 20
+
+
+class EditJournal:
+    # Undo and redo for the edits of a SegmentTable. Every edit goes through
+    # here and is recorded as the ids and positions it changed, never audio:
+    #   ('flag', seg_id, flag)                    repeat or exclude toggled
+    #   ('swap', first, second)                   segments at two positions exchanged
+    #   ('merge', merged_id, seg_ids, places)     seg_ids, at places, merged into merged_id
+    #   ('table', old, new, old_state, new_state) the whole table replaced, e.g. derived
+    #                                             again with other detection settings
+    # Undoing toggles or swaps again, or expands the merge; the merged segment
+    # stays in the table so redoing reuses it. Edits are undone in the opposite
+    # order, so the positions recorded are still valid then, and each undo or
+    # redo touches only the segments of its edit however long the history is.
+    # Undoing a replacement brings back the old table with its own edits below
+    # it in the history; the caller reads the current one from self.table.
+
+    def __init__(self, table, limit=JOURNAL_LIMIT):
+        self.table = table
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = deque(maxlen=limit)
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def toggle(self, seg_id, flag):
+        on = self.table.toggle(seg_id, flag)
+        self._record(('flag', seg_id, flag))
+        return on
+
+    def swap(self, first, second):
+        self.table.swap(first, second)
+        self._record(('swap', first, second))
+
+    def merge(self, seg_ids, buf):
+        places = sorted(self.table.position(seg_id) for seg_id in seg_ids)
+        ordered = [self.table.order[place] for place in places]
+        merged_id = self.table.merge(seg_ids, buf)
+        self._record(('merge', merged_id, ordered, places))
+        return merged_id
+
+    def replace(self, table, old_state=None, new_state=None):
+        # Swap in a new table. The states, e.g. the settings each table was
+        # derived with, are kept to hand back on undo and redo. Replacements in
+        # a row with no edit in between are one entry, from the first table to
+        # the last, so dragging a slider is undone in one step.
+        old = self.table
+        if self.undo_stack and self.undo_stack[-1][0] == 'table' and self.undo_stack[-1][2] is old:
+            _, old, _, old_state, _ = self.undo_stack.pop()
+        self.table = table
+        self._record(('table', old, table, old_state, new_state))
+        if sum(1 for edit in self.undo_stack if edit[0] == 'table') > TABLE_LIMIT:
+            while self.undo_stack.popleft()[0] != 'table':
+                pass
+
+    def undo(self):
+        # Revert the last edit and return it, None when there is nothing to undo
+        if not self.undo_stack:
+            return None
+        edit = self.undo_stack.pop()
+        kind = edit[0]
+        if kind == 'flag':
+            self.table.toggle(edit[1], edit[2])
+        elif kind == 'swap':
+            self.table.swap(edit[1], edit[2])
+        elif kind == 'merge':
+            self.table.expand(edit[1], edit[2], edit[3])
+        elif kind == 'table':
+            self.table = edit[1]
+        self.redo_stack.append(edit)
+        return edit
+
+    def redo(self):
+        # Apply the last undone edit again, None when there is nothing to redo
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        kind = edit[0]
+        if kind == 'flag':
+            self.table.toggle(edit[1], edit[2])
+        elif kind == 'swap':
+            self.table.swap(edit[1], edit[2])
+        elif kind == 'merge':
+            self.table.collapse(edit[2], edit[1])
+        elif kind == 'table':
+            self.table = edit[2]
+        self.undo_stack.append(edit)
+        return edit
+
+    def _record(self, edit):
+        # A new edit makes the undone ones unreachable
+        self.undo_stack.append(edit)
+        self.redo_stack.clear()
+
+    def snapshot(self):
+        # Both stacks as plain lists, e.g. for a session file. Only the current
+        # table is saved, so each stack goes back as far as its last replacement.
+        return {'undo': self._since_replace(self.undo_stack), 'redo': self._since_replace(self.redo_stack)}
+
+    @staticmethod
+    def _since_replace(stack):
+        edits = []
+        for edit in reversed(stack):
+            if edit[0] == 'table':
+                break
+            edits.append(list(edit))
+        edits.reverse()
+        return edits
+
+    @classmethod
+    def restore(cls, table, state, limit=JOURNAL_LIMIT):
+        journal = cls(table, limit)
+        journal.undo_stack.extend(tuple(edit) for edit in state['undo'])
+        journal.redo_stack.extend(tuple(edit) for edit in state['redo'])
+        return journal
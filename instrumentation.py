@@ -0,0 +1,185 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Stage records kept for the diagnostics panel
+RECENT_LIMIT = 200
+# Functions listed in the text summary of a profile
+PROFILE_TOP = 40
+
+_lock = threading.Lock()
+_recent = deque(maxlen=RECENT_LIMIT)
+_count = 0  # Records made so far, tells pollers something new arrived
+_log_fd = None  # Descriptor of the JSON lines log, one record per line, when set
+_context = threading.local()  # Label of the work the current thread is doing
+
+
+class Stage:
+    # Time spent in one stage of the work on a file (decode, resample, vad,
+    # regions, render, assemble, export), with what it got through. frames are
+    # audio frames for the audio stages and VAD frames for vad and regions;
+    # items are buffers or rows. A stage can be timed in pieces with timing(),
+    # e.g. once per chunk of a stream, and is recorded by finish().
+
+    def __init__(self, name, frames=0, nbytes=0, items=0):
+        self.name = name
+        self.label = getattr(_context, 'label', None)
+        self.frames = frames
+        self.bytes = nbytes
+        self.items = items
+        self.seconds = 0.0
+
+    def add(self, frames=0, nbytes=0, items=0):
+        self.frames += frames
+        self.bytes += nbytes
+        self.items += items
+
+    @contextmanager
+    def timing(self):
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def finish(self, ok=True):
+        record({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'label': self.label,
+            'stage': self.name,
+            'seconds': round(self.seconds, 6),
+            'frames': self.frames,
+            'frames_per_second': round(self.frames / self.seconds) if self.seconds > 0 else None,
+            'bytes': self.bytes,
+            'items': self.items,
+            'peak_rss_mb': peak_rss_mb(),
+            'ok': ok,
+        })
+
+
+@contextmanager
+def stage(name, frames=0, nbytes=0, items=0):
+    # Time the block as one stage. Counts not known up front can be added to the
+    # yielded Stage on the way. A block left by an exception is recorded as not ok.
+    current = Stage(name, frames, nbytes, items)
+    ok = False
+    try:
+        with current.timing():
+            yield current
+        ok = True
+    finally:
+        current.finish(ok)
+
+
+@contextmanager
+def labelled(label):
+    # Stages measured by this thread inside the block belong to label, e.g. a file name
+    previous = getattr(_context, 'label', None)
+    _context.label = label
+    try:
+        yield
+    finally:
+        _context.label = previous
+
+
+def record(entry):
+    global _count
+    with _lock:
+        _recent.append(entry)
+        _count += 1
+        if _log_fd is not None:
+            # One write per record on an O_APPEND descriptor, so the records of
+            # batch workers in other processes logging to the same file never interleave
+            os.write(_log_fd, (json.dumps(entry) + "\n").encode('utf-8'))
+
+
+def recent():
+    # The latest records, oldest first
+    with _lock:
+        return list(_recent)
+
+
+def record_count():
+    return _count
+
+
+def set_log_file(path):
+    # Append every record to path as a line of JSON from now on, None to stop
+    global _log_fd
+    with _lock:
+        if _log_fd is not None:
+            os.close(_log_fd)
+            _log_fd = None
+        if path:
+            _log_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0), 0o644)
+
+
+@contextmanager
+def profiled(path):
+    # cProfile the block in the current thread (work handed to other threads or
+    # processes isn't seen). Writes the stats to path, for pstats or snakeviz,
+    # and the slowest functions by cumulative time to path + ".txt".
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        profiler.dump_stats(path)
+        with open(path + ".txt", 'w', encoding='utf-8') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(PROFILE_TOP)
+
+
+def peak_rss_mb():
+    # High-water mark of this process's resident memory, None where unknown
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0  # Bytes on macOS, KB elsewhere
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                    'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        get_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_process.restype = wintypes.HANDLE
+        get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_info.argtypes = (wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD)
+        if get_info(get_process(), ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize / (1024.0 * 1024.0)
+    return None
+
+
+def describe(entry):
+    # One line of the diagnostics panel
+    text = f"{entry['stage']:<9} {entry['seconds'] * 1000:9.1f} ms"
+    if entry['frames_per_second']:
+        text += f" {entry['frames_per_second']:>12,} frames/s"
+    if entry['bytes']:
+        text += f" {entry['bytes'] / (1024 * 1024):8.1f} MB"
+    if entry['items']:
+        text += f" {entry['items']:>7} items"
+    if entry['peak_rss_mb'] is not None:
+        text += f"  peak {entry['peak_rss_mb']:.0f} MB"
+    if not entry['ok']:
+        text += "  (failed)"
+    if entry['label']:
+        text += f"  {entry['label']}"
+    return text
@@ -0,0 +1,180 @@
+import math
+import os
+
+from audio_io import OutputWriter, WRITE_CHUNK_FRAMES
+from audio_sources import as_segment
+from instrumentation import Stage
+
+# Silence after the first buffer, in ms
+FIRST_BUFFER_GAP_MS = 2000
+# Silence around a repeated buffer, relative to the buffer's length
+REPEAT_SILENCE_FACTOR = 1.5
+
+
+# Sample rate pydub generates AudioSegment.silent at. The old += assembly always
+# started from such a segment, so the output rate is never below this.
+SILENCE_FRAME_RATE = 11025
+
+
+def build_layout(buffers, repeat_indices=(), excluded_indices=()):
+    # Work out the output up front as a list of pieces, either ('buffer', index)
+    # or ('silence', duration_ms): every buffer that is not excluded, 2 seconds of
+    # silence after the first one, and repeated buffers played twice with 1.5x
+    # their length of silence before, between and after
+    repeat_indices = set(repeat_indices)
+    excluded_indices = set(excluded_indices)
+    layout = []
+    
+    for i, buf in enumerate(buffers):
+        # Skip excluded buffers
+        if i in excluded_indices:
+            continue
+        
+        silence_duration = int(len(buf) * REPEAT_SILENCE_FACTOR)
+        if i in repeat_indices:
+            layout.append(('silence', silence_duration))
+        
+        layout.append(('buffer', i))
+        
+        # Add 2 seconds of silence after the first buffer
+        if i == 0:
+            layout.append(('silence', FIRST_BUFFER_GAP_MS))
+        
+        if i in repeat_indices:
+            layout.extend([('silence', silence_duration), ('buffer', i), ('silence', silence_duration)])
+    
+    return layout
+
+
+def output_format(buffers, layout):
+    # (channels, frame_rate, sample_width) of the assembled output, the same
+    # format AudioSegment concatenation would have converted everything to
+    used = [buffers[value] for kind, value in layout if kind == 'buffer']
+    channels = max([1] + [buf.channels for buf in used])
+    frame_rate = max([SILENCE_FRAME_RATE] + [buf.frame_rate for buf in used])
+    sample_width = max([2] + [buf.sample_width for buf in used])
+    return channels, frame_rate, sample_width
+
+
+def silence_frames(duration_ms, frame_rate):
+    # Length of AudioSegment.silent(duration_ms) once resampled to frame_rate,
+    # following audioop.ratecv's output count, without generating any samples
+    frames = int(SILENCE_FRAME_RATE * (duration_ms / 1000.0))
+    if frame_rate == SILENCE_FRAME_RATE or frames == 0:
+        return frames
+    divisor = math.gcd(SILENCE_FRAME_RATE, frame_rate)
+    return (frames - 1) * (frame_rate // divisor) // (SILENCE_FRAME_RATE // divisor) + 1
+
+
+def output_frames(buffers, layout, frame_rate):
+    # Number of frames the layout adds up to at frame_rate
+    frames = 0
+    for kind, value in layout:
+        if kind == 'buffer':
+            buf = buffers[value]
+            frames += int(buf.frame_count()) * frame_rate // buf.frame_rate
+        else:
+            frames += silence_frames(value, frame_rate)
+    return frames
+
+
+def stream_layout(buffers, layout, progress=None, chunk_frames=WRITE_CHUNK_FRAMES):
+    # The output of the layout as a timeline of spans, so it can be written
+    # without ever being held whole: ('pcm', chunk) with chunks of at most
+    # chunk_frames of audio, and ('silence', frames), which costs nothing until
+    # the writer emits it. Buffers that don't match the output format are
+    # converted as they come up, a repeated buffer once for both of its plays.
+    # progress is called with (segments done, segments in total) before the first
+    # buffer and after each one.
+    channels, frame_rate, sample_width = output_format(buffers, layout)
+    frame_width = channels * sample_width
+    chunk_bytes = chunk_frames * frame_width
+
+    total = sum(1 for kind, _ in layout if kind == 'buffer')
+    done = 0
+    if progress is not None:
+        progress(done, total)
+    current = None  # (index, raw data) of the buffer converted last
+    for kind, value in layout:
+        if kind == 'buffer':
+            if current is None or current[0] != value:
+                buf = buffers[value]
+                if (buf.channels, buf.frame_rate, buf.sample_width) != (channels, frame_rate, sample_width):
+                    buf = as_segment(buf).set_channels(channels).set_frame_rate(frame_rate).set_sample_width(sample_width)
+                current = (value, memoryview(buf.raw_data))
+            data = current[1]
+            for offset in range(0, len(data), chunk_bytes):
+                yield 'pcm', data[offset:offset + chunk_bytes]
+            done += 1
+            if progress is not None:
+                progress(done, total)
+        else:
+            yield 'silence', silence_frames(value, frame_rate)
+
+
+def export_output(buffers, outpath, repeat_indices=(), excluded_indices=(), target=None, progress=None,
+                  on_write=None):
+    # Assemble and write the output in one pass. The layout is streamed chunk by
+    # chunk into an OutputWriter, so the whole output is never in memory, and
+    # compressed outputs are encoded by ffmpeg while the next chunks are
+    # assembled. target holds the encoding, frame_rate and channels arguments of
+    # OutputWriter; without it the output is 44.1 kHz stereo WAV.
+    # The file is written next to outpath and renamed when complete, so an
+    # interrupted export (progress may raise to cancel it) leaves no partial file.
+    # on_write is called with (bytes written, bytes expected in total) after
+    # every span, so a long segment reports progress and can be cancelled while
+    # it is converted; it may raise as well. Returns the duration of the output in ms.
+    layout = build_layout(buffers, repeat_indices, excluded_indices)
+    channels, frame_rate, sample_width = output_format(buffers, layout)
+    frame_width = channels * sample_width
+    os.makedirs(os.path.dirname(os.path.abspath(outpath)), exist_ok=True)
+    temp_path = outpath + '.part'
+
+    # Assembly and writing take turns per span, each is timed on its own. Only
+    # real audio counts as assembled bytes, silence is never materialized.
+    assemble = Stage('assemble', items=sum(1 for kind, _ in layout if kind == 'buffer'))
+    export = Stage('export')
+    spans = stream_layout(buffers, layout, progress)
+    finished = False
+    try:
+        writer = OutputWriter(temp_path, frame_rate, channels, sample_width, **(target or {}))
+        expected = output_frames(buffers, layout, frame_rate) * writer.frame_rate // frame_rate * writer.channels * 2
+        total_written = 0
+        try:
+            while True:
+                with assemble.timing():
+                    span = next(spans, None)
+                if span is None:
+                    break
+                kind, value = span
+                if kind == 'pcm':
+                    frames = len(value) // frame_width
+                    assemble.add(frames=frames, nbytes=len(value))
+                    with export.timing():
+                        written = writer.write(value)
+                else:
+                    frames = value
+                    assemble.add(frames=frames)
+                    with export.timing():
+                        written = writer.write_silence(frames)
+                export.add(frames=frames, nbytes=written)
+                total_written += written
+                if on_write is not None:
+                    on_write(total_written, expected)
+            with export.timing():
+                export.add(nbytes=writer.close())
+        except BaseException:
+            writer.abort()
+            raise
+        os.replace(temp_path, outpath)
+        finished = True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        spans.close()
+        assemble.finish(finished)
+        export.finish(finished)
+
+    return round(1000 * (assemble.frames / frame_rate))
@@ -0,0 +1,184 @@
+import bisect
+import threading
+
+import numpy as np
+import sounddevice as sd
+
+from audio_io import pcm_to_float
+from audio_sources import PcmSource, RegionView, MergedView
+
+# Frames held in the ring buffer between the feeder thread and the audio
+# callback, about 1.5 s at 44.1 kHz
+RING_FRAMES = 1 << 16
+# Frames the feeder reads from the source per step, also what play() puts in
+# the ring right away so sound starts with the next callback
+FEED_FRAMES = 4096
+
+
+def buffer_spans(buf):
+    # (source, first frame, stop frame) ranges that make up a buffer, in order.
+    # Views are read straight from their sources; anything else is wrapped once.
+    if isinstance(buf, RegionView):
+        return [(buf.source, *buf.source.frame_range(buf.start_ms, buf.end_ms))]
+    if isinstance(buf, MergedView) and buf._uniform():
+        return [span for part in buf.parts for span in buffer_spans(part)]
+    source = PcmSource.from_segment(buf.resolve() if isinstance(buf, MergedView) else buf)
+    return [(source, 0, source.frame_count())]
+
+
+class PlaybackEngine:
+    # One output stream that stays open for the lifetime of the app. play()
+    # points it at a buffer; a feeder thread copies the buffer's PCM from the
+    # memory-mapped source into a ring buffer a chunk at a time, and the audio
+    # callback plays from the ring. Switching buffers or seeking only moves the
+    # read position and drops what is in the ring.
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.stream = None
+        self.stream_format = None  # (frame_rate, channels) of the open stream
+        self.ring = None
+
+        # (spans, frame within the buffer where each span starts, sample width) of
+        # the current buffer, replaced as a whole so the feeder reads a consistent one
+        self.track = ([], [0], 2)
+        self.length = 0  # Frames in the current buffer
+        self.frame_rate = 1
+        self.tag = None  # Whatever the caller passed to play(), e.g. a segment id
+        self.played = 0  # Frames of the current buffer already sent to the device
+        self.filled = 0  # Frames of the current buffer already in the ring
+        self.ring_read = 0
+        self.ring_count = 0
+        self.playing = False
+        self.generation = 0  # Bumped on every play/seek/stop, stale feeder reads are dropped
+
+        self.closed = False
+        self.feeder = threading.Thread(target=self._feed, daemon=True)
+        self.feeder.start()
+
+    def play(self, buf, tag=None):
+        spans = buffer_spans(buf)
+        offsets = [0]
+        for _, first, stop in spans:
+            offsets.append(offsets[-1] + stop - first)
+        frame_rate, channels = buf.frame_rate, buf.channels
+        if self.stream_format != (frame_rate, channels):
+            self._open_stream(frame_rate, channels)
+
+        with self.lock:
+            self.track = (spans, offsets, buf.sample_width)
+            self.length = offsets[-1]
+            self.frame_rate = frame_rate
+            self.tag = tag
+            self._restart(0)
+
+    def seek(self, position_ms):
+        with self.lock:
+            if self.length:
+                self._restart(min(self.length, max(0, int(position_ms * self.frame_rate / 1000))))
+
+    def stop(self):
+        with self.lock:
+            self.generation += 1
+            self.playing = False
+            self.ring_count = 0
+
+    def position_ms(self):
+        return self.played * 1000 // self.frame_rate
+
+    def duration_ms(self):
+        return self.length * 1000 // self.frame_rate
+
+    def is_playing(self):
+        return self.playing
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.playing = False
+            self.lock.notify_all()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def _open_stream(self, frame_rate, channels):
+        # Only happens when a file with a different format is played
+        if self.stream is not None:
+            self.stream.close()
+        with self.lock:
+            self.generation += 1
+            self.playing = False
+            self.ring = np.zeros((RING_FRAMES, channels), dtype=np.float32)
+            self.ring_read = self.ring_count = 0
+        self.stream = sd.OutputStream(samplerate=frame_rate, channels=channels, dtype='float32',
+                                      latency='low', callback=self._callback)
+        self.stream.start()
+        self.stream_format = (frame_rate, channels)
+
+    def _restart(self, frame):
+        # Called with the lock held. The first chunk goes into the ring right
+        # here, so playback doesn't wait for the feeder thread to wake up.
+        self.generation += 1
+        self.played = self.filled = frame
+        self.ring_read = self.ring_count = 0
+        self.playing = self.length > 0
+        self._write_ring(self._read(self.track, frame, min(self.length, frame + FEED_FRAMES)))
+        self.lock.notify_all()
+
+    def _read(self, track, first, stop):
+        # float32 (frames, channels) for frames [first, stop) of a track
+        spans, offsets, sample_width = track
+        chunks = []
+        index = bisect.bisect_right(offsets, first) - 1
+        while first < stop and index < len(spans):
+            source, span_first, span_stop = spans[index]
+            offset = first - offsets[index]
+            count = min(stop - first, span_stop - span_first - offset)
+            pcm = source.pcm(span_first + offset, span_first + offset + count)
+            chunks.append(pcm_to_float(pcm, sample_width, source.channels).T)
+            first += count
+            index += 1
+        if not chunks:
+            return np.zeros((0, self.ring.shape[1]), dtype=np.float32)
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    def _write_ring(self, samples):
+        count = len(samples)
+        start = (self.ring_read + self.ring_count) % len(self.ring)
+        head = min(count, len(self.ring) - start)
+        self.ring[start:start + head] = samples[:head]
+        self.ring[:count - head] = samples[head:]
+        self.ring_count += count
+        self.filled += count
+
+    def _feed(self):
+        while True:
+            with self.lock:
+                while not self.closed and not (self.playing and self.filled < self.length
+                                               and len(self.ring) - self.ring_count >= FEED_FRAMES):
+                    self.lock.wait()
+                if self.closed:
+                    return
+                generation, track = self.generation, self.track
+                first, stop = self.filled, min(self.length, self.filled + FEED_FRAMES)
+
+            # Reading may touch the disk, so it happens outside the lock
+            samples = self._read(track, first, stop)
+
+            with self.lock:
+                if generation == self.generation:
+                    self._write_ring(samples)
+
+    def _callback(self, outdata, frames, time_info, status):
+        with self.lock:
+            count = min(frames, self.ring_count) if self.playing else 0
+            head = min(count, len(self.ring) - self.ring_read)
+            outdata[:head] = self.ring[self.ring_read:self.ring_read + head]
+            outdata[head:count] = self.ring[:count - head]
+            outdata[count:] = 0
+            self.ring_read = (self.ring_read + count) % len(self.ring)
+            self.ring_count -= count
+            self.played += count
+            if self.playing and self.played >= self.length:
+                self.playing = False
+            self.lock.notify_all()
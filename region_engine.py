@@ -0,0 +1,104 @@
+import numpy as np
+
+# Regions less than this far apart are joined, 0 keeps them as they are
+MERGE_GAP_MS = 0
+# Shorter regions are dropped
+MIN_REGION_MS = 500
+# Audio kept before and after every region, so word onsets and tails aren't clipped
+PRE_ROLL_MS = 0
+POST_ROLL_MS = 0
+# Longer regions are cut into pieces no longer than this, 0 leaves them whole.
+# It is raised to a frame more than the minimum length (and never below two
+# frames), shorter pieces would be slivers of a frame or less.
+MAX_REGION_MS = 0
+
+
+def merge_distance(merge_gap_ms=MERGE_GAP_MS, pre_roll_ms=PRE_ROLL_MS, post_roll_ms=POST_ROLL_MS):
+    # Regions closer than this are joined. Padding would make closer regions
+    # overlap, so they are joined as well.
+    return max(merge_gap_ms, pre_roll_ms + post_roll_ms)
+
+
+def effective_max_region(max_region_ms, min_region_ms=MIN_REGION_MS, frame_ms=None):
+    # The maximum length actually cut to, see MAX_REGION_MS. frame_ms is the
+    # resolution regions are found at, 1 ms when unknown.
+    if max_region_ms <= 0:
+        return max_region_ms
+    frame_ms = frame_ms or 1
+    return max(max_region_ms, max(min_region_ms, frame_ms) + frame_ms)
+
+
+def split_points(start, end, max_region_ms, energy, energy_ms, energy_from=0):
+    # Where to cut a region into pieces of at most max_region_ms. Each cut goes in
+    # the middle of the quietest frame between half and all of max_region_ms past
+    # the previous cut, and at least a quarter of it is left for the last piece.
+    # energy[i] is the level of frame energy_from + i, which covers
+    # [(energy_from + i) * energy_ms, (energy_from + i + 1) * energy_ms); it has
+    # to start no later than the region does.
+    cuts = []
+    position = start
+    while end - position > max_region_ms:
+        first = -(-(position + max_region_ms // 2) // energy_ms)
+        stop = min(energy_from + len(energy), min(position + max_region_ms, end - max_region_ms // 4) // energy_ms)
+        if stop > first:
+            levels = energy[first - energy_from:stop - energy_from]
+            position = (first + int(np.argmin(levels))) * energy_ms + energy_ms // 2
+        else:
+            position += max_region_ms  # No levels there, or frames too long to choose from
+        cuts.append(position)
+    return cuts
+
+
+def shape_regions(regions, merge_gap_ms=MERGE_GAP_MS, min_region_ms=MIN_REGION_MS, pre_roll_ms=PRE_ROLL_MS,
+                  post_roll_ms=POST_ROLL_MS, max_region_ms=MAX_REGION_MS, total_ms=None, energy=None, energy_ms=None,
+                  energy_from=0):
+    # Turn raw (start_ms, end_ms) regions, sorted by start, into the buffers to
+    # list: join close ones, drop short ones, cut long ones and pad what is left.
+    # Every step is one vectorized pass over the region arrays. Padding stays
+    # within [0, total_ms] when total_ms is given. With a per-frame energy (see
+    # split_points) long regions are cut at their quietest moments, otherwise
+    # into equal pieces.
+    regions = np.asarray(regions, dtype=np.int64).reshape(-1, 2)
+    if len(regions) == 0:
+        return regions
+    starts = regions[:, 0]
+    ends = np.maximum.accumulate(regions[:, 1])  # A region can lie inside the one before it
+
+    # Join neighbours that are closer than the merge distance
+    keep_apart = starts[1:] - ends[:-1] >= merge_distance(merge_gap_ms, pre_roll_ms, post_roll_ms)
+    starts = starts[np.concatenate(([True], keep_apart))]
+    ends = ends[np.concatenate((keep_apart, [True]))]
+
+    # Drop short ones, measured without their padding
+    long_enough = ends - starts >= min_region_ms
+    starts, ends = starts[long_enough], ends[long_enough]
+
+    # Cut long ones into pieces
+    max_region_ms = effective_max_region(max_region_ms, min_region_ms, energy_ms)
+    if max_region_ms > 0 and len(starts):
+        if energy is None:
+            pieces = np.maximum(1, -(-(ends - starts) // max_region_ms))
+        else:
+            bounds = [[start] + split_points(start, end, max_region_ms, energy, energy_ms, energy_from) + [end]
+                      for start, end in zip(starts.tolist(), ends.tolist())]
+            pieces = np.array([len(edges) - 1 for edges in bounds], dtype=np.int64)
+        owner = np.repeat(np.arange(len(starts)), pieces)
+        piece = np.arange(len(owner)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        if energy is None:
+            lengths = (ends - starts)[owner]
+            cut_starts = starts[owner] + lengths * piece // pieces[owner]
+            cut_ends = starts[owner] + lengths * (piece + 1) // pieces[owner]
+        else:
+            cut_starts = np.array([edge for edges in bounds for edge in edges[:-1]], dtype=np.int64)
+            cut_ends = np.array([edge for edges in bounds for edge in edges[1:]], dtype=np.int64)
+        first_piece, last_piece = piece == 0, piece == pieces[owner] - 1
+        starts, ends = cut_starts, cut_ends
+    else:
+        first_piece = last_piece = np.ones(len(starts), dtype=bool)
+
+    # Pad the outer edges, pieces of one region still meet where they were cut
+    starts = np.where(first_piece, np.maximum(starts - pre_roll_ms, 0), starts)
+    ends = np.where(last_piece, ends + post_roll_ms, ends)
+    if total_ms is not None:
+        ends = np.minimum(ends, max(total_ms, 0))
+    return np.stack((starts, ends), axis=1)
@@ -0,0 +1,153 @@
+import numpy as np
+
+# Per-segment flags
+REPEAT = 1    # Played twice in the output
+MERGE = 2     # Ticked for the next merge
+EXCLUDED = 4  # Left out of the list and the output
+MERGED = 8    # Made by merging other segments
+
+
+class SegmentTable:
+    # The detected segments of the loaded file. A segment keeps the id it was
+    # added with however the list is edited, so callbacks and undo history hold
+    # ids and nothing has to be renumbered afterwards. Regions and flags live in
+    # arrays indexed by id; `order` lists the ids top to bottom and `positions`
+    # maps each id back to its place in it (-1 once merged away).
+
+    def __init__(self, capacity=1024):
+        self.starts = np.zeros(capacity, dtype=np.int64)
+        self.ends = np.zeros(capacity, dtype=np.int64)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.positions = np.full(capacity, -1, dtype=np.int64)
+        self.buffers = []
+        self.order = []
+
+    def __len__(self):
+        return len(self.order)
+
+    def _new_id(self, region, buf, flags):
+        seg_id = len(self.buffers)
+        if seg_id == len(self.flags):
+            # Double the arrays, appending stays amortized constant time
+            grow = len(self.flags)
+            self.starts = np.concatenate((self.starts, np.zeros(grow, dtype=np.int64)))
+            self.ends = np.concatenate((self.ends, np.zeros(grow, dtype=np.int64)))
+            self.flags = np.concatenate((self.flags, np.zeros(grow, dtype=np.uint8)))
+            self.positions = np.concatenate((self.positions, np.full(grow, -1, dtype=np.int64)))
+        self.starts[seg_id], self.ends[seg_id] = region
+        self.flags[seg_id] = flags
+        self.buffers.append(buf)
+        return seg_id
+
+    def add(self, region, buf):
+        # Append a segment at the bottom of the list, returns its id
+        seg_id = self._new_id(region, buf, 0)
+        self.positions[seg_id] = len(self.order)
+        self.order.append(seg_id)
+        return seg_id
+
+    def contains(self, seg_id):
+        return 0 <= seg_id < len(self.buffers) and self.positions[seg_id] >= 0
+
+    def position(self, seg_id):
+        return int(self.positions[seg_id])
+
+    def region(self, seg_id):
+        return int(self.starts[seg_id]), int(self.ends[seg_id])
+
+    def has(self, seg_id, flag):
+        return bool(self.flags[seg_id] & flag)
+
+    def toggle(self, seg_id, flag):
+        self.flags[seg_id] ^= flag
+        return self.has(seg_id, flag)
+
+    def clear_flag(self, flag):
+        self.flags[:len(self.buffers)] &= ~flag & 0xFF
+
+    def with_flag(self, flag):
+        # Ids with the flag set, top to bottom
+        order = np.asarray(self.order, dtype=np.int64)
+        return order[(self.flags[order] & flag) != 0].tolist()
+
+    def without_flag(self, flag):
+        order = np.asarray(self.order, dtype=np.int64)
+        return order[(self.flags[order] & flag) == 0].tolist()
+
+    def positions_with(self, flag):
+        order = np.asarray(self.order, dtype=np.int64)
+        return np.flatnonzero(self.flags[order] & flag).tolist()
+
+    def ordered_buffers(self):
+        return [self.buffers[seg_id] for seg_id in self.order]
+
+    def describe(self, seg_id):
+        start, end = self.region(seg_id)
+        name = "Merged Buffer" if self.has(seg_id, MERGED) else "Buffer"
+        return f'{name} {self.position(seg_id)}: {start}ms - {end}ms ({(end - start) / 1000.0:.2f}s)'
+
+    def swap(self, first, second):
+        # Exchange the segments at two positions
+        a, b = self.order[first], self.order[second]
+        self.order[first], self.order[second] = b, a
+        self.positions[a], self.positions[b] = second, first
+
+    def merge(self, seg_ids, buf):
+        # Replace the segments by one at the place of the topmost of them, spanning
+        # from its start to the end of the bottom one. It keeps the topmost
+        # segment's repeat and exclude flags. Returns the new id.
+        places = sorted(self.position(seg_id) for seg_id in seg_ids)
+        top, bottom = self.order[places[0]], self.order[places[-1]]
+        flags = (self.flags[top] & (REPEAT | EXCLUDED)) | MERGED
+        merged_id = self._new_id((self.starts[top], self.ends[bottom]), buf, flags)
+        self.collapse(seg_ids, merged_id)
+        return merged_id
+
+    def collapse(self, seg_ids, merged_id):
+        # Put merged_id in the place of the topmost of the segments and take them
+        # all out of the list. merge() does this for a new segment, redoing a
+        # merge does it again for the one made then.
+        places = sorted(self.position(seg_id) for seg_id in seg_ids)
+        self.order[places[0]] = merged_id
+        for place in reversed(places[1:]):
+            del self.order[place]
+        self.positions[np.asarray(seg_ids, dtype=np.int64)] = -1
+        self.positions[merged_id] = places[0]
+        self._renumber(places[0] + 1)
+
+    def expand(self, merged_id, seg_ids, places):
+        # Undo collapse(): take merged_id out and put the segments back at the
+        # places they had, seg_ids and places both sorted top to bottom
+        self.positions[merged_id] = -1
+        self.order[places[0]] = seg_ids[0]
+        for place, seg_id in zip(places[1:], seg_ids[1:]):
+            self.order.insert(place, seg_id)
+        self._renumber(places[0])
+
+    def _renumber(self, first):
+        # Only the segments from this position down can have moved
+        below = np.asarray(self.order[first:], dtype=np.int64)
+        self.positions[below] = np.arange(first, first + len(below))
+
+    def snapshot(self):
+        # Everything but the buffers as plain lists, e.g. for a session file
+        count = len(self.buffers)
+        return {
+            'starts': self.starts[:count].tolist(),
+            'ends': self.ends[:count].tolist(),
+            'flags': self.flags[:count].tolist(),
+            'order': list(self.order),
+        }
+
+    @classmethod
+    def restore(cls, state, buffers):
+        # Table from a snapshot() and the buffer of every id in it
+        count = len(buffers)
+        table = cls(max(1024, count))
+        table.starts[:count] = state['starts']
+        table.ends[:count] = state['ends']
+        table.flags[:count] = state['flags']
+        table.buffers = list(buffers)
+        table.order = list(state['order'])
+        table.positions[np.asarray(table.order, dtype=np.int64)] = np.arange(len(table.order))
+        return table
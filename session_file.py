@@ -0,0 +1,65 @@
+import json
+import os
+
+from audio_sources import RegionView, MergedView
+from segment_table import SegmentTable
+
+# Bump when the layout changes, older sessions are then refused
+SESSION_VERSION = 3
+SESSION_EXTENSION = ".vbsession"
+
+
+def session_data(files, settings, segments, journal):
+    # The edit state of a project: segment boundaries, flags and order, the
+    # detection settings and the undo history. No audio, the sources are found
+    # again by path and checked against their content hash. files holds
+    # (path, cache key, source id) of every file, in project order.
+    index = {source_id: i for i, (_, _, source_id) in enumerate(files)}
+    segment_sources = []
+    merged = {}
+    for seg_id, buf in enumerate(segments.buffers):
+        if isinstance(buf, MergedView):
+            merged[str(seg_id)] = [[index[part.source_id], part.start_ms, part.end_ms] for part in buf.parts]
+            segment_sources.append(index[buf.parts[0].source_id])
+        else:
+            segment_sources.append(index[buf.source_id])
+    return {
+        'version': SESSION_VERSION,
+        'sources': [{'path': os.path.abspath(path), 'key': key} for path, key, _ in files],
+        'settings': settings,
+        'segments': segments.snapshot(),
+        'segment_sources': segment_sources,
+        'merged': merged,
+        'journal': journal.snapshot(),
+    }
+
+
+def save_session(path, data):
+    # Write next to the target and rename, so a crash never leaves half a session
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(temp_path, path)
+
+
+def load_session(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != SESSION_VERSION:
+        raise ValueError(f"unsupported session version {data.get('version')}")
+    return data
+
+
+def restore_segments(data, source_ids):
+    # SegmentTable of a loaded session, with buffers into the given sources, one
+    # per entry of data['sources']
+    state = data['segments']
+    buffers = []
+    for seg_id, (start, end) in enumerate(zip(state['starts'], state['ends'])):
+        parts = data['merged'].get(str(seg_id))
+        if parts is None:
+            buffers.append(RegionView(source_ids[data['segment_sources'][seg_id]], start, end))
+        else:
+            buffers.append(MergedView([RegionView(source_ids[source], part_start, part_end)
+                                       for source, part_start, part_end in parts]))
+    return SegmentTable.restore(state, buffers)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+from pydub import AudioSegment
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthesize
+
+
+@pytest.fixture(scope='session')
+def synthesized(tmp_path_factory):
+    # Speech-like recordings made by the benchmark's synthesizer, one WAV per
+    # length, loaded as AudioSegments
+    made = {}
+
+    def make(seconds, seed=1):
+        if (seconds, seed) not in made:
+            path = str(tmp_path_factory.mktemp('audio') / f'speech-{seconds}s-{seed}.wav')
+            synthesize(path, seconds, seed=seed)
+            made[seconds, seed] = AudioSegment.from_wav(path)
+        return made[seconds, seed]
+
+    return make
+
+
+@pytest.fixture(scope='session')
+def speech(synthesized):
+    return synthesized(120)
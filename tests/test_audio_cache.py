@@ -0,0 +1,52 @@
+import threading
+
+import numpy as np
+
+from audio_cache import AudioCache
+from audio_sources import PcmSource
+from vad_engine import FrameDecisions
+
+ROUNDS = 40
+
+
+def decisions():
+    return FrameDecisions(np.zeros(1000, dtype=np.uint8), 30, 1000, np.zeros(1000, dtype=np.float32))
+
+
+def test_concurrent_stores_loads_and_evictions(tmp_path):
+    # A cache too small for more than one entry, so every store evicts the
+    # entries the other threads are writing, reading and evicting meanwhile
+    cache = AudioCache(str(tmp_path), max_bytes=1)
+    errors = []
+
+    def store(worker):
+        try:
+            for i in range(ROUNDS):
+                key = f"{worker}-{i}"
+                source = cache.store_source(key, PcmSource(16000, 1, 2, b'\0' * 64000))
+                cache.store_decisions(key, {'frame_ms': 30}, decisions())
+                source.close()
+                # Another thread's entry, there or evicted already
+                other = cache.load_source(f"{(worker + 1) % 4}-{i}")
+                if other is not None:
+                    other.close()
+                cache.load_decisions(f"{(worker + 1) % 4}-{i}", {'frame_ms': 30})
+        except Exception as e:
+            errors.append(e)
+
+    def evict():
+        try:
+            for _ in range(ROUNDS * 4):
+                cache.evict()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=store, args=(worker,)) for worker in range(4)]
+    threads += [threading.Thread(target=evict) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    cache.evict()
+    assert cache.size() == 0
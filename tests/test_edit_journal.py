@@ -0,0 +1,109 @@
+from edit_journal import EditJournal, TABLE_LIMIT
+from segment_table import SegmentTable, REPEAT, EXCLUDED
+
+
+def table_of(count):
+    table = SegmentTable()
+    for i in range(count):
+        table.add((1000 * i, 1000 * i + 500), i)
+    return table
+
+
+def state_of(table):
+    return table.order[:], table.flags[:len(table.buffers)].tolist()
+
+
+def test_undo_and_redo_across_merge_and_swap():
+    journal = EditJournal(table_of(6))
+    states = [state_of(journal.table)]
+    journal.toggle(2, REPEAT)
+    states.append(state_of(journal.table))
+    journal.swap(0, 4)
+    states.append(state_of(journal.table))
+    journal.merge([2, 1, 3], 'merged')
+    states.append(state_of(journal.table))
+    journal.swap(1, 2)
+    states.append(state_of(journal.table))
+    journal.toggle(0, EXCLUDED)
+    states.append(state_of(journal.table))
+
+    for expected in reversed(states[:-1]):
+        assert journal.undo() is not None
+        assert state_of(journal.table)[0] == expected[0]
+    assert journal.undo() is None
+    # The merged segment stays in the table, out of the list
+    assert journal.table.order == states[0][0]
+    assert journal.table.flags[:6].tolist() == states[0][1]
+
+    for expected in states[1:]:
+        assert journal.redo() is not None
+        assert state_of(journal.table)[0] == expected[0]
+    assert journal.redo() is None
+    # The merged segment made first is reused, flags and all
+    assert state_of(journal.table) == states[-1]
+    assert len(journal.table.buffers) == 7
+
+
+def test_new_edit_clears_redo():
+    journal = EditJournal(table_of(3))
+    journal.swap(0, 1)
+    journal.undo()
+    assert journal.can_redo()
+    journal.toggle(0, REPEAT)
+    assert not journal.can_redo()
+
+
+def test_replacements_in_a_row_are_one_step():
+    first = table_of(3)
+    journal = EditJournal(first)
+    journal.replace(table_of(4), 'a', 'b')
+    journal.replace(table_of(5), 'b', 'c')
+    assert len(journal.undo_stack) == 1
+    edit = journal.undo()
+    assert journal.table is first
+    assert (edit[3], edit[4]) == ('a', 'c')
+
+
+def test_replacement_undo_brings_back_the_old_edits():
+    first = table_of(3)
+    journal = EditJournal(first)
+    journal.swap(0, 2)
+    journal.replace(table_of(4))
+    journal.toggle(1, REPEAT)
+    journal.undo()
+    journal.undo()
+    assert journal.table is first
+    journal.undo()
+    assert first.order == [0, 1, 2]
+
+
+def test_table_entries_are_bounded():
+    journal = EditJournal(table_of(2))
+    journal.swap(0, 1)
+    for i in range(TABLE_LIMIT + 5):
+        journal.replace(table_of(3))
+        journal.toggle(0, REPEAT)
+    replacements = [edit for edit in journal.undo_stack if edit[0] == 'table']
+    assert len(replacements) == TABLE_LIMIT
+    # The oldest replacement went with the edits before it, the toggle made
+    # after it stays and applies to the table it brought in
+    assert len(journal.undo_stack) == 2 * TABLE_LIMIT + 1
+    while journal.undo() is not None:
+        pass
+    assert journal.table.has(0, REPEAT) is False
+
+
+def test_snapshot_keeps_edits_since_the_last_replacement():
+    journal = EditJournal(table_of(4))
+    journal.toggle(0, REPEAT)
+    journal.replace(table_of(4))
+    journal.swap(0, 3)
+    journal.merge([1, 2], 'merged')
+    journal.undo()
+    restored = EditJournal.restore(journal.table, journal.snapshot())
+    assert restored.undo() is not None
+    assert restored.table.order == [0, 1, 2, 3]
+    assert restored.undo() is None
+    restored.redo()
+    restored.redo()
+    assert restored.table.order == [3, 4, 0]
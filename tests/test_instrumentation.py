@@ -0,0 +1,28 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+
+RECORDS = 200
+# Larger than a file buffer, so a buffered write would go out in pieces
+PADDING = 'x' * 20000
+
+
+def log_records(path, worker):
+    instrumentation.set_log_file(path)
+    try:
+        for i in range(RECORDS):
+            instrumentation.record({'worker': worker, 'i': i, 'padding': PADDING})
+    finally:
+        instrumentation.set_log_file(None)
+
+
+def test_records_from_processes_never_interleave(tmp_path):
+    path = str(tmp_path / 'log.jsonl')
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        list(pool.map(log_records, [path] * 4, range(4)))
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 4 * RECORDS
+    for worker in range(4):
+        assert [r['i'] for r in records if r['worker'] == worker] == list(range(RECORDS))
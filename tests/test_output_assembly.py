@@ -0,0 +1,79 @@
+import os
+import wave
+
+import numpy as np
+import pytest
+
+from audio_io import Resampler, pcm_to_float, float_to_pcm16
+from output_assembly import build_layout, silence_frames, export_output
+
+REPEAT = (1, 4)
+EXCLUDED = (2,)
+
+
+@pytest.fixture(scope='module')
+def buffers(speech):
+    # Pieces of speech 0.7 to 2.5 s long, like detected buffers
+    starts = range(0, 60000, 6000)
+    return [speech[start:start + 700 + 200 * i] for i, start in enumerate(starts)]
+
+
+def one_shot(buffers, frame_rate):
+    # The whole output in memory at once: the layout's buffers with zeros for
+    # the silences, as 16-bit mono samples
+    layout = build_layout(buffers, REPEAT, EXCLUDED)
+    data = b''.join(buffers[value].raw_data if kind == 'buffer' else bytes(2 * silence_frames(value, frame_rate))
+                    for kind, value in layout)
+    return np.frombuffer(data, dtype='<i2')
+
+
+def read_wav(path):
+    with wave.open(path, 'rb') as wav_file:
+        samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+        return wav_file.getframerate(), wav_file.getnchannels(), samples.reshape(-1, wav_file.getnchannels())
+
+
+def test_streamed_export_matches_one_shot(buffers, tmp_path):
+    outpath = str(tmp_path / 'out.wav')
+    duration = export_output(buffers, outpath, REPEAT, EXCLUDED)
+    frame_rate, channels, samples = read_wav(outpath)
+    expected = one_shot(buffers, 44100)
+    assert (frame_rate, channels) == (44100, 2)
+    assert np.array_equal(samples[:, 0], expected)
+    assert np.array_equal(samples[:, 1], expected)
+    assert duration == round(1000 * len(expected) / 44100)
+
+
+def test_streamed_resampling_matches_one_shot(buffers, tmp_path):
+    # The resampler carries its state from chunk to chunk and skips the
+    # silences, which is float rounding away from resampling all at once
+    outpath = str(tmp_path / 'out.wav')
+    export_output(buffers, outpath, REPEAT, EXCLUDED, {'frame_rate': 48000, 'channels': 1})
+    frame_rate, channels, samples = read_wav(outpath)
+    resampler = Resampler(44100, 48000, 1)
+    whole = pcm_to_float(one_shot(buffers, 44100).tobytes(), 2, 1)
+    expected = np.frombuffer(float_to_pcm16(np.concatenate((resampler.process(whole), resampler.flush()), axis=1)),
+                             dtype='<i2')
+    assert (frame_rate, channels) == (48000, 1)
+    assert len(samples) == len(expected)
+    assert np.abs(samples[:, 0].astype(int) - expected).max() <= 1
+
+
+def test_on_write_reports_progress_and_cancels(buffers, tmp_path):
+    outpath = str(tmp_path / 'out.wav')
+    reported = []
+    export_output(buffers, outpath, REPEAT, EXCLUDED, on_write=lambda written, total: reported.append((written, total)))
+    assert len(reported) > len(buffers)
+    assert reported[-1][0] == reported[-1][1] == os.path.getsize(outpath) - 44
+
+    class Cancelled(Exception):
+        pass
+
+    def cancel(written, total):
+        if written > total // 2:
+            raise Cancelled()
+
+    cancelled = str(tmp_path / 'cancelled.wav')
+    with pytest.raises(Cancelled):
+        export_output(buffers, cancelled, REPEAT, EXCLUDED, on_write=cancel)
+    assert os.listdir(tmp_path) == ['out.wav']
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from region_engine import shape_regions, effective_max_region
+
+FRAME_MS = 30
+
+
+def lengths(regions):
+    return [int(end - start) for start, end in regions]
+
+
+@pytest.fixture
+def energy():
+    # Levels of 20 s of frames, quiet every 700 ms
+    levels = np.ones(20000 // FRAME_MS, dtype=np.float32)
+    levels[::700 // FRAME_MS] = 0.01
+    return levels
+
+
+def test_long_region_is_cut_below_max_length(energy):
+    pieces = shape_regions([(0, 20000)], max_region_ms=3000, energy=energy, energy_ms=FRAME_MS)
+    assert pieces[0, 0] == 0 and pieces[-1, 1] == 20000
+    assert np.array_equal(pieces[1:, 0], pieces[:-1, 1])
+    assert max(lengths(pieces)) <= 3000
+
+
+@pytest.mark.parametrize('max_region_ms', [1, FRAME_MS - 1, FRAME_MS, 300])
+def test_max_length_is_raised_above_min_length(energy, max_region_ms):
+    # At or below a frame the cuts were one frame or no time at all apart
+    pieces = shape_regions([(0, 20000)], min_region_ms=500, max_region_ms=max_region_ms, energy=energy,
+                           energy_ms=FRAME_MS)
+    expected = shape_regions([(0, 20000)], min_region_ms=500, max_region_ms=500 + FRAME_MS, energy=energy,
+                             energy_ms=FRAME_MS)
+    assert np.array_equal(pieces, expected)
+    assert min(lengths(pieces)) > FRAME_MS
+
+
+def test_max_length_without_min_length_keeps_two_frames(energy):
+    assert effective_max_region(1, 0, FRAME_MS) == 2 * FRAME_MS
+    pieces = shape_regions([(0, 20000)], min_region_ms=0, max_region_ms=1, energy=energy, energy_ms=FRAME_MS)
+    assert min(lengths(pieces)) >= FRAME_MS
+
+
+def test_equal_pieces_without_levels():
+    pieces = shape_regions([(0, 10000)], min_region_ms=500, max_region_ms=1)
+    assert np.array_equal(pieces, shape_regions([(0, 10000)], min_region_ms=500, max_region_ms=501))
+    assert effective_max_region(0) == 0
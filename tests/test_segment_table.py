@@ -0,0 +1,90 @@
+import numpy as np
+
+from segment_table import SegmentTable, REPEAT, MERGE, EXCLUDED, MERGED
+
+
+def table_of(count, capacity=1024):
+    # Segments 1 s apart, each buffer just its id so they can be told apart
+    table = SegmentTable(capacity)
+    for i in range(count):
+        table.add((1000 * i, 1000 * i + 500), i)
+    return table
+
+
+def assert_consistent(table):
+    # Every listed id maps back to its place, every other id to -1
+    for place, seg_id in enumerate(table.order):
+        assert table.position(seg_id) == place
+    listed = set(table.order)
+    for seg_id in range(len(table.buffers)):
+        assert table.contains(seg_id) == (seg_id in listed)
+
+
+def test_ids_and_positions_survive_growing():
+    table = table_of(10, capacity=4)
+    assert len(table) == 10
+    assert table.order == list(range(10))
+    assert table.region(7) == (7000, 7500)
+    assert table.ordered_buffers() == list(range(10))
+    assert not table.contains(10)
+    assert_consistent(table)
+
+
+def test_flags_are_per_id_and_follow_the_order():
+    table = table_of(5)
+    assert table.toggle(1, REPEAT)
+    assert table.toggle(3, EXCLUDED)
+    assert table.toggle(3, MERGE)
+    table.swap(1, 3)
+    assert table.has(1, REPEAT) and not table.has(1, EXCLUDED)
+    assert table.with_flag(EXCLUDED) == [3]
+    assert table.positions_with(EXCLUDED) == [1]
+    assert table.positions_with(REPEAT) == [3]
+    assert table.without_flag(EXCLUDED) == [0, 2, 1, 4]
+    assert not table.toggle(1, REPEAT)
+    table.clear_flag(MERGE)
+    assert table.with_flag(MERGE) == []
+    assert table.has(3, EXCLUDED)
+
+
+def test_swap_keeps_ids():
+    table = table_of(4)
+    table.swap(0, 3)
+    assert table.order == [3, 1, 2, 0]
+    assert table.region(3) == (3000, 3500)
+    assert_consistent(table)
+
+
+def test_merge_and_expand_restore_the_order():
+    table = table_of(6)
+    table.toggle(4, REPEAT)
+    table.toggle(1, EXCLUDED)
+    merged_id = table.merge([4, 1, 2], 'merged')
+    assert merged_id == 6
+    assert table.order == [0, 6, 3, 5]
+    assert table.region(merged_id) == (1000, 4500)
+    # The topmost segment's flags, not the others'
+    assert table.has(merged_id, EXCLUDED) and not table.has(merged_id, REPEAT)
+    assert table.has(merged_id, MERGED)
+    assert table.describe(merged_id) == 'Merged Buffer 1: 1000ms - 4500ms (3.50s)'
+    assert_consistent(table)
+
+    table.expand(merged_id, [1, 2, 4], [1, 2, 4])
+    assert table.order == list(range(6))
+    assert_consistent(table)
+
+    table.collapse([1, 2, 4], merged_id)
+    assert table.order == [0, 6, 3, 5]
+    assert_consistent(table)
+
+
+def test_snapshot_round_trip():
+    table = table_of(5)
+    table.toggle(2, REPEAT)
+    table.merge([0, 1], 'merged')
+    table.swap(0, 2)
+    restored = SegmentTable.restore(table.snapshot(), table.buffers)
+    assert restored.order == table.order
+    assert restored.ordered_buffers() == table.ordered_buffers()
+    assert np.array_equal(restored.flags[:6], table.flags[:6])
+    assert_consistent(restored)
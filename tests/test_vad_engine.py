@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+import webrtcvad
+
+import vad_engine
+from audio_sources import PcmSource
+from vad_engine import (detect_voice_buffers, to_vad_pcm, classify_levels, classify_levels_parallel, classify_audio,
+                        classify_source, StreamingDetector, VAD_LEVELS, VAD_SAMPLE_RATE)
+
+
+def plain_scan(audio, aggressiveness=2, frame_ms=30, max_silence_ms=200, min_region_ms=500):
+    # The frame by frame loop detection started out as: every frame through
+    # webrtcvad, no gate and no epochs, so only audio shorter than an epoch
+    # matches it
+    raw_audio = to_vad_pcm(audio).raw_data
+    vad = webrtcvad.Vad(aggressiveness)
+    frame_bytes = VAD_SAMPLE_RATE * frame_ms // 1000 * 2
+    frames = [raw_audio[i:i + frame_bytes] for i in range(0, len(raw_audio), frame_bytes)]
+    max_silence_frames = int(max_silence_ms / frame_ms)
+    regions = []
+    is_speech = False
+    start = 0
+    silence_frames = 0
+    for i, frame in enumerate(frames):
+        if len(frame) < frame_bytes:
+            break
+        if vad.is_speech(frame, VAD_SAMPLE_RATE):
+            if not is_speech:
+                start = i * frame_ms
+                is_speech = True
+            silence_frames = 0
+        elif is_speech:
+            silence_frames += 1
+            if silence_frames >= max_silence_frames:
+                regions.append((start, (i - silence_frames) * frame_ms))
+                is_speech = False
+                silence_frames = 0
+    if is_speech:
+        regions.append((start, len(frames) * frame_ms))
+    return [(s, e) for s, e in regions if e - s >= min_region_ms]
+
+
+def speech_mask(regions, length_ms):
+    mask = np.zeros(length_ms // 10 + 1, dtype=bool)
+    for start, end in regions:
+        mask[start // 10:end // 10] = True
+    return mask
+
+
+def test_ungated_detection_matches_plain_scan(speech):
+    regions, buffers = detect_voice_buffers(speech, use_gate=False)
+    assert regions == plain_scan(speech)
+    assert len(buffers) == len(regions)
+
+
+def test_gate_changes_nothing_at_speaking_level(speech):
+    assert detect_voice_buffers(speech)[0] == plain_scan(speech)
+
+
+def test_gate_drift_on_quiet_speech_is_bounded(speech):
+    # Speech 40 dB down sits right at the gate's thresholds. Skipping frames
+    # leaves webrtcvad in another state, so edges move and regions may split or
+    # join, but by no more than 5% of the speech time.
+    quiet = speech - 40
+    expected = plain_scan(quiet)
+    gated = detect_voice_buffers(quiet)[0]
+    reference = speech_mask(expected, len(quiet))
+    differs = reference ^ speech_mask(gated, len(quiet))
+    assert differs.sum() <= 0.05 * reference.sum()
+    assert abs(len(gated) - len(expected)) <= 0.05 * len(expected)
+
+
+def stream(raw_audio, chunk_bytes, use_gate=True, **settings):
+    detector = StreamingDetector(use_gate=use_gate, **settings)
+    found = []
+    for offset in range(0, len(raw_audio), chunk_bytes):
+        found.extend(region for region, _ in detector.feed(raw_audio[offset:offset + chunk_bytes]))
+    found.extend(region for region, _ in detector.finish())
+    return found, detector.decisions()
+
+
+@pytest.fixture
+def short_epochs(monkeypatch):
+    # Epochs of 30 s, so a few minutes of audio spans several of them and is
+    # long enough to be spread over processes
+    monkeypatch.setattr(vad_engine, 'VAD_EPOCH_MS', 30000)
+    monkeypatch.setattr(vad_engine, 'MIN_PARALLEL_MS', 60000)
+
+
+@pytest.mark.parametrize('use_gate', [True, False])
+def test_parallel_matches_serial(speech, short_epochs, use_gate):
+    raw_audio = to_vad_pcm(speech).raw_data
+    serial = classify_levels(raw_audio, VAD_LEVELS, 30, use_gate)
+    parallel = classify_levels_parallel(raw_audio, VAD_LEVELS, 30, use_gate, workers=2)
+    assert np.array_equal(parallel, serial)
+    assert (detect_voice_buffers(speech, use_gate=use_gate, workers=2)[0]
+            == detect_voice_buffers(speech, use_gate=use_gate)[0])
+
+
+@pytest.mark.parametrize('chunk_bytes', [1001, 32000, 10 ** 8])
+def test_streaming_matches_whole_file(speech, short_epochs, chunk_bytes):
+    raw_audio = to_vad_pcm(speech).raw_data
+    settings = dict(merge_gap_ms=300, pre_roll_ms=100, post_roll_ms=200, max_region_ms=4000)
+    regions, decisions = stream(raw_audio, chunk_bytes, **settings)
+    assert regions == detect_voice_buffers(speech, **settings)[0]
+    whole = classify_audio(speech)
+    assert np.array_equal(decisions.bits, whole.bits)
+    assert np.array_equal(decisions.energy, whole.energy)
+    assert decisions.total_frames == whole.total_frames
+
+
+def test_source_decisions_match_whole_file(speech, short_epochs):
+    source = PcmSource.from_segment(speech.set_channels(2))
+    found = classify_source(source, chunk_frames=50000)
+    whole = classify_audio(speech.set_channels(2))
+    assert np.array_equal(found.bits, whole.bits)
+    assert found.regions() == whole.regions()
+
+
+def test_streaming_without_decisions_keeps_nothing_per_frame(speech, short_epochs):
+    raw_audio = to_vad_pcm(speech).raw_data
+    detector = StreamingDetector(max_region_ms=4000, keep_decisions=False)
+    regions = []
+    longest = 0
+    for offset in range(0, len(raw_audio), 32000):
+        regions.extend(region for region, _ in detector.feed(raw_audio[offset:offset + 32000]))
+        longest = max(longest, len(detector.energy))
+    regions.extend(region for region, _ in detector.finish())
+    assert regions == detect_voice_buffers(speech, max_region_ms=4000)[0]
+    assert detector.decided == [] and detector.levels == []
+    # Levels only reach back to the start of the open region
+    assert longest * 30 < 10000
@@ -0,0 +1,607 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import webrtcvad
+import numpy as np
+from pydub import AudioSegment
+
+try:
+    import audioop
+except ImportError:
+    import pyaudioop as audioop  # Same fallback pydub uses on newer Pythons
+
+from audio_sources import RegionView
+from instrumentation import Stage, stage
+from region_engine import (MERGE_GAP_MS, MIN_REGION_MS, PRE_ROLL_MS, POST_ROLL_MS, MAX_REGION_MS, merge_distance,
+                           shape_regions)
+
+# Detection works on 16 kHz mono 16-bit PCM, which is what webrtcvad expects
+VAD_SAMPLE_RATE = 16000
+VAD_SAMPLE_WIDTH = 2
+
+# webrtcvad's aggressiveness settings. Scans keep the decisions of all of them,
+# one bit per level, so switching levels later needs no new scan.
+VAD_LEVELS = (0, 1, 2, 3)
+
+# A region ends after this much non-speech (the hangover)
+MAX_SILENCE_MS = 200
+
+# Bump whenever a change makes detection give different decisions, so cached
+# results from older versions are not reused
+DETECTION_VERSION = 3
+
+# Frames quieter than this never reach webrtcvad
+GATE_FLOOR_DBFS = -60.0
+# Frames below this level are also skipped when they barely cross zero (hum, rumble, DC drift)
+GATE_LOW_DBFS = -50.0
+GATE_MIN_ZCR = 0.01
+
+# webrtcvad keeps flagging speech for a short while after a word ends, so frames
+# this close behind a candidate are passed through even when they are quiet
+GATE_HANGOVER_MS = 300
+
+# Number of frames the pre-gate looks at in one go, keeps the float copy small
+GATE_BLOCK_FRAMES = 4096
+
+# webrtcvad adapts its noise model as it goes and never forgets its starting
+# point entirely, so a scan cannot be cut into pieces and give the same answer as
+# one long pass. Instead detection always restarts the detector at fixed epoch
+# boundaries, warming it up on the audio just before the epoch. Serial, streaming
+# and parallel scans all run exactly this per-epoch computation and agree bit for bit.
+VAD_EPOCH_MS = 5 * 60 * 1000
+EPOCH_WARMUP_MS = 10000
+
+# Below this much audio a process pool costs more than it saves
+MIN_PARALLEL_MS = 2 * VAD_EPOCH_MS
+
+
+def frame_matrix(raw_audio, samples_per_frame):
+    # View the PCM bytes as a (frames x samples) int16 matrix without copying.
+    # A trailing partial frame is left out, just like the VAD loop always did.
+    num_frames = len(raw_audio) // (samples_per_frame * VAD_SAMPLE_WIDTH)
+    samples = np.frombuffer(raw_audio, dtype='<i2', count=num_frames * samples_per_frame)
+    return samples.reshape(num_frames, samples_per_frame)
+
+
+def dbfs_to_rms(dbfs):
+    return 32768.0 * 10 ** (dbfs / 20.0)
+
+
+def energy_gate(frames, floor_dbfs=GATE_FLOOR_DBFS, low_dbfs=GATE_LOW_DBFS, min_zcr=GATE_MIN_ZCR):
+    # Returns a bool per frame, True where the frame could contain speech
+    floor_rms = dbfs_to_rms(floor_dbfs)
+    low_rms = dbfs_to_rms(low_dbfs)
+    candidates = np.zeros(len(frames), dtype=bool)
+
+    for block_start in range(0, len(frames), GATE_BLOCK_FRAMES):
+        block = frames[block_start:block_start + GATE_BLOCK_FRAMES].astype(np.float32)
+        block -= block.mean(axis=1, keepdims=True)  # Remove DC offset before measuring
+
+        rms = np.sqrt(np.einsum('ij,ij->i', block, block) / block.shape[1])
+        sign_changes = np.count_nonzero(np.diff(np.signbit(block), axis=1), axis=1)
+        zcr = sign_changes / block.shape[1]
+
+        silent = (rms < floor_rms) | ((rms < low_rms) & (zcr < min_zcr))
+        candidates[block_start:block_start + len(block)] = ~silent
+
+    return candidates
+
+
+def frame_rms(frames):
+    # Level of every frame with its DC offset removed, used to find quiet points
+    # to cut long regions at. Integer arithmetic makes it come out the same
+    # however the frames are split into chunks.
+    rms = np.zeros(len(frames), dtype=np.float32)
+    n = frames.shape[1]
+    for block_start in range(0, len(frames), GATE_BLOCK_FRAMES):
+        block = frames[block_start:block_start + GATE_BLOCK_FRAMES].astype(np.int64)
+        total = block.sum(axis=1)
+        power = n * np.einsum('ij,ij->i', block, block) - total * total
+        rms[block_start:block_start + len(block)] = np.sqrt(power) / n
+    return rms
+
+
+def extend_forward(mask, count):
+    # Also mark the `count` frames following every marked frame
+    if count <= 0 or not mask.any():
+        return mask
+    marked = np.concatenate(([0], np.cumsum(mask)))
+    ends = np.arange(1, len(mask) + 1)
+    starts = np.maximum(ends - count - 1, 0)
+    return (marked[ends] - marked[starts]) > 0
+
+
+def gate_with_hangover(frames, frame_ms, previous_gate=None):
+    # Pre-gate decisions, extended forward to cover webrtcvad's hangover.
+    # previous_gate is the energy_gate output for the frames just before these ones.
+    gate = energy_gate(frames)
+    if previous_gate is None or len(previous_gate) == 0:
+        return extend_forward(gate, GATE_HANGOVER_MS // frame_ms)
+    padded = np.concatenate((previous_gate, gate))
+    return extend_forward(padded, GATE_HANGOVER_MS // frame_ms)[len(previous_gate):]
+
+
+def new_detectors(levels):
+    return [(1 << level, webrtcvad.Vad(level)) for level in levels]
+
+
+def run_vad(detectors, raw_audio, frame_bytes, first, stop, candidates):
+    # Ask each (bit, webrtcvad.Vad) detector about frames [first, stop) that are
+    # marked in candidates, everything else stays non-speech. Returns a uint8 per
+    # frame with the bits of the detectors that heard speech. Frame 0 is the
+    # start of raw_audio.
+    checks = [(bit, vad.is_speech) for bit, vad in detectors]
+    view = memoryview(raw_audio)
+    speech = np.zeros(stop - first, dtype=np.uint8)
+    for i in (np.flatnonzero(candidates[first:stop]) + first).tolist():
+        offset = i * frame_bytes
+        frame = view[offset:offset + frame_bytes]
+        bits = 0
+        for bit, is_speech in checks:
+            if is_speech(frame, VAD_SAMPLE_RATE):
+                bits |= bit
+        speech[i - first] = bits
+    return speech
+
+
+def classify_epoch(raw_audio, candidates, first, stop, levels, frame_ms):
+    # Decisions for frames [first, stop) of one epoch, from fresh detectors that
+    # have first been run over the warm-up frames before `first`
+    frame_bytes = VAD_SAMPLE_RATE * frame_ms // 1000 * VAD_SAMPLE_WIDTH
+    detectors = new_detectors(levels)
+    run_vad(detectors, raw_audio, frame_bytes, max(0, first - EPOCH_WARMUP_MS // frame_ms), first, candidates)
+    return run_vad(detectors, raw_audio, frame_bytes, first, stop, candidates)
+
+
+def frame_candidates(frames, frame_ms, use_gate):
+    if use_gate:
+        return gate_with_hangover(frames, frame_ms)
+    return np.ones(len(frames), dtype=bool)
+
+
+def classify_levels(raw_audio, levels=VAD_LEVELS, frame_ms=30, use_gate=True, progress=None):
+    # Per-frame speech decisions for 16 kHz mono PCM at several aggressiveness
+    # levels, a uint8 per full frame with bit n set where level n heard speech.
+    # progress is called with the fraction done after every epoch.
+    frames = frame_matrix(raw_audio, VAD_SAMPLE_RATE * frame_ms // 1000)
+    candidates = frame_candidates(frames, frame_ms, use_gate)
+    epoch_frames = VAD_EPOCH_MS // frame_ms
+
+    speech = np.zeros(len(frames), dtype=np.uint8)
+    for first in range(0, len(frames), epoch_frames):
+        stop = min(len(frames), first + epoch_frames)
+        speech[first:stop] = classify_epoch(raw_audio, candidates, first, stop, levels, frame_ms)
+        if progress is not None:
+            progress(stop / len(frames))
+    return speech
+
+
+def _classify_shard(audio_name, speech_name, num_frames, first, stop, levels, frame_ms, use_gate):
+    # Worker side of classify_levels_parallel, handles one epoch. Reads PCM from and
+    # writes decisions to shared memory, so no audio is pickled between processes.
+    samples_per_frame = VAD_SAMPLE_RATE * frame_ms // 1000
+    frame_bytes = samples_per_frame * VAD_SAMPLE_WIDTH
+    audio_shm = shared_memory.SharedMemory(name=audio_name)
+    speech_shm = shared_memory.SharedMemory(name=speech_name)
+    try:
+        # The shard overlaps the previous one by the warm-up, plus the gate's
+        # hangover so its pre-gate matches a full scan exactly
+        shard_start = max(0, first - EPOCH_WARMUP_MS // frame_ms - GATE_HANGOVER_MS // frame_ms)
+        raw = audio_shm.buf[shard_start * frame_bytes:stop * frame_bytes]
+        frames = frame_matrix(raw, samples_per_frame)
+        candidates = frame_candidates(frames, frame_ms, use_gate)
+        decisions = classify_epoch(raw, candidates, first - shard_start, stop - shard_start, levels, frame_ms)
+
+        speech = np.ndarray((num_frames,), dtype=np.uint8, buffer=speech_shm.buf)
+        speech[first:stop] = decisions
+        del speech, frames, raw
+    finally:
+        audio_shm.close()
+        speech_shm.close()
+
+
+def classify_levels_parallel(raw_audio, levels=VAD_LEVELS, frame_ms=30, use_gate=True, workers=None, progress=None):
+    # Same decisions as classify_levels, with the epochs spread over a process pool
+    workers = workers or os.cpu_count() or 1
+    frame_bytes = VAD_SAMPLE_RATE * frame_ms // 1000 * VAD_SAMPLE_WIDTH
+    num_frames = len(raw_audio) // frame_bytes
+    if workers <= 1 or num_frames * frame_ms < MIN_PARALLEL_MS:
+        return classify_levels(raw_audio, levels, frame_ms, use_gate, progress)
+
+    epoch_frames = VAD_EPOCH_MS // frame_ms
+    audio_shm = shared_memory.SharedMemory(create=True, size=num_frames * frame_bytes)
+    speech_shm = shared_memory.SharedMemory(create=True, size=num_frames)
+    try:
+        audio_shm.buf[:num_frames * frame_bytes] = memoryview(raw_audio)[:num_frames * frame_bytes]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [
+                pool.submit(_classify_shard, audio_shm.name, speech_shm.name, num_frames,
+                            first, min(num_frames, first + epoch_frames), levels, frame_ms, use_gate)
+                for first in range(0, num_frames, epoch_frames)
+            ]
+            try:
+                for done, job in enumerate(as_completed(jobs), 1):
+                    job.result()
+                    if progress is not None:
+                        progress(done / len(jobs))
+            except BaseException:
+                # Don't start the remaining epochs, e.g. when progress cancelled the run
+                for job in jobs:
+                    job.cancel()
+                raise
+        return np.ndarray((num_frames,), dtype=np.uint8, buffer=speech_shm.buf).copy()
+    finally:
+        audio_shm.close()
+        audio_shm.unlink()
+        speech_shm.close()
+        speech_shm.unlink()
+
+
+def break_frames(frame_ms, max_silence_ms=MAX_SILENCE_MS, merge_gap_ms=MERGE_GAP_MS):
+    # Non-speech frames that split two regions. Joining regions that end up less
+    # than merge_gap_ms apart is the same as asking for a longer break, as a
+    # closed region ends at the start of its last speech frame.
+    return max(int(max_silence_ms / frame_ms), -(-merge_gap_ms // frame_ms) - 1)
+
+
+def speech_to_regions(speech, frame_ms, max_silence_frames, total_frames):
+    # Turn per-frame decisions into (start_ms, end_ms) regions.
+    # Speech frames separated by fewer than max_silence_frames non-speech frames
+    # belong to the same region. A closed region ends at the start of its last
+    # speech frame, an open one runs to the end of the audio (total_frames,
+    # which counts a trailing partial frame).
+    speech_idx = np.flatnonzero(speech)
+    if len(speech_idx) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    gaps = np.diff(speech_idx) - 1
+    breaks = np.flatnonzero(gaps >= max_silence_frames)
+    first_frames = np.concatenate(([speech_idx[0]], speech_idx[breaks + 1]))
+    last_frames = np.concatenate((speech_idx[breaks], [speech_idx[-1]]))
+
+    regions = np.empty((len(first_frames), 2), dtype=np.int64)
+    regions[:, 0] = first_frames * frame_ms
+    regions[:, 1] = last_frames * frame_ms
+
+    trailing_silence = len(speech) - 1 - speech_idx[-1]
+    if trailing_silence < max_silence_frames:
+        regions[-1, 1] = total_frames * frame_ms
+    return regions
+
+
+class FrameDecisions:
+    # The per-frame VAD decisions of a whole file at every aggressiveness level,
+    # with the level of every frame. Regions for any level, hangover, merge gap,
+    # minimum and maximum length are derived from these in milliseconds, so
+    # tuning them never runs webrtcvad again.
+
+    def __init__(self, bits, frame_ms, total_frames, energy):
+        self.bits = bits  # uint8 per full frame, bit n set where level n heard speech
+        self.frame_ms = frame_ms
+        self.total_frames = total_frames  # Also counts a trailing partial frame
+        self.energy = energy  # frame_rms() of every full frame
+
+    def speech(self, aggressiveness):
+        return (self.bits & (1 << aggressiveness)) != 0
+
+    def regions(self, aggressiveness=2, max_silence_ms=MAX_SILENCE_MS, merge_gap_ms=MERGE_GAP_MS,
+                min_region_ms=MIN_REGION_MS, pre_roll_ms=PRE_ROLL_MS, post_roll_ms=POST_ROLL_MS,
+                max_region_ms=MAX_REGION_MS):
+        with stage('regions', frames=self.total_frames) as measured:
+            regions = speech_to_regions(self.speech(aggressiveness), self.frame_ms, int(max_silence_ms / self.frame_ms),
+                                        self.total_frames)
+            regions = shape_regions(regions, merge_gap_ms, min_region_ms, pre_roll_ms, post_roll_ms, max_region_ms,
+                                    self.total_frames * self.frame_ms, self.energy, self.frame_ms)
+            measured.add(items=len(regions))
+            return [(int(start), int(end)) for start, end in regions]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, bits=self.bits, frame_ms=self.frame_ms, total_frames=self.total_frames, energy=self.energy)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['bits'], int(data['frame_ms']), int(data['total_frames']), data['energy'])
+
+
+def to_vad_pcm(audio):
+    return audio.set_channels(1).set_frame_rate(VAD_SAMPLE_RATE).set_sample_width(VAD_SAMPLE_WIDTH)
+
+
+class VadPcmConverter:
+    # Chunk-by-chunk version of to_vad_pcm for streamed PCM. Uses the same audioop
+    # calls as pydub and carries the resampler state over, so the result is
+    # byte-identical to converting the whole file at once.
+
+    def __init__(self, frame_rate, channels, sample_width=2):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.state = None
+
+    def convert(self, pcm):
+        if self.channels == 2:
+            pcm = audioop.tomono(pcm, self.sample_width, 0.5, 0.5)
+        elif self.channels > 2:
+            # pydub sums each channel integer-divided by the channel count
+            dtype = {1: np.int8, 2: '<i2', 4: '<i4'}[self.sample_width]
+            samples = np.frombuffer(pcm, dtype=dtype).reshape(-1, self.channels).astype(np.int64)
+            pcm = (samples // self.channels).sum(axis=1).astype(dtype).tobytes()
+        if self.frame_rate != VAD_SAMPLE_RATE and pcm:
+            pcm, self.state = audioop.ratecv(pcm, self.sample_width, 1, self.frame_rate, VAD_SAMPLE_RATE, self.state)
+        if self.sample_width != VAD_SAMPLE_WIDTH:
+            pcm = audioop.lin2lin(pcm, self.sample_width, VAD_SAMPLE_WIDTH)
+        return pcm
+
+
+def detect_voice_buffers(audio, aggressiveness=2, frame_ms=30, use_gate=True, workers=1, source_id=None, progress=None,
+                         **shape):
+    # With a source_id the buffers are RegionViews into that source (the original
+    # audio), otherwise they are slices of the 16 kHz mono copy used for detection.
+    # shape takes the other FrameDecisions.regions() settings, e.g. merge_gap_ms.
+    with stage('resample', frames=int(audio.frame_count()), nbytes=len(audio.raw_data)):
+        audio = to_vad_pcm(audio)
+    raw_audio = audio.raw_data
+    frame_bytes = VAD_SAMPLE_RATE * frame_ms // 1000 * VAD_SAMPLE_WIDTH
+    total_frames = -(-len(raw_audio) // frame_bytes)
+
+    # Only the one level is needed here
+    with stage('vad', frames=total_frames, nbytes=len(raw_audio)):
+        bits = classify_levels_parallel(raw_audio, (aggressiveness,), frame_ms, use_gate, workers, progress)
+        energy = frame_rms(frame_matrix(raw_audio, VAD_SAMPLE_RATE * frame_ms // 1000))
+    filtered_regions = FrameDecisions(bits, frame_ms, total_frames, energy).regions(aggressiveness, **shape)
+    if source_id is not None:
+        filtered_buffers = [RegionView(source_id, start, end) for start, end in filtered_regions]
+    else:
+        filtered_buffers = [audio[start:end] for start, end in filtered_regions]
+    return filtered_regions, filtered_buffers
+
+
+class StreamingDetector:
+    # Runs the same detection as detect_voice_buffers over PCM that arrives in
+    # chunks. Only the partial frame at the end of a chunk, the warm-up for the
+    # next epoch and (without a source_id) the audio of the region that is still
+    # open are kept between calls, so memory stays bounded no matter how long the
+    # input is. Decisions are made at every level; with keep_decisions they are
+    # collected, a byte and a level per frame (about 0.6 MB an hour at 30 ms),
+    # and decisions() hands them out once the input is finished. Without it
+    # nothing grows with the input. Regions are shaped like
+    # FrameDecisions.regions() does; a padded one is handed out once the audio
+    # has reached its end, so padding at the end of the file comes out the same.
+
+    def __init__(self, aggressiveness=2, frame_ms=30, use_gate=True, min_region_ms=MIN_REGION_MS, source_id=None,
+                 max_silence_ms=MAX_SILENCE_MS, merge_gap_ms=MERGE_GAP_MS, pre_roll_ms=PRE_ROLL_MS,
+                 post_roll_ms=POST_ROLL_MS, max_region_ms=MAX_REGION_MS, keep_decisions=True):
+        self.source_id = source_id
+        self.keep_decisions = keep_decisions
+        self.aggressiveness = aggressiveness
+        self.frame_ms = frame_ms
+        self.use_gate = use_gate
+        self.min_region_ms = min_region_ms
+        self.pre_roll_ms = pre_roll_ms
+        self.post_roll_ms = post_roll_ms
+        self.max_region_ms = max_region_ms
+        self.samples_per_frame = VAD_SAMPLE_RATE * frame_ms // 1000
+        self.frame_bytes = self.samples_per_frame * VAD_SAMPLE_WIDTH
+        self.max_silence_frames = int(max_silence_ms / frame_ms)
+        self.break_frames = break_frames(frame_ms, max_silence_ms, merge_distance(merge_gap_ms, pre_roll_ms, post_roll_ms))
+        self.epoch_frames = VAD_EPOCH_MS // frame_ms
+        self.warmup_frames = EPOCH_WARMUP_MS // frame_ms
+        self.detectors = None
+        self.decided = []  # uint8 decisions of every feed(), with keep_decisions
+        self.levels = []  # frame_rms() of every feed(), with keep_decisions
+        self.energy = np.zeros(0, dtype=np.float32)  # frame_rms() from energy_from on, to cut the open region at
+        self.energy_from = 0
+        self.total_frames = None  # Set by finish()
+
+        self.history = bytearray()  # PCM from history_frame onwards
+        self.history_candidates = np.zeros(0, dtype=bool)  # Gate output for the full frames in history
+        self.history_frame = 0
+        self.frames_done = 0  # Full frames classified so far
+        self.gate_tail = np.zeros(0, dtype=bool)  # Raw energy gate of the last few frames
+        self.open_start = None  # First speech frame of the open region
+        self.open_last = None  # Last speech frame of the open region
+        self.pending = []  # Shaped (start, end) regions waiting for the audio to reach their end
+
+    def feed(self, pcm):
+        # Add a chunk of 16 kHz mono PCM, returns the (region, buffer) pairs it completed
+        self.history += pcm
+        offset = (self.frames_done - self.history_frame) * self.frame_bytes
+        num_frames = (len(self.history) - offset) // self.frame_bytes
+        if num_frames == 0:
+            return []
+
+        frames = frame_matrix(bytes(self.history[offset:offset + num_frames * self.frame_bytes]), self.samples_per_frame)
+        levels = frame_rms(frames)
+        self.energy = np.concatenate((self.energy, levels))
+        if self.use_gate:
+            gate = energy_gate(frames)
+            padded = np.concatenate((self.gate_tail, gate))
+            candidates = extend_forward(padded, GATE_HANGOVER_MS // self.frame_ms)[len(self.gate_tail):]
+            self.gate_tail = padded[-(GATE_HANGOVER_MS // self.frame_ms):]
+        else:
+            candidates = np.ones(num_frames, dtype=bool)
+        self.history_candidates = np.concatenate((self.history_candidates, candidates))
+
+        bits = self._classify(self.frames_done, self.frames_done + num_frames)
+        if self.keep_decisions:
+            self.decided.append(bits)
+            self.levels.append(levels)
+        speech = (bits & (1 << self.aggressiveness)) != 0
+        base = self.frames_done
+        self.frames_done += num_frames
+
+        speech_idx = np.flatnonzero(speech) + base
+        if self.open_last is not None:
+            speech_idx = np.concatenate(([self.open_last], speech_idx))
+        if len(speech_idx) == 0:
+            results = self._emit(self.frames_done * self.frame_ms)
+            self._trim_history()
+            return results
+
+        breaks = np.flatnonzero(np.diff(speech_idx) - 1 >= self.break_frames)
+        first_frames = np.concatenate(([speech_idx[0]], speech_idx[breaks + 1]))
+        last_frames = np.concatenate((speech_idx[breaks], [speech_idx[-1]]))
+        if self.open_start is not None:
+            first_frames[0] = self.open_start
+
+        # The final group stays open until enough silence has followed it
+        closed = len(first_frames)
+        if self.frames_done - 1 - last_frames[-1] < self.break_frames:
+            closed -= 1
+            self.open_start, self.open_last = int(first_frames[-1]), int(last_frames[-1])
+        else:
+            self.open_start = self.open_last = None
+
+        for first, last in zip(first_frames[:closed].tolist(), last_frames[:closed].tolist()):
+            self._close(first * self.frame_ms, last * self.frame_ms)
+        results = self._emit(self.frames_done * self.frame_ms)
+        self._trim_history()
+        return results
+
+    def finish(self):
+        # Close whatever region is still open at the end of the input
+        self.total_frames = self.frames_done
+        if len(self.history) > (self.frames_done - self.history_frame) * self.frame_bytes:
+            self.total_frames += 1  # A trailing partial frame still counts towards the end time
+        if self.open_start is not None:
+            if self.frames_done - 1 - self.open_last < self.max_silence_frames:
+                end = self.total_frames * self.frame_ms
+            else:
+                end = self.open_last * self.frame_ms  # Only kept open for a merge that never came
+            self._close(self.open_start * self.frame_ms, end)
+        total_ms = self.total_frames * self.frame_ms
+        self.pending = [(start, min(end, total_ms)) for start, end in self.pending]
+        results = self._emit(total_ms)
+        self.open_start = self.open_last = None
+        self.history = bytearray()
+        self.history_candidates = np.zeros(0, dtype=bool)
+        self.history_frame = self.frames_done
+        return results
+
+    def decisions(self):
+        # FrameDecisions for everything fed, after finish(), with keep_decisions
+        if not self.keep_decisions:
+            raise ValueError("decisions weren't kept")
+        bits = np.concatenate(self.decided) if self.decided else np.zeros(0, dtype=np.uint8)
+        energy = np.concatenate(self.levels) if self.levels else np.zeros(0, dtype=np.float32)
+        return FrameDecisions(bits, self.frame_ms, self.total_frames, energy)
+
+    def _classify(self, first, stop):
+        # Decisions for absolute frames [first, stop), switching detectors at epoch boundaries
+        speech = np.zeros(stop - first, dtype=np.uint8)
+        position = first
+        while position < stop:
+            epoch_stop = min(stop, (position // self.epoch_frames + 1) * self.epoch_frames)
+            if position % self.epoch_frames == 0:
+                self.detectors = new_detectors(VAD_LEVELS)
+                warm_start = max(0, position - self.warmup_frames)
+                run_vad(self.detectors, self.history, self.frame_bytes, warm_start - self.history_frame,
+                        position - self.history_frame, self.history_candidates)
+            speech[position - first:epoch_stop - first] = run_vad(
+                self.detectors, self.history, self.frame_bytes, position - self.history_frame,
+                epoch_stop - self.history_frame, self.history_candidates)
+            position = epoch_stop
+        return speech
+
+    def _close(self, start, end):
+        # A region is complete, queue the buffers it turns into
+        shaped = shape_regions([(start, end)], 0, self.min_region_ms, self.pre_roll_ms, self.post_roll_ms,
+                               self.max_region_ms, energy=self.energy, energy_ms=self.frame_ms,
+                               energy_from=self.energy_from)
+        self.pending.extend((int(start), int(end)) for start, end in shaped)
+
+    def _emit(self, available_ms):
+        # Buffers for the queued regions that the audio has reached the end of
+        ready = 0
+        while ready < len(self.pending) and self.pending[ready][1] <= available_ms:
+            ready += 1
+        results = [self._make_region(start, end) for start, end in self.pending[:ready]]
+        del self.pending[:ready]
+        return results
+
+    def _make_region(self, start, end):
+        if self.source_id is not None:
+            return (start, end), RegionView(self.source_id, start, end)
+        bytes_per_ms = VAD_SAMPLE_RATE // 1000 * VAD_SAMPLE_WIDTH
+        history_ms = self.history_frame * self.frame_ms
+        pcm = bytes(self.history[(start - history_ms) * bytes_per_ms:(end - history_ms) * bytes_per_ms])
+        buffer = AudioSegment(pcm, frame_rate=VAD_SAMPLE_RATE, sample_width=VAD_SAMPLE_WIDTH, channels=1)
+        return (start, end), buffer
+
+    def _trim_history(self):
+        # Drop audio that can no longer be part of a region or of the next warm-up
+        keep_from = self.frames_done - self.warmup_frames
+        if self.source_id is None:
+            if self.open_start is not None:
+                keep_from = min(keep_from, (self.open_start * self.frame_ms - self.pre_roll_ms) // self.frame_ms)
+            if self.pending:
+                keep_from = min(keep_from, self.pending[0][0] // self.frame_ms)
+            keep_from = max(keep_from, 0)
+        drop = keep_from - self.history_frame
+        if drop > 0:
+            del self.history[:drop * self.frame_bytes]
+            self.history_candidates = self.history_candidates[drop:]
+            self.history_frame = keep_from
+        # Levels are only needed to cut the region that is still open
+        energy_keep = self.open_start if self.open_start is not None else self.frames_done
+        if energy_keep > self.energy_from:
+            self.energy = self.energy[energy_keep - self.energy_from:].copy()
+            self.energy_from = energy_keep
+
+
+def detection_params(frame_ms=30, use_gate=True):
+    # Everything that influences the per-frame decisions, used to key cached
+    # results. Level, hangover, merge gap and minimum length only come in later.
+    return {
+        'version': DETECTION_VERSION,
+        'levels': list(VAD_LEVELS),
+        'frame_ms': frame_ms,
+        'use_gate': use_gate,
+        'epoch_ms': VAD_EPOCH_MS,
+        'epoch_warmup_ms': EPOCH_WARMUP_MS,
+    }
+
+
+def classify_audio(audio, frame_ms=30, use_gate=True, workers=1, progress=None):
+    # FrameDecisions for a decoded AudioSegment, over a pool of workers if asked
+    with stage('resample', frames=int(audio.frame_count()), nbytes=len(audio.raw_data)):
+        raw_audio = to_vad_pcm(audio).raw_data
+    frame_bytes = VAD_SAMPLE_RATE * frame_ms // 1000 * VAD_SAMPLE_WIDTH
+    total_frames = -(-len(raw_audio) // frame_bytes)
+    with stage('vad', frames=total_frames, nbytes=len(raw_audio)):
+        bits = classify_levels_parallel(raw_audio, VAD_LEVELS, frame_ms, use_gate, workers, progress)
+        energy = frame_rms(frame_matrix(raw_audio, VAD_SAMPLE_RATE * frame_ms // 1000))
+    return FrameDecisions(bits, frame_ms, total_frames, energy)
+
+
+def classify_source(source, frame_ms=30, use_gate=True, chunk_frames=1 << 20, progress=None):
+    # FrameDecisions for an already decoded PcmSource, a chunk at a time so only a
+    # small 16 kHz copy exists at any moment. Same results as classify_audio.
+    converter = VadPcmConverter(source.frame_rate, source.channels, source.sample_width)
+    # The regions it finds on the way are dropped, -1 stands in for a source id
+    # so making them costs nothing
+    detector = StreamingDetector(frame_ms=frame_ms, use_gate=use_gate, source_id=-1)
+    data = memoryview(source.data).cast('B')
+    step = chunk_frames * source.frame_width
+    resample, vad = Stage('resample', source.frame_count(), len(data)), Stage('vad')
+    ok = False
+    try:
+        for offset in range(0, len(data), step):
+            with resample.timing():
+                pcm = converter.convert(data[offset:offset + step])
+            with vad.timing():
+                detector.feed(pcm)
+            vad.add(nbytes=len(pcm))
+            if progress is not None:
+                progress(min(len(data), offset + step) / len(data))
+        with vad.timing():
+            detector.finish()
+        vad.add(frames=detector.total_frames)
+        ok = True
+    finally:
+        resample.finish(ok)
+        vad.finish(ok)
+    return detector.decisions()
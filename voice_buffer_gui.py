@@ -2,112 +2,101 @@ import os
 os.environ["PATH"] += os.pathsep + r"C:\ffmpeg\bin"
 
 import dearpygui.dearpygui as dpg
-from pydub import AudioSegment
-import webrtcvad
-import tempfile
 import threading
+import time
 import traceback
-import wave
-import io
-import simpleaudio as sa
+import multiprocessing
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import time
+
+from vad_engine import classify_audio, classify_source, detection_params, StreamingDetector, VadPcmConverter, MAX_SILENCE_MS
+from region_engine import MERGE_GAP_MS, MIN_REGION_MS, PRE_ROLL_MS, POST_ROLL_MS, MAX_REGION_MS
+from audio_io import (ffmpeg_pcm_chunks, load_audio_file, probe_audio_format, SUPPORTED_EXTENSIONS, OUTPUT_ENCODINGS,
+                      OUTPUT_FRAME_RATE, OUTPUT_FRAME_RATES)
+from audio_sources import (PcmSource, FilePcmSource, RegionView, MergedView, add_source, get_source, remove_source,
+                           clear_sources, retain_sources, release_sources, buffer_sources)
+from audio_cache import AudioCache, hash_file
+from output_assembly import export_output
+from segment_table import SegmentTable, REPEAT, MERGE, EXCLUDED, MERGED
+from edit_journal import EditJournal
+from playback_engine import PlaybackEngine
+from waveform import PeakPyramid, region_mask
+from session_file import session_data, save_session, load_session, restore_segments, SESSION_EXTENSION
+from instrumentation import Stage, stage, labelled, profiled, recent, record_count, set_log_file, describe
 
 # Global variables
-current_playback = None
-buffers = []
-speech_regions = []
-buffer_descriptions = []
-selected_buffers = set()
-excluded_buffers = set()  # New set for excluded buffers
-excluded_buffer_history = []  # Stack to track excluded buffers for undo
-audio = None
-merge_buffers = set()
+player = None  # PlaybackEngine, its output stream is opened on the first Play
+segments = SegmentTable()  # Buffers of the loaded file with their repeat/merge/exclude flags
+journal = EditJournal(segments)  # Undo/redo of the edits to segments, replaced with it
 last_input_dir = os.path.join(os.getcwd(), "raw")  # Initialize with default paths
 last_output_dir = os.path.join(os.getcwd(), "processed")
+load_cancel = threading.Event()  # Set to stop the load in progress, replaced for every load
+ui_updates = queue.Queue()  # Results and progress from the loader and export threads, applied by the render loop
+export_jobs = queue.Queue()  # Exports waiting for the export thread
+export_thread = None  # Started with the first export
+current_export = None  # The export being written
+audio_cache = None  # Created on first use
+visible_rows = []  # Segment ids listed in the buffer window, excluded ones left out
+slot_rows = []  # Segment id shown by each row widget, None for unused rows
+first_listed = -1  # Position in visible_rows shown by the first row widget
+waveform = None  # PeakPyramid of the loaded file
+waveform_view = None  # (start, end, width) the waveform was last drawn for, None to redraw
+waveform_fit = False  # Show the whole file on the next frame
+waveform_source = None  # Source id of the file the waveform shows
+waveform_spans = None  # (start, end) ms of the listed buffers in that file, None until needed
+project_files = []  # The loaded files in project order, see new_project_file()
+project_load = None  # Files being loaded with what to do once they're in, see start_project()
+regions_settings = None  # Detection settings the buffer list was derived with
+diagnostics_shown = -1  # record_count() the diagnostics panel was last filled at
+undo_shown = None  # (can undo, can redo) the Undo and Redo buttons were last set for
 
-def play_audiosegment(segment):
-    global current_playback
-    try:
-        # Stop any existing playback
-        if current_playback is not None:
-            current_playback.stop()
-            current_playback = None
-            time.sleep(0.1)  # Small delay to ensure clean stop
-        
-        # Convert to raw PCM data
-        samples = np.array(segment.get_array_of_samples())
-        
-        # Get audio parameters
-        channels = segment.channels
-        sample_width = segment.sample_width
-        frame_rate = segment.frame_rate
-        
-        # Play using simpleaudio
-        current_playback = sa.play_buffer(
-            samples.tobytes(), 
-            num_channels=channels,
-            bytes_per_sample=sample_width,
-            sample_rate=frame_rate
-        )
-        
-        # Wait for playback to finish
-        current_playback.wait_done()
-        current_playback = None
-            
-    except Exception as e:
-        print(f"Playback error: {str(e)}")
-        traceback.print_exc()
+# Only the rows scrolled into view have widgets, which are reused as the list scrolls
+ROW_HEIGHT = 23  # Pixels per buffer row, including item spacing
+ROW_OVERSCAN = 5  # Extra rows kept ready above and below the visible ones
+# Files of a project decoded at the same time
+PROJECT_LOAD_THREADS = 4
+# Editable fields, where Ctrl+Z belongs to the text
+TEXT_INPUTS = ("output_file", "diagnostics_log_path", "vad_workers")
 
-def detect_voice_buffers(audio, aggressiveness=2, frame_ms=30):
-    audio = audio.set_channels(1).set_frame_rate(16000)
-    raw_audio = audio.raw_data
-    vad = webrtcvad.Vad(aggressiveness)  # Reduced aggressiveness for less strict detection
-    frame_bytes = int(audio.frame_rate * frame_ms / 1000 * 2)
-    frames = [raw_audio[i:i+frame_bytes] for i in range(0, len(raw_audio), frame_bytes)]
-    speech_regions = []
-    is_speech = False
-    start = 0
-    silence_frames = 0
-    max_silence_frames = int(200 / frame_ms)  # Increased from 20ms to 50ms for more lenient detection
-    merge_silence_frames = int(300 / frame_ms)  # 0.3 second threshold for merging
-    
-    # First pass: detect speech regions
-    for i, frame in enumerate(frames):
-        if len(frame) < frame_bytes:
-            break
-        if vad.is_speech(frame, audio.frame_rate):
-            if not is_speech:
-                start = i * frame_ms
-                is_speech = True
-            silence_frames = 0
-        else:
-            if is_speech:
-                silence_frames += 1
-                if silence_frames >= max_silence_frames:
-                    end = (i - silence_frames) * frame_ms
-                    speech_regions.append((start, end))
-                    is_speech = False
-                    silence_frames = 0
-    if is_speech:
-        speech_regions.append((start, len(frames) * frame_ms))
-    
-    # Second pass: merge regions
-    filtered_regions = []
-    filtered_buffers = []
-    for start, end in speech_regions:
-        if end - start >= 500:  # Keep only buffers >= 1 second
-            filtered_regions.append((start, end))
-            filtered_buffers.append(audio[start:end])
-    
-    return filtered_regions, filtered_buffers
+def get_player():
+    global player
+    if player is None:
+        player = PlaybackEngine()
+    return player
 
 def play_buffer(sender, app_data, user_data):
-    global buffers
-    idx = user_data
-    if 0 <= idx < len(buffers):
-        threading.Thread(target=play_audiosegment, args=(buffers[idx],), daemon=True).start()
-        dpg.set_value("status", f"Playing buffer {idx}...")
+    seg_id = user_data
+    if segments.contains(seg_id):
+        try:
+            # Starts right away, switching over from whatever was playing
+            get_player().play(segments.buffers[seg_id], tag=seg_id)
+            dpg.configure_item("playback_position", max_value=player.duration_ms() / 1000.0)
+            dpg.set_value("status", f"Playing buffer {segments.position(seg_id)}...")
+        except Exception as e:
+            print(f"Playback error: {str(e)}")
+            traceback.print_exc()
+            dpg.set_value("status", f"Playback error: {str(e)}")
+
+def stop_playback(sender, app_data):
+    if player is not None:
+        player.stop()
+
+def seek_playback(sender, app_data):
+    if player is not None:
+        player.seek(app_data * 1000.0)
+
+def update_playback_position():
+    # Show where playback is, called every frame. Left alone while the user drags it.
+    if player is None or dpg.is_item_active("playback_position"):
+        return
+    position = player.position_ms() / 1000.0
+    dpg.set_value("playback_position", position)
+    if player.is_playing() and segments.contains(player.tag):
+        label = f"Buffer {segments.position(player.tag)}: {position:.1f} / {player.duration_ms() / 1000.0:.1f}s"
+    else:
+        label = "Stopped"
+    dpg.configure_item("playback_position", label=label)
 
 def select_input_file(sender, app_data):
     global last_input_dir
@@ -117,365 +106,820 @@ def select_input_file(sender, app_data):
         
         # Set default output filename based on input filename
         input_filename = os.path.basename(app_data['file_path_name'])
-        output_filename = input_filename.rsplit('.', 1)[0] + '-processed.wav'
+        output_filename = input_filename.rsplit('.', 1)[0] + '-processed' + output_extension()
         dpg.set_value("output_file", output_filename)
         
         load_audio(None, None)
 
-def load_audio(sender, app_data):
-    global audio, buffers, speech_regions, buffer_descriptions, selected_buffers, merge_buffers, excluded_buffers
+def add_detected_buffers(found):
+    # Append newly detected (region, buffer) pairs to the buffer list
+    for region, buf in found:
+        segments.add(region, buf)
+    refresh_buffer_list()
+
+def get_cache():
+    global audio_cache
+    if not dpg.get_value("use_cache"):
+        return None
+    if audio_cache is None:
+        audio_cache = AudioCache()
+    return audio_cache
+
+def clear_cache(sender, app_data):
+    cache = audio_cache or AudioCache()
+    cache.clear()
+    dpg.set_value("status", f"Cleared cache at {cache.directory}")
+
+class LoadCancelled(Exception):
+    pass
+
+def post(kind, cancel, *args):
+    # Hand a loader or export result to the render thread. cancel identifies the
+    # job, so results of a load that was replaced by a newer one are dropped.
+    ui_updates.put((kind, cancel) + args)
+
+def process_ui_updates():
+    # Apply what loader threads posted, called every frame
+    while True:
+        try:
+            kind, cancel, *args = ui_updates.get_nowait()
+        except queue.Empty:
+            return
+        if kind == "export_progress":
+            text, fraction = args
+            dpg.set_value("export_progress", fraction)
+            dpg.configure_item("export_progress", overlay=text)
+            continue
+        if kind == "message":
+            dpg.set_value("status", args[0])
+            continue
+        if kind == "profile":
+            dpg.set_value("profile_result", f"Last profile: {args[0]}")
+            continue
+        if kind == "export_status":
+            dpg.set_value("status", args[0])
+            dpg.set_value("export_progress", 0.0)
+            dpg.configure_item("export_progress", overlay=f"{export_jobs.qsize()} exports waiting" if not export_jobs.empty() else "")
+            continue
+        if cancel is not load_cancel:
+            # From a load that was replaced by a newer one, whatever it loaded goes
+            if kind == "file_loaded":
+                remove_source(args[1])
+            continue
+        if kind == "buffers":
+            if not cancel.is_set():
+                add_detected_buffers(args[0])
+        elif kind == "file_loaded":
+            file_loaded(*args)
+        elif kind == "file_failed":
+            file_failed(*args)
+        elif kind == "rescanned":
+            set_rescanned(*args)
+        elif kind == "frame_ms":
+            dpg.set_value("vad_frame_ms", str(args[0]))
+        elif kind == "progress":
+            text, fraction = args
+            dpg.set_value("load_progress", fraction)
+            dpg.configure_item("load_progress", overlay=text)
+        elif kind == "status":
+            dpg.set_value("status", args[0])
+        elif kind == "done":
+            dpg.hide_item("cancel_load")
+
+def progress_reporter(cancel, label):
+    # Progress callback for the detection functions, also where a cancelled load stops
+    def report(fraction):
+        if cancel.is_set():
+            raise LoadCancelled()
+        post("progress", cancel, f"{label} {fraction:.0%}", fraction)
+    return report
+
+def detection_settings():
+    # Current values of the detection controls
+    return {
+        'aggressiveness': dpg.get_value("vad_aggressiveness"),
+        'frame_ms': int(dpg.get_value("vad_frame_ms")),
+        'max_silence_ms': dpg.get_value("vad_max_silence_ms"),
+        'merge_gap_ms': dpg.get_value("vad_merge_gap_ms"),
+        'min_region_ms': dpg.get_value("vad_min_region_ms"),
+        'pre_roll_ms': dpg.get_value("vad_pre_roll_ms"),
+        'post_roll_ms': dpg.get_value("vad_post_roll_ms"),
+        'max_region_ms': int(dpg.get_value("vad_max_region_s") * 1000),
+    }
+
+def set_detection_controls(settings):
+    dpg.set_value("vad_aggressiveness", settings['aggressiveness'])
+    dpg.set_value("vad_frame_ms", str(settings['frame_ms']))
+    for name in ('max_silence_ms', 'merge_gap_ms', 'min_region_ms', 'pre_roll_ms', 'post_roll_ms'):
+        dpg.set_value(f"vad_{name}", settings[name])
+    dpg.set_value("vad_max_region_s", settings['max_region_ms'] / 1000.0)
+
+def derive_regions(decisions, settings):
+    return decisions.regions(settings['aggressiveness'], settings['max_silence_ms'], settings['merge_gap_ms'],
+                             settings['min_region_ms'], settings['pre_roll_ms'], settings['post_roll_ms'],
+                             settings['max_region_ms'])
+
+def stream_voice_buffers(infile, cancel, cache, cache_key, settings, incremental):
+    # Decode through an ffmpeg pipe at the file's own quality and run VAD chunk by
+    # chunk. With incremental, buffers are added to the list as soon as they are
+    # found. Returns (source id, decisions).
+    frame_rate, channels, duration = probe_audio_format(infile)
+    channels = min(channels, 2)  # Let ffmpeg downmix surround sources
+    # The decode goes straight to disk, into the cache entry when caching
+    if cache_key is not None:
+        source = cache.open_writer(cache_key, frame_rate, channels, 2, infile)
+    else:
+        source = FilePcmSource(frame_rate, channels, 2, name=infile)
+    source_id = add_source(source)
+    converter = VadPcmConverter(frame_rate, channels)
+    detector = StreamingDetector(settings['aggressiveness'], settings['frame_ms'], min_region_ms=settings['min_region_ms'],
+                                 source_id=source_id, max_silence_ms=settings['max_silence_ms'],
+                                 merge_gap_ms=settings['merge_gap_ms'], pre_roll_ms=settings['pre_roll_ms'],
+                                 post_roll_ms=settings['post_roll_ms'], max_region_ms=settings['max_region_ms'])
+    detected_regions = []
+    decode, resample, vad = Stage('decode'), Stage('resample'), Stage('vad')
+    finished = False
     
     try:
-        infile = dpg.get_value("file_selector")
-        if not infile:
-            dpg.set_value("status", "No file selected")
-            return
+        chunks = ffmpeg_pcm_chunks(infile, frame_rate, channels, chunk_bytes=frame_rate * channels * 2 * 10)
+        try:
+            while True:
+                # Decode, resampling and VAD take turns per chunk, each is timed on its own
+                with decode.timing():
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    source.append(chunk)
+                decode.add(frames=len(chunk) // source.frame_width, nbytes=len(chunk))
+                with resample.timing():
+                    pcm = converter.convert(chunk)
+                resample.add(frames=len(chunk) // source.frame_width, nbytes=len(chunk))
+                with vad.timing():
+                    found = detector.feed(pcm)
+                vad.add(nbytes=len(pcm))
+                if cancel.is_set():
+                    raise LoadCancelled()
+                if found:
+                    detected_regions.extend(region for region, _ in found)
+                    if incremental:
+                        post("buffers", cancel, found)
+                
+                # VAD runs right behind the decode, so both share one progress bar
+                decoded = source.frame_count() / frame_rate
+                scanned = detector.frames_done * detector.frame_ms / 1000.0
+                if duration:
+                    post("progress", cancel, f"Decoded {min(1.0, decoded / duration):.0%}, VAD {min(1.0, scanned / duration):.0%}",
+                         min(1.0, scanned / duration))
+                if incremental:
+                    post("status", cancel, f"Detecting voice buffers... {scanned / 60.0:.1f} min scanned, {len(detected_regions)} buffers")
+        finally:
+            chunks.close()  # Stops ffmpeg when the load was cancelled
+        
+        with vad.timing():
+            found = detector.finish()
+        vad.add(frames=detector.total_frames, items=len(detected_regions) + len(found))
+        if found:
+            detected_regions.extend(region for region, _ in found)
+            if incremental:
+                post("buffers", cancel, found)
+        print(f"Detected {len(detected_regions)} voice regions")
+        
+        # From here on the audio is read from the memory-mapped file
+        decisions = detector.decisions()
+        if cache_key is not None:
+            cache.commit_source(cache_key, source)
+            cache.store_decisions(cache_key, detection_params(settings['frame_ms']), decisions)
+        else:
+            source.finish()
+        finished = True
+    except Exception:
+        if cache_key is not None:
+            cache.abandon_writer(cache_key, source)
+        remove_source(source_id)
+        raise
+    finally:
+        for measured in (decode, resample, vad):
+            measured.finish(finished)
+    
+    return source_id, decisions
+
+def decode_voice_buffers(infile, cancel, cache, cache_key, workers, settings):
+    # Decode the whole file at once, then detect over a pool of workers.
+    # Returns (source id, decisions).
+    post("progress", cancel, "Decoding...", 0.0)
+    with stage('decode') as measured:
+        audio = load_audio_file(infile)
+        measured.add(frames=int(audio.frame_count()), nbytes=len(audio.raw_data))
+    if cancel.is_set():
+        raise LoadCancelled()
+    print(f"Successfully loaded audio file: {len(audio)}ms duration")
+    
+    # Write the decode to disk once, the cache entry or a scratch file. Buffers
+    # reference the memory-mapped file instead of holding copies of the audio.
+    if cache is not None:
+        source = cache.store_source(cache_key, PcmSource.from_segment(audio, name=infile))
+    else:
+        source = FilePcmSource.from_segment(audio, name=infile)
+    source_id = add_source(source)
+    try:
+        # Decisions at every level, so the controls can be tuned without a rescan
+        decisions = classify_audio(audio, settings['frame_ms'], workers=workers, progress=progress_reporter(cancel, "VAD"))
+    except LoadCancelled:
+        remove_source(source_id)
+        raise
+    if cache is not None:
+        cache.store_decisions(cache_key, detection_params(settings['frame_ms']), decisions)
+    return source_id, decisions
+
+def load_from_cache(infile, cancel, cache, cache_key, settings):
+    # A cached decode and its decisions, running VAD again only if the frame
+    # length changed. Returns (source id, decisions), None when the file isn't cached.
+    source = cache.load_source(cache_key, infile)
+    if source is None:
+        return None
+    
+    source_id = add_source(source)
+    params = detection_params(settings['frame_ms'])
+    decisions = cache.load_decisions(cache_key, params)
+    if decisions is None:
+        try:
+            decisions = classify_source(source, settings['frame_ms'], progress=progress_reporter(cancel, "VAD"))
+        except LoadCancelled:
+            remove_source(source_id)
+            raise
+        cache.store_decisions(cache_key, params, decisions)
+    print(f"Loaded {os.path.basename(infile)} from cache")
+    return source_id, decisions
+
+def load_waveform(source, cancel, cache, cache_key):
+    # Peak pyramid for the waveform panel, computed once per file and cached
+    peaks = cache.load_peaks(cache_key) if cache is not None else None
+    if peaks is None:
+        peaks = PeakPyramid.build(source, progress=progress_reporter(cancel, "Waveform"))
+        if cache is not None:
+            cache.store_peaks(cache_key, peaks)
+    return peaks
+
+def project_worker(entries, cancel, cache, streaming, workers, settings, expected_keys, profile_path, incremental):
+    # Everything slow about loading the files of a project, off the UI thread.
+    # Several files load at once on a small thread pool; ffmpeg decodes each in
+    # a process of its own, so the decodes really overlap. The VAD workers are
+    # shared out between the files loading at once. expected_keys are the
+    # content hashes a session was saved with. With a profile_path everything
+    # runs under cProfile, which only sees its own thread, so the files then
+    # load one after another.
+    threads = 1 if profile_path is not None else max(1, min(len(entries), workers, PROJECT_LOAD_THREADS))
+    file_workers = max(1, workers // threads)
+    # Files with the same content share a cache entry, the first one writes it
+    # and the others wait to read it from there
+    key_locks = {}
+    key_locks_lock = threading.Lock()
+    
+    def key_lock(cache_key):
+        if cache_key is None:
+            return threading.Lock()  # Not cached, nothing to share
+        with key_locks_lock:
+            return key_locks.setdefault(cache_key, threading.Lock())
+    
+    def load(job):
+        entry, expected_key = job
+        load_project_file(entry, cancel, cache, streaming, file_workers, settings, expected_key, incremental, key_lock)
+    
+    try:
+        jobs = list(zip(entries, expected_keys))
+        if profile_path is not None:
+            with profiled(profile_path):
+                for job in jobs:
+                    load(job)
+            post("profile", None, profile_path)
+        elif threads == 1:
+            for job in jobs:
+                load(job)
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(load, jobs))
+        post("progress", cancel, "Done", 1.0)
+    finally:
+        post("done", cancel)
+
+def load_project_file(entry, cancel, cache, streaming, workers, settings, expected_key, incremental, key_lock):
+    # Load one file and hand it to the UI thread with "file_loaded", or report
+    # it with "file_failed"
+    infile = entry['path']
+    loaded = None
+    with labelled(os.path.basename(infile)):
+        try:
+            # A file we've seen before comes straight from the cache
+            cache_key = None
+            if cache is not None:
+                post("status", cancel, "Checking cache...")
+                cache_key = cache.file_key(infile)
+            if expected_key is not None and (cache_key or hash_file(infile)) != expected_key:
+                raise ValueError("changed since the session was saved")
             
+            listed = False
+            with key_lock(cache_key):
+                if cache is not None:
+                    loaded = load_from_cache(infile, cancel, cache, cache_key, settings)
+                if loaded is None and streaming:
+                    loaded = stream_voice_buffers(infile, cancel, cache, cache_key, settings, incremental)
+                    listed = incremental
+                elif loaded is None:
+                    loaded = decode_voice_buffers(infile, cancel, cache, cache_key, workers, settings)
+                source_id, decisions = loaded
+                peaks = load_waveform(get_source(source_id), cancel, cache, cache_key)
+            post("file_loaded", cancel, entry, source_id, cache_key, decisions, peaks, listed)
+            
+        except LoadCancelled:
+            print(f"Cancelled loading {infile}")
+            if loaded is not None:
+                remove_source(loaded[0])
+            post("file_failed", cancel, entry, None)
+        except Exception as e:
+            print(f"Error details: {str(e)}")
+            print("Full traceback:")
+            traceback.print_exc()
+            if loaded is not None:
+                remove_source(loaded[0])
+            post("file_failed", cancel, entry, f"{os.path.basename(infile)}: {str(e)}")
+
+def rescan_worker(files, cancel, cache, frame_ms, previous, settings):
+    # Decisions for a new frame length for every (source id, cache key) in files,
+    # from the already decoded audio. Unless all of them finish, the previous
+    # decisions are handed back. The settings the list was derived with go back
+    # either way; with new decisions they no longer match the controls, so the
+    # list is derived again.
+    decisions = list(previous)
+    rescanned = False
+    try:
+        params = detection_params(frame_ms)
+        for i, (source_id, cache_key) in enumerate(files):
+            if decisions[i].frame_ms == frame_ms:
+                continue  # Added while the frame length was being changed
+            file_cache = cache if cache_key is not None else None
+            found = file_cache.load_decisions(cache_key, params) if file_cache is not None else None
+            if found is None:
+                with labelled(os.path.basename(get_source(source_id).name or "")):
+                    found = classify_source(get_source(source_id), frame_ms, progress=progress_reporter(cancel, "VAD"))
+                if file_cache is not None:
+                    file_cache.store_decisions(cache_key, params, found)
+            decisions[i] = found
+        rescanned = True
+        post("progress", cancel, "Done", 1.0)
+    except LoadCancelled:
+        post("status", cancel, "Frame length change cancelled.")
+    except Exception as e:
+        print(f"Error rescanning: {str(e)}")
+        traceback.print_exc()
+        post("status", cancel, f"Error rescanning: {str(e)}")
+    finally:
+        if not rescanned:
+            decisions = list(previous)
+            post("frame_ms", cancel, previous[0].frame_ms)  # Put the control back
+        post("rescanned", cancel, decisions, settings)
+        post("done", cancel)
+
+def rescan_frames(frame_ms):
+    global load_cancel
+    load_cancel.set()
+    load_cancel = threading.Event()
+    
+    files = [(entry['source_id'], entry['cache_key']) for entry in project_files]
+    previous = [entry['decisions'] for entry in project_files]
+    for entry in project_files:
+        entry['decisions'] = None  # The controls wait until the rescan is done
+    
+    dpg.set_value("load_progress", 0.0)
+    dpg.configure_item("load_progress", overlay="")
+    dpg.show_item("cancel_load")
+    dpg.set_value("status", f"Rescanning with {frame_ms} ms frames...")
+    threading.Thread(
+        target=rescan_worker,
+        args=(files, load_cancel, get_cache(), frame_ms, previous, regions_settings),
+        daemon=True,
+    ).start()
+
+def set_rescanned(decisions, settings):
+    # A rescan is done. settings are those the list was derived with; controls
+    # moved meanwhile are caught up with.
+    global regions_settings
+    for entry, found in zip(project_files, decisions):
+        entry['decisions'] = found
+    regions_settings = settings
+    detection_changed(None, None)
+
+def project_ready():
+    # Every file is loaded and no rescan is running
+    return bool(project_files) and project_load is None and all(entry['decisions'] is not None for entry in project_files)
+
+def detection_changed(sender, app_data):
+    # One of the detection controls moved. Everything but the frame length is
+    # derived again from the cached decisions right away.
+    if not project_ready():
+        return  # Loading or rescanning, the list catches up once that is done
+    settings = detection_settings()
+    if any(entry['decisions'].frame_ms != settings['frame_ms'] for entry in project_files):
+        rescan_frames(settings['frame_ms'])
+    elif settings != regions_settings:
+        resegment(settings)
+
+def resegment(settings):
+    # Replace the buffer list with the regions for these settings, file after
+    # file. Edits made to the old list don't carry over, its segments no longer
+    # exist, but the replacement is one entry in the journal: undo brings the
+    # old list back with its edits and the settings it was derived with.
+    global segments, journal, regions_settings
+    started = time.perf_counter()
+    old = segments
+    segments = SegmentTable()
+    list_files(project_files, settings)
+    if len(old) and regions_settings is not None:
+        journal.replace(segments, regions_settings, settings)
+    else:
+        journal = EditJournal(segments)
+    regions_settings = settings
+    refresh_buffer_list()
+    dpg.set_value("status", f"Found {len(segments)} buffers in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def list_files(entries, settings):
+    # Add the regions of these files to the bottom of the list
+    for entry in entries:
+        for start, end in derive_regions(entry['decisions'], settings):
+            segments.add((start, end), RegionView(entry['source_id'], start, end))
+
+def cancel_load(sender, app_data):
+    if not load_cancel.is_set():
+        load_cancel.set()
+        dpg.set_value("status", "Cancelling...")
+
+def load_audio(sender, app_data):
+    start_project([dpg.get_value("file_selector")])
+
+def add_project_files(sender, app_data):
+    # Called by the multi-select dialog, adds the files to the project
+    paths = sorted(app_data.get('selections', {}).values()) or [app_data['file_path_name']]
+    start_project(paths, append=bool(project_files))
+
+def start_project(paths, session=None, append=False):
+    # Load files, as a new project or added to the one loaded. A new project
+    # restores the session once its files are in, if one is given.
+    global segments, journal, load_cancel, regions_settings, project_load
+    
+    paths = [path for path in paths if path]
+    if not paths:
+        dpg.set_value("status", "No file selected")
+        return
+    
+    for infile in paths:
         print(f"Attempting to open: {infile}")
         print(f"File exists: {os.path.exists(infile)}")
         
-        # Reset all selections and states when loading a new file
-        selected_buffers.clear()  # Clear repeat selections
-        merge_buffers.clear()     # Clear merge selections
-        excluded_buffers.clear()  # Clear excluded buffers
-        
         # Get file extension
         file_ext = os.path.splitext(infile)[1].lower()
         
-        # Load audio based on file type
-        if file_ext == '.m4a':
-            audio = AudioSegment.from_file(infile, format='m4a', codec='aac')
-        elif file_ext == '.mp3':
-            audio = AudioSegment.from_file(infile, format='mp3')
-        elif file_ext == '.wav':
-            audio = AudioSegment.from_file(infile, format='wav')
-        else:
+        if file_ext not in SUPPORTED_EXTENSIONS:
             dpg.set_value("status", f"Unsupported file format: {file_ext}")
             return
-            
-        print(f"Successfully loaded audio file: {len(audio)}ms duration")
-        speech_regions, buffers = detect_voice_buffers(audio)
-        print(f"Detected {len(buffers)} voice regions")
-        
-        # Clear old controls
-        dpg.delete_item("buffer_group", children_only=True)
-        
-        # Create buffer descriptions and add controls
-        buffer_descriptions = []
-        for idx, (region, buf) in enumerate(zip(speech_regions, buffers)):
-            start, end = region
-            dur = (end - start) / 1000.0
-            desc = f'Buffer {idx}: {start}ms - {end}ms ({dur:.2f}s)'
-            buffer_descriptions.append(desc)
-        
-        # Refresh the buffer list with all controls
+    
+    if append and not project_ready():
+        dpg.set_value("status", "Wait for the files to finish loading before adding more")
+        return
+    
+    # Abort the files that are still loading instead of waiting for them
+    load_cancel.set()
+    load_cancel = threading.Event()
+    
+    if not append:
+        # Start over with no buffers, selections or exclusions
+        clear_sources()
+        project_files.clear()
+        segments = SegmentTable()
+        journal = EditJournal(segments)
+        regions_settings = None
+        show_waveform(None)
         refresh_buffer_list()
-        
-        dpg.set_value("status", f"Loaded {len(buffers)} buffers.")
-        
+    
+    entries = [new_project_file(path) for path in paths]
+    project_files.extend(entries)
+    settings = detection_settings()
+    project_load = {'entries': entries, 'settings': settings, 'session': session, 'append': append,
+                    'failed': [], 'cancelled': False}
+    update_project_list()
+    
+    streaming = dpg.get_value("streaming_mode")
+    expected_keys = [source['key'] for source in session['sources']] if session is not None else [None] * len(entries)
+    # A single new file fills the list while it streams in
+    incremental = not append and session is None and len(entries) == 1
+    
+    dpg.set_value("load_progress", 0.0)
+    dpg.configure_item("load_progress", overlay="")
+    dpg.show_item("cancel_load")
+    names = ", ".join(os.path.basename(path) for path in paths)
+    dpg.set_value("status", f"Loading {names}...")
+    threading.Thread(
+        target=project_worker,
+        args=(entries, load_cancel, get_cache(), streaming, max(1, dpg.get_value("vad_workers")), settings,
+              expected_keys, profile_request("load"), incremental),
+        daemon=True,
+    ).start()
+
+def new_project_file(path):
+    # A file of the project. The rest is filled in once it has loaded;
+    # decisions is None while it loads or rescans.
+    return {'path': path, 'source_id': None, 'cache_key': None, 'decisions': None, 'peaks': None, 'listed': False}
+
+def file_loaded(entry, source_id, cache_key, decisions, peaks, listed):
+    entry.update(source_id=source_id, cache_key=cache_key, decisions=decisions, peaks=peaks, listed=listed)
+    if waveform is None:
+        show_waveform_file(entry)  # The first file in
+    update_project_list()
+    finish_project_load()
+
+def file_failed(entry, message):
+    project_files.remove(entry)
+    project_load['entries'].remove(entry)
+    if message is None:
+        project_load['cancelled'] = True
+    else:
+        project_load['failed'].append(message)
+    update_project_list()
+    finish_project_load()
+
+def finish_project_load():
+    # Once every file of the load is in, list their buffers
+    global project_load, regions_settings, journal
+    load = project_load
+    if any(entry['decisions'] is None for entry in load['entries']):
+        return
+    project_load = None
+    entries = load['entries']
+    
+    if load['session'] is not None and not load['failed'] and not load['cancelled']:
+        # The detected list is replaced by the saved one
+        restore_session(load['session'])
+        return
+    if load['append'] and regions_settings is not None:
+        list_files(entries, regions_settings)
+        # A list from before a detection change wouldn't have the new files,
+        # so the history stops at the last change
+        journal = EditJournal.restore(segments, journal.snapshot())
+        refresh_buffer_list()
+    elif entries and all(entry['listed'] for entry in entries):
+        regions_settings = load['settings']  # Listed while streaming in
+    else:
+        resegment(load['settings'])
+    
+    if load['failed']:
+        status = f"Error loading file: {'; '.join(load['failed'])}"
+    elif load['cancelled']:
+        status = "Loading cancelled."
+    elif len(entries) == 1:
+        status = f"Loaded {len(segments)} buffers."
+    else:
+        status = f"Loaded {len(entries)} files, {len(segments)} buffers."
+    dpg.set_value("status", status)
+    
+    # Catch up with controls moved while loading
+    detection_changed(None, None)
+
+def update_project_list():
+    labels = [project_label(i) for i in range(len(project_files))]
+    dpg.configure_item("waveform_file", items=labels)
+    dpg.set_value("project_files", f"Project: {len(project_files)} files" if len(project_files) > 1 else "")
+
+def project_label(index):
+    return f"{index + 1}. {os.path.basename(project_files[index]['path'])}"
+
+def select_waveform_file(sender, app_data):
+    for index, entry in enumerate(project_files):
+        if project_label(index) == app_data and entry['peaks'] is not None:
+            show_waveform_file(entry)
+
+def show_waveform_file(entry):
+    show_waveform(entry['peaks'], entry['source_id'])
+    if entry in project_files:
+        dpg.set_value("waveform_file", project_label(project_files.index(entry)))
+
+def file_name(buf):
+    # Which file of the project a buffer comes from
+    parts = buf.parts if isinstance(buf, MergedView) else [buf]
+    names = {os.path.basename(get_source(part.source_id).name or "") for part in parts}
+    return names.pop() if len(names) == 1 else f"{len(names)} files"
+
+def save_session_file(sender, app_data):
+    # Called by the save dialog
+    path = app_data['file_path_name']
+    if not path:
+        return
+    if not project_ready():
+        dpg.set_value("status", "Wait for the files to finish loading before saving a session")
+        return
+    if not path.endswith(SESSION_EXTENSION):
+        path = path.rsplit('.', 1)[0] + SESSION_EXTENSION
+    
+    # Snapshot on the UI thread, hashing the sources may take a moment the first time
+    files = [(entry['path'], entry['cache_key'], entry['source_id']) for entry in project_files]
+    data = session_data(files, regions_settings, segments, journal)
+    threading.Thread(target=save_session_worker, args=(path, data), daemon=True).start()
+
+def save_session_worker(path, data):
+    try:
+        for source in data['sources']:
+            if source['key'] is None:
+                source['key'] = hash_file(source['path'])
+        save_session(path, data)
+        post("message", None, f"Saved session to {path}")
+    except Exception as e:
+        print(f"Error saving session: {str(e)}")
+        traceback.print_exc()
+        post("message", None, f"Error saving session: {str(e)}")
+
+def open_session_file(sender, app_data):
+    # Called by the open dialog. The files load as usual (from the cache when
+    # possible), then the saved list replaces the detected one.
+    path = app_data['file_path_name']
+    if not path:
+        return
+    try:
+        session = load_session(path)
     except Exception as e:
-        print(f"Error details: {str(e)}")
-        print("Full traceback:")
+        print(f"Error opening session: {str(e)}")
         traceback.print_exc()
-        dpg.set_value("status", f"Error loading file: {str(e)}")
+        dpg.set_value("status", f"Error opening session: {str(e)}")
+        return
+    
+    paths = [source['path'] for source in session['sources']]
+    missing = [infile for infile in paths if not os.path.exists(infile)]
+    if missing:
+        dpg.set_value("status", f"Source file not found: {', '.join(missing)}")
+        return
+    dpg.set_value("file_selector", paths[0])
+    dpg.set_value("output_file", os.path.basename(paths[0]).rsplit('.', 1)[0] + '-processed' + output_extension())
+    set_detection_controls(session['settings'])
+    start_project(paths, session)
+
+def restore_session(session):
+    global segments, journal, regions_settings
+    segments = restore_segments(session, [entry['source_id'] for entry in project_files])
+    journal = EditJournal.restore(segments, session['journal'])
+    regions_settings = session['settings']
+    refresh_buffer_list()
+    dpg.set_value("status", f"Restored session with {len(segments)} buffers")
 
 def toggle_repeat(sender, app_data, user_data):
-    global selected_buffers
-    idx = user_data
-    if idx in selected_buffers:
-        selected_buffers.remove(idx)
-        dpg.configure_item(sender, label="Repeat")
-    else:
-        selected_buffers.add(idx)
-        dpg.configure_item(sender, label="Repeating")
+    journal.toggle(user_data, REPEAT)
+    update_rows([user_data])
     
     # Update status with current buffer descriptions
-    selected_descriptions = [buffer_descriptions[i] for i in sorted(selected_buffers)]
+    selected_descriptions = [segments.describe(i) for i in segments.with_flag(REPEAT)]
     dpg.set_value("status", f'Selected buffers for repetition: {", ".join(selected_descriptions)}')
 
 def toggle_merge(sender, app_data, user_data):
-    global merge_buffers
-    idx = user_data
-    if idx in merge_buffers:
-        merge_buffers.remove(idx)
-    else:
-        merge_buffers.add(idx)
+    segments.toggle(user_data, MERGE)
     
     # Update status with current buffer descriptions
-    merge_descriptions = [buffer_descriptions[i] for i in sorted(merge_buffers)]
+    merge_descriptions = [segments.describe(i) for i in segments.with_flag(MERGE)]
     dpg.set_value("status", f'Selected buffers for merging: {", ".join(merge_descriptions)}')
 
 def toggle_exclude(sender, app_data, user_data):
-    global excluded_buffers, excluded_buffer_history
-    idx = user_data
-    if idx in excluded_buffers:
-        excluded_buffers.remove(idx)
-        dpg.configure_item(sender, label="Exclude")
-    else:
-        excluded_buffers.add(idx)
-        # Store the buffer info for undo
-        excluded_buffer_history.append({
-            'index': idx,
-            'buffer': buffers[idx],
-            'region': speech_regions[idx],
-            'description': buffer_descriptions[idx],
-            'was_selected': idx in selected_buffers,
-            'was_merge_selected': idx in merge_buffers
-        })
-        dpg.configure_item(sender, label="Excluded")
+    journal.toggle(user_data, EXCLUDED)
     
     # Update status with current buffer descriptions
-    excluded_descriptions = [buffer_descriptions[i] for i in sorted(excluded_buffers)]
+    excluded_descriptions = [segments.describe(i) for i in segments.with_flag(EXCLUDED)]
     dpg.set_value("status", f'Excluded buffers: {", ".join(excluded_descriptions)}')
     
-    # Refresh the buffer list to update visibility
+    # The row disappears, the rows below move up
     refresh_buffer_list()
 
-def undo_exclude(sender, app_data):
-    global excluded_buffers, excluded_buffer_history, buffers, speech_regions, buffer_descriptions, selected_buffers, merge_buffers
-    
-    if not excluded_buffer_history:
-        dpg.set_value("status", "No excluded buffers to restore")
+def undo_edit(sender=None, app_data=None):
+    edit = journal.undo()
+    if edit is None:
+        dpg.set_value("status", "Nothing to undo")
         return
+    show_edit(edit)
+    dpg.set_value("status", f"Undid {describe_edit(edit)}")
+
+def redo_edit(sender=None, app_data=None):
+    edit = journal.redo()
+    if edit is None:
+        dpg.set_value("status", "Nothing to redo")
+        return
+    show_edit(edit)
+    dpg.set_value("status", f"Redid {describe_edit(edit)}")
+
+def undo_shortcut(sender, app_data):
+    # Ctrl+Z undoes, Ctrl+Shift+Z or Ctrl+Y redoes. Not while typing in a field,
+    # there it is the field's own undo.
+    if not dpg.is_key_down(dpg.mvKey_Control):
+        return
+    if any(dpg.is_item_active(tag) for tag in TEXT_INPUTS):
+        return
+    if app_data == dpg.mvKey_Y or dpg.is_key_down(dpg.mvKey_Shift):
+        redo_edit()
+    else:
+        undo_edit()
+
+def update_undo_buttons():
+    # Enable Undo and Redo only when there is something to undo or redo, called every frame
+    global undo_shown
+    state = (journal.can_undo(), journal.can_redo())
+    if state == undo_shown:
+        return
+    undo_shown = state
+    dpg.configure_item("undo_button", enabled=state[0])
+    dpg.configure_item("redo_button", enabled=state[1])
+
+def show_edit(edit):
+    # Redraw what an undone or redone edit changed
+    global segments, regions_settings
+    if edit[0] == 'table':
+        # The list and the detection controls go back or forward together
+        segments = journal.table
+        regions_settings = edit[4] if segments is edit[2] else edit[3]
+        set_detection_controls(regions_settings)
+        refresh_buffer_list()
+        detection_changed(None, None)  # Rescans if the frame length went back too
+    elif edit[0] == 'flag' and edit[2] == REPEAT:
+        update_rows([edit[1]])
+    elif edit[0] == 'swap':
+        seg_id, other_id = segments.order[edit[1]], segments.order[edit[2]]
+        if segments.has(seg_id, EXCLUDED):
+            seg_id, other_id = other_id, seg_id
+        swap_rows(seg_id, other_id)
+    else:
+        refresh_buffer_list()  # Rows appear, disappear or collapse
+
+def describe_edit(edit):
+    kind = edit[0]
+    if kind == 'flag':
+        seg_id = edit[1]
+        what = "repeat" if edit[2] == REPEAT else "exclude"
+        name = "Merged Buffer" if segments.has(seg_id, MERGED) else "Buffer"
+        return f"{what} of {name} {segments.position(seg_id)}"
+    if kind == 'swap':
+        return f"move between positions {edit[1]} and {edit[2]}"
+    if kind == 'table':
+        return "detection settings change"
+    return f"merge of {len(edit[2])} buffers"
+
+def move_buffer_up(sender, app_data, user_data):
+    move_buffer(user_data, -1)
+
+def move_buffer_down(sender, app_data, user_data):
+    move_buffer(user_data, 1)
+
+def move_buffer(seg_id, step):
+    position = segments.position(seg_id)
+    other = position + step
+    if not 0 <= other < len(segments):
+        return  # Already at the top or bottom
     
-    # Get the last excluded buffer info
-    last_excluded = excluded_buffer_history.pop()
-    idx = last_excluded['index']
-    
-    # Remove from excluded set
-    excluded_buffers.remove(idx)
+    journal.swap(position, other)
     
-    # Restore the buffer
-    buffers[idx] = last_excluded['buffer']
-    speech_regions[idx] = last_excluded['region']
-    buffer_descriptions[idx] = last_excluded['description']
+    # Only the two swapped rows change
+    swap_rows(seg_id, segments.order[position])
     
-    # Restore selection states
-    if last_excluded['was_selected']:
-        selected_buffers.add(idx)
-    if last_excluded['was_merge_selected']:
-        merge_buffers.add(idx)
+    # Update status with current buffer descriptions
+    selected_descriptions = [segments.describe(i) for i in segments.with_flag(REPEAT)]
+    excluded_descriptions = [segments.describe(i) for i in segments.with_flag(EXCLUDED)]
     
-    # Update buffer labels
-    update_buffer_labels()
+    status_parts = []
+    if selected_descriptions:
+        status_parts.append(f'Selected for repetition: {", ".join(selected_descriptions)}')
+    if excluded_descriptions:
+        status_parts.append(f'Excluded: {", ".join(excluded_descriptions)}')
     
-    # Refresh the buffer list
-    refresh_buffer_list()
+    status_message = f"Moved {segments.describe(seg_id)} {'up' if step < 0 else 'down'}"
+    if status_parts:
+        status_message += " | " + " | ".join(status_parts)
     
-    # Update status
-    dpg.set_value("status", f"Restored {buffer_descriptions[idx]}")
-
-def move_buffer_up(sender, app_data, user_data):
-    global buffers, speech_regions, buffer_descriptions
-    idx = user_data
-    if idx > 0:  # Can't move first buffer up
-        # Swap buffers
-        buffers[idx], buffers[idx-1] = buffers[idx-1], buffers[idx]
-        speech_regions[idx], speech_regions[idx-1] = speech_regions[idx-1], speech_regions[idx]
-        buffer_descriptions[idx], buffer_descriptions[idx-1] = buffer_descriptions[idx-1], buffer_descriptions[idx]
-        
-        # Update selected, excluded, and merge sets if needed
-        if idx in selected_buffers:
-            selected_buffers.remove(idx)
-            selected_buffers.add(idx-1)
-        if idx-1 in selected_buffers:
-            selected_buffers.remove(idx-1)
-            selected_buffers.add(idx)
-            
-        if idx in merge_buffers:
-            merge_buffers.remove(idx)
-            merge_buffers.add(idx-1)
-        if idx-1 in merge_buffers:
-            merge_buffers.remove(idx-1)
-            merge_buffers.add(idx)
-            
-        if idx in excluded_buffers:
-            excluded_buffers.remove(idx)
-            excluded_buffers.add(idx-1)
-        if idx-1 in excluded_buffers:
-            excluded_buffers.remove(idx-1)
-            excluded_buffers.add(idx)
-        
-        # Update buffer labels with new indices
-        update_buffer_labels()
-        
-        # Refresh the buffer list
-        refresh_buffer_list()
-        
-        # Update status with current buffer descriptions
-        selected_descriptions = [buffer_descriptions[i] for i in sorted(selected_buffers)]
-        excluded_descriptions = [buffer_descriptions[i] for i in sorted(excluded_buffers)]
-        
-        status_parts = []
-        if selected_descriptions:
-            status_parts.append(f'Selected for repetition: {", ".join(selected_descriptions)}')
-        if excluded_descriptions:
-            status_parts.append(f'Excluded: {", ".join(excluded_descriptions)}')
-        
-        status_message = f"Moved {buffer_descriptions[idx-1]} up"
-        if status_parts:
-            status_message += " | " + " | ".join(status_parts)
-        
-        dpg.set_value("status", status_message)
-
-def move_buffer_down(sender, app_data, user_data):
-    global buffers, speech_regions, buffer_descriptions
-    idx = user_data
-    if idx < len(buffers) - 1:  # Can't move last buffer down
-        # Swap buffers
-        buffers[idx], buffers[idx+1] = buffers[idx+1], buffers[idx]
-        speech_regions[idx], speech_regions[idx+1] = speech_regions[idx+1], speech_regions[idx]
-        buffer_descriptions[idx], buffer_descriptions[idx+1] = buffer_descriptions[idx+1], buffer_descriptions[idx]
-        
-        # Update selected, excluded, and merge sets if needed
-        if idx in selected_buffers:
-            selected_buffers.remove(idx)
-            selected_buffers.add(idx+1)
-        if idx+1 in selected_buffers:
-            selected_buffers.remove(idx+1)
-            selected_buffers.add(idx)
-            
-        if idx in merge_buffers:
-            merge_buffers.remove(idx)
-            merge_buffers.add(idx+1)
-        if idx+1 in merge_buffers:
-            merge_buffers.remove(idx+1)
-            merge_buffers.add(idx)
-            
-        if idx in excluded_buffers:
-            excluded_buffers.remove(idx)
-            excluded_buffers.add(idx+1)
-        if idx+1 in excluded_buffers:
-            excluded_buffers.remove(idx+1)
-            excluded_buffers.add(idx)
-        
-        # Update buffer labels with new indices
-        update_buffer_labels()
-        
-        # Refresh the buffer list
-        refresh_buffer_list()
-        
-        # Update status with current buffer descriptions
-        selected_descriptions = [buffer_descriptions[i] for i in sorted(selected_buffers)]
-        excluded_descriptions = [buffer_descriptions[i] for i in sorted(excluded_buffers)]
-        
-        status_parts = []
-        if selected_descriptions:
-            status_parts.append(f'Selected for repetition: {", ".join(selected_descriptions)}')
-        if excluded_descriptions:
-            status_parts.append(f'Excluded: {", ".join(excluded_descriptions)}')
-        
-        status_message = f"Moved {buffer_descriptions[idx+1]} down"
-        if status_parts:
-            status_message += " | " + " | ".join(status_parts)
-        
-        dpg.set_value("status", status_message)
-
-def update_buffer_labels():
-    # Update buffer descriptions with new indices
-    new_descriptions = []
-    for idx, (region, buf) in enumerate(zip(speech_regions, buffers)):
-        start, end = region
-        dur = (end - start) / 1000.0
-        if "Merged Buffer" in buffer_descriptions[idx]:
-            desc = f'Merged Buffer {idx}: {start}ms - {end}ms ({dur:.2f}s)'
-        else:
-            desc = f'Buffer {idx}: {start}ms - {end}ms ({dur:.2f}s)'
-        new_descriptions.append(desc)
-    buffer_descriptions.clear()
-    buffer_descriptions.extend(new_descriptions)
+    dpg.set_value("status", status_message)
 
 def merge_selected(sender, app_data):
-    global buffers, speech_regions, buffer_descriptions, selected_buffers, merge_buffers, excluded_buffers
-    
-    if not buffers:
+    if not len(segments):
         dpg.set_value("status", "No buffers loaded")
         return
-        
-    if len(merge_buffers) < 2:
+    
+    merge_ids = segments.with_flag(MERGE)
+    if len(merge_ids) < 2:
         dpg.set_value("status", "Please select at least 2 buffers to merge")
         return
     
     try:
-        # Sort selected indices to maintain order
-        selected_indices = sorted(list(merge_buffers))
-        
-        # Create new merged buffer
-        merged_buffer = AudioSegment.silent(duration=0)
-        for idx in selected_indices:
-            merged_buffer += buffers[idx]
-        
-        # Update buffers and descriptions
-        new_buffers = []
-        new_regions = []
-        new_descriptions = []
-        
-        # Track which indices in the new list correspond to which old indices
-        new_to_old_mapping = {}
-        current_new_idx = 0
+        # The merged buffer only refers to the selected buffers' audio, and takes
+        # the place of the first of them
+        merged_buffer = MergedView([segments.buffers[i] for i in merge_ids])
+        journal.merge(merge_ids, merged_buffer)
         
-        # Add unselected buffers before the first selected one
-        for i in range(selected_indices[0]):
-            new_buffers.append(buffers[i])
-            new_regions.append(speech_regions[i])
-            new_descriptions.append(buffer_descriptions[i])
-            new_to_old_mapping[current_new_idx] = i
-            current_new_idx += 1
+        # Clear merge selections, the rows show the new state
+        segments.clear_flag(MERGE)
         
-        # Add merged buffer
-        new_buffers.append(merged_buffer)
-        start_time = speech_regions[selected_indices[0]][0]
-        end_time = speech_regions[selected_indices[-1]][1]
-        new_regions.append((start_time, end_time))
-        dur = (end_time - start_time) / 1000.0
-        new_descriptions.append(f'Merged Buffer: {start_time}ms - {end_time}ms ({dur:.2f}s)')
-        new_to_old_mapping[current_new_idx] = selected_indices[0]  # Map merged buffer to first selected buffer
-        current_new_idx += 1
-        
-        # Add unselected buffers after the last selected one
-        for i in range(selected_indices[-1] + 1, len(buffers)):
-            new_buffers.append(buffers[i])
-            new_regions.append(speech_regions[i])
-            new_descriptions.append(buffer_descriptions[i])
-            new_to_old_mapping[current_new_idx] = i
-            current_new_idx += 1
-        
-        # Update global variables
-        buffers = new_buffers
-        speech_regions = new_regions
-        buffer_descriptions = new_descriptions
-        
-        # Update selected and excluded buffers based on the new mapping
-        new_selected = set()
-        new_excluded = set()
-        
-        for new_idx, old_idx in new_to_old_mapping.items():
-            if old_idx in selected_buffers:
-                new_selected.add(new_idx)
-            if old_idx in excluded_buffers:
-                new_excluded.add(new_idx)
-        
-        selected_buffers = new_selected
-        excluded_buffers = new_excluded
-        
-        # Update buffer labels with new indices
-        update_buffer_labels()
-        
-        # Clear old controls
-        dpg.delete_item("buffer_group", children_only=True)
-        
-        # Refresh the buffer list with all controls
+        # The merged rows collapse into one
         refresh_buffer_list()
         
-        # Clear merge checkboxes and merge_buffers set
-        merge_buffers.clear()
-        for idx in range(len(buffers)):
-            if idx not in excluded_buffers:  # Only clear checkboxes for visible buffers
-                dpg.set_value(f"merge_{idx}", False)
-        
         # Update status messages with new buffer descriptions
-        selected_descriptions = [buffer_descriptions[i] for i in sorted(selected_buffers)]
-        excluded_descriptions = [buffer_descriptions[i] for i in sorted(excluded_buffers)]
+        selected_descriptions = [segments.describe(i) for i in segments.with_flag(REPEAT)]
+        excluded_descriptions = [segments.describe(i) for i in segments.with_flag(EXCLUDED)]
         
         status_parts = []
         if selected_descriptions:
@@ -483,7 +927,7 @@ def merge_selected(sender, app_data):
         if excluded_descriptions:
             status_parts.append(f'Excluded: {", ".join(excluded_descriptions)}')
         
-        status_message = f"Merged {len(selected_indices)} buffers into one."
+        status_message = f"Merged {len(merge_ids)} buffers into one."
         if status_parts:
             status_message += " | " + " | ".join(status_parts)
         
@@ -520,10 +964,13 @@ def show_message(title, message):
         dpg.add_text(message)
         dpg.add_button(label="OK", callback=close_message)
 
+class ExportCancelled(Exception):
+    pass
+
 def process_and_save(sender, app_data):
-    global audio, buffers, selected_buffers
+    global export_thread
     
-    if not audio or not buffers:
+    if not len(segments):
         dpg.set_value("status", "No audio loaded or no buffers detected.")
         return
         
@@ -533,108 +980,292 @@ def process_and_save(sender, app_data):
         dpg.set_value("status", "Please select output folder and filename.")
         return
         
-    # Ensure output file has .wav extension
-    if not outfile.endswith('.wav'):
-        outfile = outfile.rsplit('.', 1)[0] + '.wav'
-        
-    output = AudioSegment.silent(duration=0)
+    # Ensure output file has the extension of the output format
+    extension = output_extension()
+    if not outfile.lower().endswith(extension):
+        outfile = outfile.rsplit('.', 1)[0] + extension
     
-    # Get selected buffers for repetition
-    repeat_indices = sorted(list(selected_buffers))
+    # Construct the full output path
+    outpath = os.path.abspath(os.path.join(outfolder, outfile))
+    
+    # Snapshot the list as it is now, editing can go on while the export waits
+    # its turn. The sources stay loaded until the export is done with them.
+    buffers = segments.ordered_buffers()
+    job = {
+        'buffers': buffers,
+        'repeat': segments.positions_with(REPEAT),
+        'excluded': segments.positions_with(EXCLUDED),
+        'outpath': outpath,
+        'target': output_target(),
+        'sources': buffer_sources(buffers),
+        'cancel': threading.Event(),
+        'profile': profile_request("export"),
+    }
+    retain_sources(job['sources'])
+    export_jobs.put(job)
+    
+    if export_thread is None:
+        export_thread = threading.Thread(target=export_worker, daemon=True)
+        export_thread.start()
+    dpg.set_value("status", f"Queued export of {outfile} ({export_jobs.qsize()} waiting)")
+
+def export_worker():
+    # Runs queued exports one after another
+    global current_export
+    while True:
+        job = export_jobs.get()
+        current_export = job
+        try:
+            run_export(job)
+        finally:
+            current_export = None
+            release_sources(job['sources'])
+
+def run_export(job):
+    name = os.path.basename(job['outpath'])
+    with labelled(name):
+        if job['profile'] is None:
+            write_export(job)
+            return
+        with profiled(job['profile']):
+            write_export(job)
+        post("profile", None, job['profile'])
+
+def write_export(job):
+    cancel = job['cancel']
+    name = os.path.basename(job['outpath'])
+    
+    segments_done = [0, 0]  # Segments written, in total
+    
+    def on_segment(done, total):
+        if cancel.is_set():
+            raise ExportCancelled()
+        segments_done[:] = [done, total]
+    
+    def on_write(written, total):
+        if cancel.is_set():
+            raise ExportCancelled()
+        done, count = segments_done
+        segment = f"segment {min(done + 1, count)}/{count}, " if count else ""  # The one being written
+        post("export_progress", cancel, f"{name}: {segment}{written / 1e6:.1f} of {total / 1e6:.1f} MB written",
+             min(1.0, written / max(1, total)))
     
-    # Process all buffers
-    for i, buf in enumerate(buffers):
-        # Skip excluded buffers
-        if i in excluded_buffers:
-            continue
-            
-        # If this buffer is selected for repetition, add silence before first instance
-        if i in repeat_indices:
-            silence_duration = int(len(buf) * 1.5)
-            output += AudioSegment.silent(duration=silence_duration)
-        
-        # Add the buffer
-        output += buf
-        
-        # Add 2 seconds of silence after the first buffer
-        if i == 0:
-            output += AudioSegment.silent(duration=2000)
-        
-        # If this buffer is selected for repetition
-        if i in repeat_indices:
-            # Calculate silence duration (1.5x buffer duration)
-            silence_duration = int(len(buf) * 1.5)
-            
-            # Add silence before the repeated buffer
-            output += AudioSegment.silent(duration=silence_duration)
-            
-            # Add the buffer again
-            output += buf
-            
-            # Add silence after the repeated buffer
-            output += AudioSegment.silent(duration=silence_duration)
-                
     try:
-        # Create output directory if it doesn't exist
-        os.makedirs(outfolder, exist_ok=True)
-        
-        # Construct the full output path
-        outpath = os.path.abspath(os.path.join(outfolder, outfile))
-        print(f"Saving to: {outpath}")
-        
-        # Export as WAV with maximum quality
-        output.export(
-            outpath,
-            format='wav',
-            parameters=[
-                '-acodec', 'pcm_s16le',  # 16-bit PCM
-                '-ar', '44100',          # 44.1kHz sample rate
-                '-ac', '2'               # Stereo
-            ]
-        )
+        print(f"Saving to: {job['outpath']}")
+        # Assembled and encoded in one pass, a chunk at a time
+        export_output(job['buffers'], job['outpath'], job['repeat'], job['excluded'], job['target'],
+                      progress=on_segment, on_write=on_write)
         
         # Show success message
         print("File successfully saved!")
-        dpg.set_value("status", f'Successfully saved to {outpath}')
+        post("export_status", cancel, f"Successfully saved to {job['outpath']}")
+    except ExportCancelled:
+        print(f"Cancelled export of {job['outpath']}")
+        post("export_status", cancel, f"Cancelled export of {name}")
     except Exception as e:
         print(f"Error saving file: {str(e)}")
         traceback.print_exc()
-        dpg.set_value("status", f'Error saving file: {e}')
+        post("export_status", cancel, f"Error saving file: {e}")
 
-def refresh_buffer_list():
-    # Clear old controls
-    dpg.delete_item("buffer_group", children_only=True)
+def output_target():
+    # Current values of the output format controls
+    return {
+        'encoding': dpg.get_value("output_encoding").lower(),
+        'frame_rate': int(dpg.get_value("output_frame_rate")),
+        'channels': 1 if dpg.get_value("output_channels") == "Mono" else 2,
+    }
+
+def output_extension():
+    return OUTPUT_ENCODINGS[dpg.get_value("output_encoding").lower()][0]
+
+def output_encoding_changed(sender, app_data):
+    # Keep the output filename's extension in line with the format
+    outfile = dpg.get_value("output_file")
+    if outfile:
+        dpg.set_value("output_file", outfile.rsplit('.', 1)[0] + output_extension())
+
+def cancel_export(sender, app_data):
+    job = current_export
+    if job is not None and not job['cancel'].is_set():
+        job['cancel'].set()
+        dpg.set_value("status", f"Cancelling export of {os.path.basename(job['outpath'])}...")
+
+def show_waveform(peaks, source_id=None):
+    global waveform, waveform_view, waveform_fit, waveform_source, waveform_spans
+    waveform = peaks
+    waveform_source = source_id
+    waveform_spans = None
+    waveform_view = None
+    waveform_fit = peaks is not None
+    if peaks is None:
+        for series in ("waveform_peaks", "waveform_regions"):
+            dpg.set_value(series, [[], [], []])
+
+def update_waveform():
+    # Redraw the waveform when it was zoomed, panned or the buffers changed.
+    # Called every frame; a redraw only reduces one level of the peak pyramid.
+    global waveform_view, waveform_fit
+    if waveform is None:
+        return
+    width = max(1, dpg.get_item_rect_size("waveform_plot")[0])
+    if waveform_fit:
+        # A new file starts zoomed out all the way
+        start, end = 0.0, waveform.duration()
+    else:
+        start, end = dpg.get_axis_limits("waveform_x")
+        if waveform_view == (start, end, width):
+            return
+    waveform_view = (start, end, width)
     
-    # Add new controls
-    for idx, desc in enumerate(buffer_descriptions):
-        # Skip excluded buffers
-        if idx in excluded_buffers:
-            continue
-            
-        with dpg.group(parent="buffer_group", horizontal=True):
-            dpg.add_checkbox(label="Merge", tag=f"merge_{idx}", callback=toggle_merge, user_data=idx)
-            dpg.add_text(desc)
-            dpg.add_button(label="Play", tag=f"play_{idx}", callback=play_buffer, user_data=idx)
-            dpg.add_button(label="Repeat", tag=f"repeat_{idx}", callback=toggle_repeat, user_data=idx)
-            dpg.add_button(label="Up", tag=f"up_{idx}", callback=move_buffer_up, user_data=idx)
-            dpg.add_button(label="Down", tag=f"down_{idx}", callback=move_buffer_down, user_data=idx)
-            dpg.add_button(label="Exclude", tag=f"exclude_{idx}", callback=toggle_exclude, user_data=idx)
-            
-            # Update checkbox and button states
-            if idx in merge_buffers:
-                dpg.set_value(f"merge_{idx}", True)
-            if idx in selected_buffers:
-                dpg.configure_item(f"repeat_{idx}", label="Repeating")
+    times, mins, maxs = waveform.query(start, end, width)
+    dpg.set_value("waveform_peaks", [times.tolist(), maxs.tolist(), mins.tolist()])
+    
+    # Listed buffers of the file shown are shaded behind the waveform
+    starts, ends = listed_spans()
+    covered = region_mask(starts, ends, times).astype(float)
+    dpg.set_value("waveform_regions", [times.tolist(), covered.tolist(), (-covered).tolist()])
+    
+    if waveform_fit:
+        waveform_fit = False
+        dpg.fit_axis_data("waveform_x")
 
-def main():
-    global merge_buffers
+def listed_spans():
+    # (starts, ends) in ms of the listed audio that comes from the file the
+    # waveform shows. Merged buffers are shaded part by part, as their parts
+    # may come from different places or files.
+    global waveform_spans
+    if waveform_spans is None:
+        spans = []
+        for seg_id in visible_rows:
+            buf = segments.buffers[seg_id]
+            for part in (buf.parts if isinstance(buf, MergedView) else [buf]):
+                if part.source_id == waveform_source:
+                    spans.append((part.start_ms, part.end_ms))
+        spans = np.array(spans, dtype=np.int64).reshape(-1, 2)
+        waveform_spans = (spans[:, 0], spans[:, 1])
+    return waveform_spans
+
+def add_row_slot():
+    # One reusable row of widgets, pointed at a buffer by bind_row()
+    slot = len(slot_rows)
+    with dpg.group(parent="buffer_group", horizontal=True, tag=f"row_{slot}", show=False):
+        dpg.add_checkbox(label="Merge", tag=f"merge_{slot}", callback=toggle_merge)
+        dpg.add_text("", tag=f"desc_{slot}")
+        dpg.add_button(label="Play", tag=f"play_{slot}", callback=play_buffer)
+        dpg.add_button(label="Repeat", tag=f"repeat_{slot}", callback=toggle_repeat)
+        dpg.add_button(label="Up", tag=f"up_{slot}", callback=move_buffer_up)
+        dpg.add_button(label="Down", tag=f"down_{slot}", callback=move_buffer_down)
+        dpg.add_button(label="Exclude", tag=f"exclude_{slot}", callback=toggle_exclude)
+    slot_rows.append(None)
+
+def bind_row(slot, seg_id):
+    # Show a segment in a row and send its callbacks there
+    for name in ("merge", "play", "repeat", "up", "down", "exclude"):
+        dpg.configure_item(f"{name}_{slot}", user_data=seg_id)
+    dpg.set_value(f"merge_{slot}", segments.has(seg_id, MERGE))
+    dpg.set_value(f"desc_{slot}", describe_segment(seg_id))
+    dpg.configure_item(f"repeat_{slot}", label="Repeating" if segments.has(seg_id, REPEAT) else "Repeat")
+    if slot_rows[slot] is None:
+        dpg.show_item(f"row_{slot}")
+    slot_rows[slot] = seg_id
+
+def describe_segment(seg_id):
+    # With several files, which one a buffer comes from
+    if len(project_files) > 1:
+        return f"{segments.describe(seg_id)} [{file_name(segments.buffers[seg_id])}]"
+    return segments.describe(seg_id)
+
+def update_rows(seg_ids):
+    # Redraw only the rows of these segments, if they are on screen
+    seg_ids = set(seg_ids)
+    for slot, seg_id in enumerate(slot_rows):
+        if seg_id in seg_ids:
+            bind_row(slot, seg_id)
+
+def swap_rows(seg_id, other_id):
+    # Two neighbouring segments changed places. An excluded neighbour isn't
+    # listed, then only the moved row's number changes.
+    if segments.has(other_id, EXCLUDED):
+        update_rows([seg_id])
+        return
+    if seg_id not in slot_rows or other_id not in slot_rows:
+        refresh_buffer_list()
+        return
+    slot, other_slot = slot_rows.index(seg_id), slot_rows.index(other_id)
+    visible_rows[first_listed + slot], visible_rows[first_listed + other_slot] = other_id, seg_id
+    bind_row(slot, other_id)
+    bind_row(other_slot, seg_id)
+
+def show_visible_rows():
+    # Point the row widgets at the part of the list that is scrolled into view.
+    # Called every frame, does nothing unless the list was scrolled or changed.
+    global first_listed
+    first = max(0, int(dpg.get_y_scroll("buffer_window")) // ROW_HEIGHT - ROW_OVERSCAN)
+    first = min(first, len(visible_rows))
+    if first == first_listed:
+        return
+    if first_listed == -1 and visible_rows and project_ready():
+        # The list changed, time redrawing it. Not while loading, when it grows
+        # with every chunk.
+        first_listed = first
+        with stage('render', items=len(visible_rows)):
+            bind_visible_rows(first)
+    else:
+        first_listed = first
+        bind_visible_rows(first)
+
+def bind_visible_rows(first):
+    count = min(len(visible_rows) - first, dpg.get_item_height("buffer_window") // ROW_HEIGHT + 2 * ROW_OVERSCAN + 1)
+    while len(slot_rows) < count:
+        add_row_slot()
     
+    # Spacers stand in for the rows above and below
+    dpg.configure_item("buffer_list_top", height=first * ROW_HEIGHT)
+    dpg.configure_item("buffer_list_bottom", height=(len(visible_rows) - first - count) * ROW_HEIGHT)
+    for slot in range(len(slot_rows)):
+        if slot < count:
+            bind_row(slot, visible_rows[first + slot])
+        elif slot_rows[slot] is not None:
+            dpg.hide_item(f"row_{slot}")
+            slot_rows[slot] = None
+
+def profile_request(kind):
+    # Where to write the profile of this load or export, None unless asked for.
+    # Only the next one is profiled.
+    if not dpg.get_value("profile_next"):
+        return None
+    dpg.set_value("profile_next", False)
+    return os.path.join(os.getcwd(), "profiles", f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+
+def toggle_json_log(sender, app_data):
+    try:
+        set_log_file(dpg.get_value("diagnostics_log_path") if app_data else None)
+    except OSError as e:
+        dpg.set_value("diagnostics_log", False)
+        dpg.set_value("status", f"Can't write log: {str(e)}")
+
+def update_diagnostics():
+    # Show new stage timings in the diagnostics panel, called every frame
+    global diagnostics_shown
+    if record_count() == diagnostics_shown:
+        return
+    diagnostics_shown = record_count()
+    dpg.set_value("diagnostics_text", "\n".join(describe(entry) for entry in reversed(recent())))
+
+def refresh_buffer_list():
+    # Recompute which buffers are listed after buffers were added, removed,
+    # excluded or restored. The rows on screen are redrawn on the next frame, so
+    # row widgets are only ever created on the render thread.
+    global first_listed, waveform_view, waveform_spans
+    visible_rows[:] = segments.without_flag(EXCLUDED)
+    first_listed = -1
+    waveform_view = waveform_spans = None  # The region overlay changed too
+
+def main():
     dpg.create_context()
     dpg.create_viewport(title="Voice Buffer Splitter", width=800, height=600)
     dpg.setup_dearpygui()
     
-    merge_buffers = set()  # Initialize merge_buffers set
-    
     # Create file dialogs
     with dpg.file_dialog(
         directory_selector=True, 
@@ -657,22 +1288,86 @@ def main():
         dpg.add_file_extension(".mp3")
         dpg.add_file_extension(".wav")
     
+    with dpg.file_dialog(show=False, callback=add_project_files, tag="project_file_dialog", width=700, height=400,
+                         file_count=100):
+        dpg.add_file_extension(".m4a")
+        dpg.add_file_extension(".mp3")
+        dpg.add_file_extension(".wav")
+    
+    with dpg.file_dialog(show=False, callback=open_session_file, tag="session_open_dialog", width=700, height=400):
+        dpg.add_file_extension(SESSION_EXTENSION)
+    with dpg.file_dialog(show=False, callback=save_session_file, tag="session_save_dialog", width=700, height=400,
+                         default_filename="session"):
+        dpg.add_file_extension(SESSION_EXTENSION)
+    
     with dpg.window(label="Voice Buffer Splitter", tag="Primary Window"):
         dpg.add_text("Select input audio file:")
         with dpg.group(horizontal=True):
             dpg.add_input_text(tag="file_selector", readonly=True, width=400)
             dpg.add_button(label="Browse", callback=lambda: dpg.show_item("input_file_dialog"))
+            dpg.add_button(label="Add Files", callback=lambda: dpg.show_item("project_file_dialog"))
+            dpg.add_button(label="Open Session", callback=lambda: dpg.show_item("session_open_dialog"))
+            dpg.add_button(label="Save Session", callback=lambda: dpg.show_item("session_save_dialog"))
+        with dpg.group(horizontal=True):
+            dpg.add_progress_bar(tag="load_progress", default_value=0.0, width=400)
+            dpg.add_button(label="Cancel", tag="cancel_load", callback=cancel_load, show=False)
+        with dpg.group(horizontal=True):
+            dpg.add_checkbox(label="Streaming mode (lower memory, buffers appear while loading)", tag="streaming_mode", default_value=True)
+            dpg.add_input_int(label="VAD workers (non-streaming)", tag="vad_workers", default_value=os.cpu_count() or 1, min_value=1, min_clamped=True, width=100)
+        with dpg.group(horizontal=True):
+            dpg.add_checkbox(label="Cache decoded audio and detected buffers", tag="use_cache", default_value=True)
+            dpg.add_button(label="Clear Cache", callback=clear_cache)
+        
+        # Detection, all but the frame length apply instantly to the loaded file
+        with dpg.group(horizontal=True):
+            dpg.add_slider_int(label="Aggressiveness", tag="vad_aggressiveness", default_value=2, min_value=0, max_value=3,
+                               width=100, callback=detection_changed)
+            dpg.add_combo(("10", "20", "30"), label="Frame ms (rescans)", tag="vad_frame_ms", default_value="30",
+                          width=60, callback=detection_changed)
+        with dpg.group(horizontal=True):
+            dpg.add_slider_int(label="Hangover ms", tag="vad_max_silence_ms", default_value=MAX_SILENCE_MS,
+                               min_value=0, max_value=2000, width=120, callback=detection_changed)
+            dpg.add_slider_int(label="Merge gap ms", tag="vad_merge_gap_ms", default_value=MERGE_GAP_MS,
+                               min_value=0, max_value=3000, width=120, callback=detection_changed)
+            dpg.add_slider_int(label="Min length ms", tag="vad_min_region_ms", default_value=MIN_REGION_MS,
+                               min_value=0, max_value=5000, width=120, callback=detection_changed)
+        with dpg.group(horizontal=True):
+            dpg.add_slider_int(label="Pre-roll ms", tag="vad_pre_roll_ms", default_value=PRE_ROLL_MS,
+                               min_value=0, max_value=1000, width=120, callback=detection_changed)
+            dpg.add_slider_int(label="Post-roll ms", tag="vad_post_roll_ms", default_value=POST_ROLL_MS,
+                               min_value=0, max_value=1000, width=120, callback=detection_changed)
+            dpg.add_slider_float(label="Max length s (0 = off)", tag="vad_max_region_s", default_value=MAX_REGION_MS / 1000.0,
+                                 min_value=0.0, max_value=60.0, format="%.1f", width=120, callback=detection_changed)
         
         dpg.add_separator()
         
         with dpg.group(horizontal=True):
             dpg.add_text("Voice Buffers:")
             dpg.add_button(label="Merge Selected", callback=merge_selected)
-            dpg.add_button(label="Undo Exclude", callback=undo_exclude)
+            dpg.add_button(label="Undo", tag="undo_button", callback=undo_edit)
+            dpg.add_button(label="Redo", tag="redo_button", callback=redo_edit)
+        
+        # Waveform of one whole file, scroll to zoom and drag to pan
+        with dpg.group(horizontal=True):
+            dpg.add_combo((), label="Waveform", tag="waveform_file", width=300, callback=select_waveform_file)
+            dpg.add_text("", tag="project_files")
+        with dpg.plot(tag="waveform_plot", height=140, width=-1, no_menus=True, no_box_select=True):
+            dpg.add_plot_axis(dpg.mvXAxis, tag="waveform_x", label="Time (s)")
+            with dpg.plot_axis(dpg.mvYAxis, tag="waveform_y", no_tick_labels=True, lock_min=True, lock_max=True):
+                dpg.add_shade_series([], [], y2=[], tag="waveform_regions", label="Buffers")
+                dpg.add_shade_series([], [], y2=[], tag="waveform_peaks", label="Audio")
+            dpg.set_axis_limits("waveform_y", -1.0, 1.0)
+        
+        with dpg.group(horizontal=True):
+            dpg.add_slider_float(tag="playback_position", label="Stopped", min_value=0.0, max_value=1.0,
+                                 format="%.1f s", width=400, callback=seek_playback)
+            dpg.add_button(label="Stop", callback=stop_playback)
         
         dpg.add_text("Use checkboxes to select buffers to merge, and 'Repeat' buttons to mark buffers for repetition:")
         with dpg.child_window(tag="buffer_window", height=300):
+            dpg.add_spacer(tag="buffer_list_top", height=0)
             dpg.add_group(tag="buffer_group")
+            dpg.add_spacer(tag="buffer_list_bottom", height=0)
         
         dpg.add_separator()
         
@@ -683,19 +1378,53 @@ def main():
         
         dpg.add_text("Output filename:")
         dpg.add_input_text(tag="output_file", default_value="output-processed.wav")
+        with dpg.group(horizontal=True):
+            dpg.add_combo(("WAV", "FLAC", "MP3", "Opus"), label="Format", tag="output_encoding", default_value="WAV",
+                          width=80, callback=output_encoding_changed)
+            dpg.add_combo([str(rate) for rate in OUTPUT_FRAME_RATES], label="Sample rate", tag="output_frame_rate",
+                          default_value=str(OUTPUT_FRAME_RATE), width=80)
+            dpg.add_combo(("Stereo", "Mono"), label="Channels", tag="output_channels", default_value="Stereo", width=80)
         
         dpg.add_separator()
         
         with dpg.group(horizontal=True):
             dpg.add_button(label="Process and Save", callback=process_and_save)
             dpg.add_button(label="Exit", callback=lambda: dpg.stop_dearpygui())
+        with dpg.group(horizontal=True):
+            dpg.add_progress_bar(tag="export_progress", default_value=0.0, width=400)
+            dpg.add_button(label="Cancel Export", callback=cancel_export)
         
         dpg.add_text("", tag="status")
+        
+        # Where the time goes, newest stage first
+        with dpg.collapsing_header(label="Diagnostics", default_open=False):
+            with dpg.group(horizontal=True):
+                dpg.add_checkbox(label="Profile next load or export", tag="profile_next", default_value=False)
+                dpg.add_text("", tag="profile_result")
+            with dpg.group(horizontal=True):
+                dpg.add_checkbox(label="JSON log", tag="diagnostics_log", default_value=False, callback=toggle_json_log)
+                dpg.add_input_text(tag="diagnostics_log_path", width=400,
+                                   default_value=os.path.join(os.getcwd(), "voice_buffer_log.jsonl"))
+            dpg.add_input_text(tag="diagnostics_text", multiline=True, readonly=True, width=-1, height=150)
+    
+    with dpg.handler_registry():
+        dpg.add_key_press_handler(dpg.mvKey_Z, callback=undo_shortcut)
+        dpg.add_key_press_handler(dpg.mvKey_Y, callback=undo_shortcut)
     
     dpg.show_viewport()
     dpg.set_primary_window("Primary Window", True)
-    dpg.start_dearpygui()
+    while dpg.is_dearpygui_running():
+        process_ui_updates()
+        show_visible_rows()  # Follow scrolling of the buffer list
+        update_waveform()
+        update_playback_position()
+        update_diagnostics()
+        update_undo_buttons()
+        dpg.render_dearpygui_frame()
+    if player is not None:
+        player.close()
     dpg.destroy_context()
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # Needed for the parallel VAD workers in the frozen executable
     main() 
\ No newline at end of file
@@ -7,7 +7,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=['pydub', 'webrtcvad', 'simpleaudio', 'numpy'],
+    hiddenimports=['pydub', 'webrtcvad', 'sounddevice', 'numpy'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
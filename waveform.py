@@ -0,0 +1,115 @@
+import numpy as np
+
+# Frames summarized by one min/max pair at the finest level
+PEAK_BLOCK = 256
+# Each coarser level has this many times fewer pairs than the one below it
+PEAK_FACTOR = 4
+# Levels stop once they are this short
+PEAK_MIN_LEVEL = 1024
+# Blocks scanned per step while building, bounds the memory used for it
+PEAK_CHUNK_BLOCKS = 1 << 14
+
+SAMPLE_DTYPES = {1: np.int8, 2: '<i2', 4: '<i4'}
+
+
+class PeakPyramid:
+    # Min/max envelope of a whole recording at several resolutions. Drawing any
+    # time range at any width only reduces the level whose blocks are just
+    # small enough, so it costs about the same for 3 seconds or 3 hours.
+    # Peaks are stored normalized to [-1, 1] over all channels.
+
+    def __init__(self, levels, frame_rate, frames):
+        self.levels = levels  # [(mins, maxs)] from finest to coarsest
+        self.frame_rate = frame_rate
+        self.frames = frames
+
+    @classmethod
+    def build(cls, source, progress=None):
+        # Scan the source once, a chunk at a time, reducing whole blocks with NumPy
+        data = memoryview(source.data).cast('B')
+        frames = source.frame_count()
+        blocks = -(-frames // PEAK_BLOCK)
+        dtype = SAMPLE_DTYPES[source.sample_width]
+        scale = float(1 << (8 * source.sample_width - 1))
+        mins = np.zeros(blocks, dtype=np.float32)
+        maxs = np.zeros(blocks, dtype=np.float32)
+
+        chunk_frames = PEAK_CHUNK_BLOCKS * PEAK_BLOCK
+        for first in range(0, frames, chunk_frames):
+            stop = min(frames, first + chunk_frames)
+            samples = np.frombuffer(data[first * source.frame_width:stop * source.frame_width], dtype=dtype)
+            full = (stop - first) // PEAK_BLOCK
+            block = first // PEAK_BLOCK
+            if full:
+                shaped = samples[:full * PEAK_BLOCK * source.channels].reshape(full, -1)
+                mins[block:block + full] = shaped.min(axis=1) / scale
+                maxs[block:block + full] = shaped.max(axis=1) / scale
+            if full * PEAK_BLOCK < stop - first:
+                # Partial block at the very end
+                tail = samples[full * PEAK_BLOCK * source.channels:]
+                mins[block + full] = tail.min() / scale
+                maxs[block + full] = tail.max() / scale
+            if progress is not None:
+                progress(stop / frames)
+
+        levels = [(mins, maxs)]
+        while len(levels[-1][0]) > PEAK_MIN_LEVEL:
+            mins, maxs = levels[-1]
+            starts = np.arange(0, len(mins), PEAK_FACTOR)
+            levels.append((np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)))
+        return cls(levels, source.frame_rate, frames)
+
+    def save(self, path):
+        arrays = {}
+        for i, (mins, maxs) in enumerate(self.levels):
+            arrays[f'min{i}'] = mins
+            arrays[f'max{i}'] = maxs
+        with open(path, 'wb') as f:
+            np.savez(f, frame_rate=self.frame_rate, frames=self.frames, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            count = sum(1 for name in data.files if name.startswith('min'))
+            levels = [(data[f'min{i}'], data[f'max{i}']) for i in range(count)]
+            return cls(levels, int(data['frame_rate']), int(data['frames']))
+
+    def duration(self):
+        return self.frames / self.frame_rate
+
+    def query(self, start_s, end_s, columns):
+        # (times, mins, maxs) with one min/max pair per column for [start_s, end_s)
+        first = int(max(0.0, start_s) * self.frame_rate)
+        stop = int(min(self.duration(), end_s) * self.frame_rate)
+        if stop <= first or columns <= 0:
+            empty = np.zeros(0, dtype=np.float32)
+            return empty, empty, empty
+
+        # Coarsest level that still has at least one block per column
+        level, block = 0, PEAK_BLOCK
+        while level + 1 < len(self.levels) and block * PEAK_FACTOR <= (stop - first) / columns:
+            level += 1
+            block *= PEAK_FACTOR
+        mins, maxs = self.levels[level]
+
+        # Blocks [starts, ends) overlap each column. reduceat stops at the next
+        # column's first block, which the column may share, so that one is added.
+        end = min(len(mins), -(-stop // block))
+        mins, maxs = mins[:end], maxs[:end]
+        edges = np.linspace(first, stop, columns + 1)
+        starts = np.minimum((edges[:-1] // block).astype(np.int64), end - 1)
+        last = np.minimum(np.ceil(edges[1:] / block).astype(np.int64), end) - 1
+        column_mins = np.minimum(np.minimum.reduceat(mins, starts), mins[last])
+        column_maxs = np.maximum(np.maximum.reduceat(maxs, starts), maxs[last])
+        return edges[:-1] / self.frame_rate, column_mins, column_maxs
+
+
+def region_mask(starts_ms, ends_ms, times):
+    # Which of the times (in seconds) fall inside any of the regions
+    if len(starts_ms) == 0:
+        return np.zeros(len(times), dtype=bool)
+    order = np.argsort(starts_ms)
+    starts = np.asarray(starts_ms)[order] / 1000.0
+    reach = np.maximum.accumulate(np.asarray(ends_ms)[order] / 1000.0)  # Regions may overlap after merges
+    index = np.searchsorted(starts, times, side='right') - 1
+    return (index >= 0) & (times < reach[np.maximum(index, 0)])